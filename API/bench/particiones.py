@@ -0,0 +1,144 @@
+"""
+Latencia de las queries calientes a medida que crece la historia de turnos.
+
+Arma el esquema (particionado con sql/002, o plano con --sin-particionar para
+comparar), carga la cola viva y luego agrega historia de a un año por paso,
+hacia atrás en el tiempo. En cada paso mide p50/p95 de las sentencias de
+queries.py que corren en cada request; con particiones deben quedar planas.
+
+Ejemplo (desde API/):
+    DB_NAME=turnos_plans python -m bench.particiones --pasos 4 --turnos-por-paso 2000000
+    DB_NAME=turnos_plans python -m bench.particiones --sin-particionar --out bench/plano.json
+
+Las escrituras se miden dentro de una transacción con ROLLBACK.
+"""
+
+import argparse
+import json
+import statistics
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+import psycopg2
+
+import queries as q
+from bench.query_plans import (
+    _ctx,
+    crear_esquema,
+    db_params,
+    insertar_cola,
+    insertar_historia,
+    vacuum_analyze,
+)
+
+HOT: List[Tuple[str, str, Callable[[Dict[str, Any]], Any]]] = [
+    ("turnos_en_curso", q.TURNOS_EN_CURSO, lambda c: (c["sid"],)),
+    ("turno_actual", q.TURNO_ACTUAL, lambda c: (c["sid"],)),
+    ("turno_activo_por_telefono", q.TURNO_ACTIVO_POR_TELEFONO, lambda c: (c["sid"], c["tel_activo"])),
+    (
+        "crear_turno_seguro",
+        q.CREAR_TURNO_SEGURO,
+        lambda c: (c["sid"], "Nuevo", 30, "+1 000-000-0000", 2),
+    ),
+    ("iniciar_turno", q.INICIAR_TURNO, lambda c: (c["espera_id"], c["sid"])),
+    ("finalizar_turno", q.FINALIZAR_TURNO, lambda c: (c["espera_id"], c["sid"])),
+    (
+        "estadisticas_por_fecha",
+        q.ESTADISTICAS_POR_FECHA,
+        lambda c: {"sucursal_id": c["sid"], "fecha": c["fecha"]},
+    ),
+]
+
+
+def medir(conn, sql: str, params: Any, n: int) -> Dict[str, float]:
+    cur = conn.cursor()
+    for _ in range(min(10, n)):  # caché de planes / buffers
+        cur.execute(sql, params)
+        conn.rollback()
+    lat = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        cur.execute(sql, params)
+        if cur.description:
+            cur.fetchall()
+        lat.append((time.perf_counter() - t0) * 1000.0)
+        conn.rollback()
+    lat.sort()
+    return {
+        "p50_ms": round(statistics.median(lat), 3),
+        "p95_ms": round(lat[int(0.95 * (len(lat) - 1))], 3),
+    }
+
+
+def tamano_turnos(conn) -> Tuple[int, int]:
+    cur = conn.cursor()
+    cur.execute("SELECT count(*) FROM turnos")
+    filas = cur.fetchone()[0]
+    # el tamaño del padre particionado es 0: sumar las hojas
+    cur.execute(
+        """
+        SELECT COALESCE(sum(pg_total_relation_size(relid)), 0)
+        FROM pg_partition_tree('turnos') WHERE isleaf
+        """
+    )
+    bytes_ = cur.fetchone()[0]
+    conn.rollback()
+    return filas, int(bytes_)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Latencia de queries calientes vs. tamaño de la historia")
+    ap.add_argument("--sin-particionar", action="store_true", help="tabla plana (001) para comparar")
+    ap.add_argument("--pasos", type=int, default=4, help="años de historia a agregar, uno por paso")
+    ap.add_argument("--turnos-por-paso", type=int, default=1_000_000)
+    ap.add_argument("--sucursales", type=int, default=40)
+    ap.add_argument("--activos", type=int, default=25)
+    ap.add_argument("--repeticiones", type=int, default=200)
+    ap.add_argument("--out", help="guardar resultados como JSON")
+    args = ap.parse_args()
+
+    particionado = not args.sin_particionar
+    conn = psycopg2.connect(**db_params())
+    pasos = []
+    try:
+        crear_esquema(conn, args.sucursales, particionado, years=args.pasos + 1)
+        insertar_cola(conn, args.sucursales, args.activos)
+
+        for paso in range(args.pasos + 1):
+            if paso:
+                desde = 365 * (paso - 1)
+                insertar_historia(conn, args.turnos_por_paso, args.sucursales, 365, desde_dias=desde)
+            vacuum_analyze(conn)
+
+            ctx = _ctx(conn)
+            conn.rollback()
+            filas, bytes_ = tamano_turnos(conn)
+            res = {
+                "historia_anios": paso,
+                "filas": filas,
+                "mb": round(bytes_ / 2 ** 20, 1),
+                "queries": {name: medir(conn, sql, params(ctx), args.repeticiones)
+                            for name, sql, params in HOT},
+            }
+            pasos.append(res)
+            print(f"paso {paso}: {filas} filas, {res['mb']} MB", flush=True)
+    finally:
+        conn.close()
+
+    names = [h[0] for h in HOT]
+    print(f"\n{'p50 ms':<28}" + "".join(f"{p['historia_anios']:>9}a" for p in pasos) + "   último/primero")
+    for name in names:
+        vals = [p["queries"][name]["p50_ms"] for p in pasos]
+        ratio = vals[-1] / vals[0] if vals[0] else float("nan")
+        print(f"{name:<28}" + "".join(f"{v:>10.3f}" for v in vals) + f"   x{ratio:.2f}")
+
+    if args.out:
+        Path(args.out).write_text(
+            json.dumps({"particionado": particionado, "pasos": pasos}, indent=2, ensure_ascii=False) + "\n",
+            encoding="utf-8",
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+"""
+Regresiones de plan de las queries de producción (queries.py) sobre un
+dataset grande y sintético de turnos.
+
+1) --seed: crea el esquema en una base de pruebas y genera millones de turnos
+   finalizados repartidos en varios años y sucursales, más una cola viva por sucursal.
+   Con --particionado aplica además sql/002 (turnos particionada por mes).
+2) Para cada query corre EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) y valida:
+     - forma del plan (nodos prohibidos / índices esperados)
+     - presupuesto de buffers (shared hit + read) y de tiempo
+3) Imprime una tabla y, con --baseline, el delta contra una corrida anterior.
+
+Ejemplo (desde API/):
+    DB_NAME=turnos_plans python -m bench.query_plans --seed --turnos 5000000
+    DB_NAME=turnos_plans python -m bench.query_plans --out bench/plans.json
+    DB_NAME=turnos_plans python -m bench.query_plans --baseline bench/plans.json
+
+Sale con código 1 si alguna query viola su presupuesto o su forma.
+Las sentencias de escritura se ejecutan dentro de una transacción con ROLLBACK.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import psycopg2
+
+import queries as q
+
+API_DIR = Path(__file__).resolve().parent.parent
+SCHEMA_SQL = API_DIR / "sql" / "001_schema.sql"
+PARTICIONADO_SQL = API_DIR / "sql" / "002_turnos_particionado.sql"
+ACTIVOS_SQL = API_DIR / "sql" / "003_turnos_activos_idempotencia.sql"
+CONSULTORIOS_SQL = API_DIR / "sql" / "004_consultorios.sql"
+
+
+def db_params() -> dict:
+    return {
+        "dbname": os.getenv("DB_NAME", "turnos_plans"),
+        "user": os.getenv("DB_USER", "postgres"),
+        "password": os.getenv("DB_PASSWORD", "123"),
+        "host": os.getenv("DB_HOST", "localhost"),
+        "port": os.getenv("DB_PORT", "5432"),
+    }
+
+
+# =======================
+# Seed
+# =======================
+
+def crear_esquema(conn, n_sucursales: int, particionado: bool = False, years: int = 3) -> None:
+    """Recrea sucursales/turnos vacías (001 + 003 + 004); con particionado aplica sql/002 y crea los meses de `years` años."""
+    cur = conn.cursor()
+    cur.execute("DROP TABLE IF EXISTS idempotency_keys, turnos_activos, consultorios CASCADE")
+    cur.execute("DROP TABLE IF EXISTS turnos_legacy CASCADE")
+    cur.execute("DROP TABLE IF EXISTS turnos CASCADE")
+    cur.execute("DROP TABLE IF EXISTS sucursales CASCADE")
+    cur.execute(SCHEMA_SQL.read_text(encoding="utf-8"))
+    if particionado:
+        cur.execute(PARTICIONADO_SQL.read_text(encoding="utf-8"))
+        cur.execute("DROP TABLE turnos_legacy")
+        asegurar_particiones(conn, years * 365)
+    cur.execute(ACTIVOS_SQL.read_text(encoding="utf-8"))
+    cur.execute(CONSULTORIOS_SQL.read_text(encoding="utf-8"))
+    cur.execute(
+        """
+        INSERT INTO sucursales (id, nombre, doctor_nombre, username, password_hash)
+        SELECT g, 'Sucursal ' || g, 'Dr. ' || g, 'sucursal' || g, 'x'
+        FROM generate_series(1, %s) g
+        """,
+        (n_sucursales,),
+    )
+    cur.execute("SELECT setval('sucursales_id_seq', %s)", (n_sucursales,))
+    conn.commit()
+
+
+def asegurar_particiones(conn, dias_atras: int) -> None:
+    conn.cursor().execute(
+        "SELECT turnos_asegurar_particiones((NOW() - make_interval(days => %s))::date, (NOW() + interval '3 months')::date)",
+        (dias_atras,),
+    )
+
+
+def insertar_historia(conn, n_turnos: int, n_sucursales: int, dias: int, desde_dias: int = 0) -> None:
+    """Finalizados repartidos uniformemente entre hace desde_dias+1 y desde_dias+dias días."""
+    conn.cursor().execute(
+        """
+        INSERT INTO turnos (sucursal_id, nombre, edad, telefono, estado,
+                            created_at, inicio_atencion, updated_at)
+        SELECT
+            1 + (g %% %(suc)s),
+            'Paciente ' || g,
+            1 + (g %% 90),
+            '+1 809-' || lpad(((g / 10000) %% 1000)::text, 3, '0') || '-' || lpad((g %% 10000)::text, 4, '0'),
+            'finalizado',
+            ts,
+            ts + make_interval(mins => 5 + (g %% 40)),
+            ts + make_interval(mins => 15 + (g %% 40))
+        FROM (
+            SELECT g,
+                   date_trunc('day', NOW() - make_interval(days => 1 + %(desde)s + (g %% %(dias)s)))
+                     + make_interval(hours => 8 + (g %% 10), mins => g %% 60) AS ts
+            FROM generate_series(1, %(n)s) g
+        ) s
+        """,
+        {"suc": n_sucursales, "dias": dias, "desde": desde_dias, "n": n_turnos},
+    )
+    conn.commit()
+
+
+def insertar_cola(conn, n_sucursales: int, activos_por_sucursal: int) -> None:
+    """Cola viva de hoy: uno atendiendo por sucursal, el resto en espera."""
+    conn.cursor().execute(
+        """
+        INSERT INTO turnos (sucursal_id, nombre, edad, telefono, estado, created_at, inicio_atencion)
+        SELECT
+            s,
+            'Activo ' || s || '-' || k,
+            30,
+            '+1 829-' || lpad(s::text, 3, '0') || '-' || lpad(k::text, 4, '0'),
+            CASE WHEN k = 1 THEN 'atendiendo' ELSE 'espera' END,
+            date_trunc('day', NOW()) + make_interval(hours => 8, mins => k),
+            CASE WHEN k = 1 THEN NOW() END
+        FROM generate_series(1, %s) s, generate_series(1, %s) k
+        """,
+        (n_sucursales, activos_por_sucursal),
+    )
+    conn.commit()
+
+
+def vacuum_analyze(conn) -> None:
+    old_isolation = conn.isolation_level
+    conn.set_isolation_level(0)  # VACUUM no corre dentro de transacción
+    try:
+        conn.cursor().execute("VACUUM ANALYZE turnos")
+        conn.cursor().execute("VACUUM ANALYZE sucursales")
+    finally:
+        conn.set_isolation_level(old_isolation)
+
+
+def seed(conn, n_turnos: int, n_sucursales: int, years: int, activos_por_sucursal: int,
+         particionado: bool = False) -> None:
+    crear_esquema(conn, n_sucursales, particionado, years)
+    insertar_historia(conn, n_turnos, n_sucursales, 365 * years)
+    insertar_cola(conn, n_sucursales, activos_por_sucursal)
+    vacuum_analyze(conn)
+
+
+# =======================
+# Casos
+# =======================
+
+@dataclass
+class Case:
+    name: str
+    sql: str
+    params: Callable[[Any], Any]
+    write: bool = False
+    # ningún nodo de estos tipos sobre `turnos` o sus particiones (p.ej. "Seq Scan")
+    forbid_on_turnos: Tuple[str, ...] = ("Seq Scan",)
+    # al menos uno de estos índices (o su equivalente por partición) debe aparecer en el plan
+    expect_index: Tuple[str, ...] = ()
+    # particiones recorridas como máximo (ventana de activos: 2 meses + turnos_default)
+    max_particiones: int = 3
+    max_buffers: int = 1000
+    max_ms: float = 50.0
+    notes: str = ""
+
+
+def _one(conn, sql: str, params=()) -> Any:
+    cur = conn.cursor()
+    cur.execute(sql, params)
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _busy_sucursal(conn) -> int:
+    return _one(conn, "SELECT sucursal_id FROM turnos WHERE estado='espera' GROUP BY 1 ORDER BY count(*) DESC LIMIT 1")
+
+
+def _ctx(conn) -> Dict[str, Any]:
+    sid = _busy_sucursal(conn)
+    return {
+        "sid": sid,
+        "espera_id": _one(conn, "SELECT id FROM turnos WHERE sucursal_id=%s AND estado='espera' ORDER BY created_at LIMIT 1", (sid,)),
+        "tel_activo": _one(conn, "SELECT telefono FROM turnos WHERE sucursal_id=%s AND estado='espera' LIMIT 1", (sid,)),
+        # un día con historia completa (hace ~30 días)
+        "fecha": _one(conn, "SELECT (NOW() - interval '30 days')::date::text"),
+        # 12 semanas que terminan en esa fecha (default de /estadisticas/{id}/heatmap)
+        "desde_12s": _one(conn, "SELECT (NOW() - interval '113 days')::date::text"),
+    }
+
+
+ACTIVE_IDX = ("turnos_activos_idx", "turnos_activos_telefono_idx", "turnos_espera_prioridad_idx")
+
+CASES: List[Case] = [
+    Case(
+        "turno_actual", q.TURNO_ACTUAL, lambda c: (c["sid"],),
+        expect_index=ACTIVE_IDX, max_buffers=50, max_ms=5,
+    ),
+    Case(
+        "turnos_en_curso", q.TURNOS_EN_CURSO, lambda c: (c["sid"],),
+        expect_index=ACTIVE_IDX, max_buffers=200, max_ms=10,
+    ),
+    Case(
+        "turno_activo_por_telefono", q.TURNO_ACTIVO_POR_TELEFONO, lambda c: (c["sid"], c["tel_activo"]),
+        expect_index=ACTIVE_IDX, max_buffers=50, max_ms=5,
+    ),
+    Case(
+        "turno_activo_por_nombre", q.TURNO_ACTIVO_POR_NOMBRE, lambda c: (c["sid"], "Activo x"),
+        expect_index=ACTIVE_IDX, max_buffers=200, max_ms=10,
+    ),
+    # El duplicado ya no se puede medir con EXPLAIN ANALYZE: el trigger de
+    # turnos_activos aborta el INSERT con unique_violation.
+    Case(
+        "crear_turno_seguro (nuevo)", q.CREAR_TURNO_SEGURO,
+        lambda c: (c["sid"], "Nuevo", 30, "+1 000-000-0000", 2),
+        write=True, max_buffers=200, max_ms=15,
+    ),
+    Case(
+        "iniciar_turno", q.INICIAR_TURNO, lambda c: (c["espera_id"], c["sid"]),
+        write=True, expect_index=("turnos_pkey",), max_buffers=100, max_ms=10,
+    ),
+    Case(
+        "dispatch_espera", q.DISPATCH_ESPERA, lambda c: (c["sid"],),
+        expect_index=ACTIVE_IDX, max_buffers=200, max_ms=10,
+    ),
+    Case(
+        "reclamar_turno", q.RECLAMAR_TURNO,
+        lambda c: {"sucursal_id": c["sid"], "numero": 1, "turno_id": c["espera_id"]},
+        write=True, expect_index=("turnos_pkey",), max_buffers=100, max_ms=10,
+    ),
+    Case(
+        "finalizar_turno", q.FINALIZAR_TURNO, lambda c: (c["espera_id"], c["sid"]),
+        write=True, expect_index=("turnos_pkey",), max_buffers=100, max_ms=10,
+    ),
+    Case(
+        "estadisticas_por_fecha", q.ESTADISTICAS_POR_FECHA,
+        lambda c: {"sucursal_id": c["sid"], "fecha": c["fecha"]},
+        expect_index=("turnos_sucursal_created_idx",), max_buffers=2000, max_ms=50,
+    ),
+    Case(
+        "heatmap_columnas", q.HEATMAP_COLUMNAS,
+        lambda c: {"sucursal_id": c["sid"], "desde": c["desde_12s"], "hasta": c["fecha"]},
+        expect_index=("turnos_sucursal_created_idx",), max_particiones=5, max_buffers=50000, max_ms=500,
+        notes="una fila de arrays; el cálculo va en NumPy y se cachea por rango",
+    ),
+]
+
+
+# =======================
+# Plan
+# =======================
+
+@dataclass
+class Result:
+    name: str
+    ms: float
+    buffers: int
+    nodes: List[str]
+    indexes: List[str]
+    particiones: int = 0
+    failures: List[str] = field(default_factory=list)
+
+    def to_json(self) -> dict:
+        return {
+            "ms": round(self.ms, 3),
+            "buffers": self.buffers,
+            "nodes": self.nodes,
+            "indexes": self.indexes,
+            "particiones": self.particiones,
+            "failures": self.failures,
+        }
+
+
+_PARTICION_RE = re.compile(r"^turnos_(?:y\d{4}m\d{2}|default)(?=_|$)")
+
+
+def _es_turnos(rel: Optional[str]) -> bool:
+    return rel == "turnos" or bool(rel and _PARTICION_RE.match(rel))
+
+
+def _indice_padre(idx: str) -> str:
+    """turnos_y2026m03_activos_idx -> turnos_activos_idx"""
+    return _PARTICION_RE.sub("turnos", idx)
+
+
+def _walk(plan: dict, out: List[dict]) -> None:
+    out.append(plan)
+    for child in plan.get("Plans", []) or []:
+        _walk(child, out)
+
+
+def explain(conn, case: Case, ctx: Dict[str, Any]) -> Result:
+    cur = conn.cursor()
+    try:
+        cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + case.sql, case.params(ctx))
+        doc = cur.fetchone()[0][0]
+    finally:
+        # escrituras (y cualquier lectura) no dejan rastro
+        conn.rollback()
+
+    root = doc["Plan"]
+    nodes: List[dict] = []
+    _walk(root, nodes)
+
+    buffers = int(root.get("Shared Hit Blocks", 0)) + int(root.get("Shared Read Blocks", 0))
+    ms = float(doc.get("Execution Time", 0.0))
+    node_desc = []
+    indexes = []
+    particiones = set()
+    for n in nodes:
+        rel = n.get("Relation Name")
+        idx = n.get("Index Name")
+        node_desc.append(n["Node Type"] + (f" on {rel}" if rel else "") + (f" using {idx}" if idx else ""))
+        if idx:
+            indexes.append(_indice_padre(idx))
+        # las podadas en ejecución aparecen con "never executed" (Actual Loops = 0)
+        if rel and rel != "turnos" and _es_turnos(rel) and n.get("Actual Loops", 1):
+            particiones.add(rel)
+
+    res = Result(case.name, ms, buffers, node_desc, sorted(set(indexes)), len(particiones))
+
+    for n in nodes:
+        if _es_turnos(n.get("Relation Name")) and n["Node Type"] in case.forbid_on_turnos:
+            res.failures.append(f"{n['Node Type']} sobre {n['Relation Name']}")
+    if len(particiones) > case.max_particiones:
+        res.failures.append(f"recorre {len(particiones)} particiones > {case.max_particiones}")
+    if case.expect_index and not set(case.expect_index) & set(indexes):
+        res.failures.append(f"no usa ninguno de {list(case.expect_index)}")
+    if buffers > case.max_buffers:
+        res.failures.append(f"buffers {buffers} > {case.max_buffers}")
+    if ms > case.max_ms:
+        res.failures.append(f"{ms:.1f} ms > {case.max_ms} ms")
+    return res
+
+
+def report(results: List[Result], baseline: Optional[dict]) -> None:
+    print(f"{'query':<32} {'ms':>9} {'buffers':>9} {'Δbuf':>8}  estado")
+    for r in results:
+        delta = ""
+        if baseline and r.name in baseline.get("queries", {}):
+            b = baseline["queries"][r.name]["buffers"]
+            if b:
+                delta = f"{(r.buffers - b) / b:+.0%}"
+        estado = "OK" if not r.failures else "FALLA: " + "; ".join(r.failures)
+        print(f"{r.name:<32} {r.ms:>9.2f} {r.buffers:>9} {delta:>8}  {estado}")
+
+        if baseline and r.name in baseline.get("queries", {}):
+            old_nodes = baseline["queries"][r.name]["nodes"]
+            if old_nodes != r.nodes:
+                print("    plan cambió:")
+                for line in old_nodes:
+                    if line not in r.nodes:
+                        print(f"      - {line}")
+                for line in r.nodes:
+                    if line not in old_nodes:
+                        print(f"      + {line}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Suite de regresión de planes de queries")
+    ap.add_argument("--seed", action="store_true", help="recrea y llena la base (¡borra datos!)")
+    ap.add_argument("--turnos", type=int, default=3_000_000)
+    ap.add_argument("--sucursales", type=int, default=40)
+    ap.add_argument("--years", type=int, default=3)
+    ap.add_argument("--activos", type=int, default=25, help="turnos activos por sucursal")
+    ap.add_argument("--particionado", action="store_true", help="con --seed: turnos particionada por mes (sql/002)")
+    ap.add_argument("--only", help="correr solo las queries que contengan este texto")
+    ap.add_argument("--baseline", help="JSON de una corrida anterior para mostrar deltas")
+    ap.add_argument("--out", help="guardar resultados como JSON")
+    ap.add_argument("--budget-scale", type=float, default=1.0, help="multiplica los presupuestos de tiempo (máquinas lentas)")
+    args = ap.parse_args()
+
+    conn = psycopg2.connect(**db_params())
+    try:
+        if args.seed:
+            t0 = time.perf_counter()
+            seed(conn, args.turnos, args.sucursales, args.years, args.activos, args.particionado)
+            print(f"seed: {args.turnos} turnos en {time.perf_counter() - t0:.1f}s")
+
+        ctx = _ctx(conn)
+        conn.rollback()
+
+        results = []
+        for case in CASES:
+            if args.only and args.only not in case.name:
+                continue
+            case.max_ms *= args.budget_scale
+            results.append(explain(conn, case, ctx))
+    finally:
+        conn.close()
+
+    baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8")) if args.baseline else None
+    report(results, baseline)
+
+    if args.out:
+        Path(args.out).write_text(
+            json.dumps({"queries": {r.name: r.to_json() for r in results}}, indent=2, ensure_ascii=False) + "\n",
+            encoding="utf-8",
+        )
+
+    if any(r.failures for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
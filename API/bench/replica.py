@@ -0,0 +1,116 @@
+"""
+Chequeo de la réplica de lectura con dos Postgres locales.
+
+Con el primario en DB_WRITE_DSN (o DB_*) y la réplica en DB_READ_DSN:
+  1) mide el lag como lo hace ReadRouter y muestra a dónde irían las lecturas;
+  2) escribe N filas en el primario y mide cuánto tardan en verse en la réplica;
+  3) fuerza el umbral a -1 y verifica que las lecturas caen al primario.
+
+Ejemplo (desde API/, réplica por streaming en el 5433; ver services/db.py):
+    DB_READ_DSN="host=localhost port=5433 dbname=turnos_db user=postgres password=123" \\
+        DB_NAME=turnos_db python -m bench.replica --escrituras 200
+
+Usa una tabla propia (replica_probe) que se borra al terminar.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from bench.query_plans import db_params
+from services import db
+
+
+def _primary_params() -> dict:
+    dsn = os.getenv("DB_WRITE_DSN")
+    return {"dsn": dsn} if dsn else db_params()
+
+
+def _en_replica(router: db.ReadRouter) -> bool:
+    conn = router.getconn_read()
+    try:
+        cur = conn.raw.cursor()
+        cur.execute("SELECT pg_is_in_recovery()")
+        return bool(cur.fetchone()[0])
+    finally:
+        conn.close()
+
+
+def visibilidad(primary: db.ConnectionPool, replica: db.ConnectionPool, n: int, timeout_s: float) -> list:
+    p = primary.getconn()
+    r = replica.getconn()
+    lat = []
+    try:
+        pc = p.raw.cursor()
+        pc.execute("CREATE TABLE IF NOT EXISTS replica_probe (id BIGSERIAL PRIMARY KEY, ts TIMESTAMPTZ DEFAULT NOW())")
+        p.commit()
+        r.raw.autocommit = True  # cada SELECT con snapshot nuevo
+        rc = r.raw.cursor()
+        for _ in range(n):
+            pc.execute("INSERT INTO replica_probe DEFAULT VALUES RETURNING id")
+            rid = pc.fetchone()[0]
+            p.commit()
+            t0 = time.perf_counter()
+            while True:
+                try:
+                    rc.execute("SELECT 1 FROM replica_probe WHERE id = %s", (rid,))
+                    if rc.fetchone():
+                        break
+                except Exception:
+                    pass  # la tabla todavía no llegó a la réplica
+                if time.perf_counter() - t0 > timeout_s:
+                    raise RuntimeError(f"la fila {rid} no apareció en la réplica tras {timeout_s}s")
+                time.sleep(0.001)
+            lat.append((time.perf_counter() - t0) * 1000.0)
+    finally:
+        try:
+            pc.execute("DROP TABLE IF EXISTS replica_probe")
+            p.commit()
+        finally:
+            r.raw.autocommit = False
+            p.close()
+            r.close()
+    return lat
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--escrituras", type=int, default=100)
+    ap.add_argument("--timeout", type=float, default=10.0, help="segundos máx. para ver cada fila")
+    args = ap.parse_args()
+
+    read_dsn = os.getenv("DB_READ_DSN")
+    if not read_dsn:
+        print("Falta DB_READ_DSN (DSN libpq de la réplica)", file=sys.stderr)
+        return 2
+
+    primary = db.ConnectionPool(_primary_params(), maxconn=4, timeout_s=5)
+    replica = db.ConnectionPool({"dsn": read_dsn}, maxconn=4, timeout_s=5)
+    router = db.ReadRouter(primary, replica)
+    try:
+        lag = router.check_lag()
+        if lag is None:
+            print(f"réplica no disponible: {router.last_error}")
+            return 1
+        print(f"lag: {lag:.3f}s (umbral {router.max_lag_s}s) -> lecturas a "
+              f"{'réplica' if _en_replica(router) else 'primario'}")
+
+        lat = sorted(visibilidad(primary, replica, args.escrituras, args.timeout))
+        print(f"visibilidad de escrituras en la réplica ({len(lat)}): "
+              f"p50={statistics.median(lat):.1f}ms "
+              f"p95={lat[min(len(lat) - 1, int(0.95 * len(lat)))]:.1f}ms max={lat[-1]:.1f}ms")
+
+        router.max_lag_s = -1.0
+        router.check_lag()
+        fallback = not _en_replica(router)
+        print(f"umbral -1s -> lecturas a {'primario (ok)' if fallback else 'réplica (MAL)'}")
+        return 0 if fallback else 1
+    finally:
+        primary.closeall()
+        replica.closeall()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
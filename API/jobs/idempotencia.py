@@ -0,0 +1,52 @@
+"""
+Borra las respuestas de Idempotency-Key vencidas (sql/003).
+
+Desde API/, una vez por día junto a jobs.particiones:
+    python -m jobs.idempotencia
+"""
+
+import logging
+
+import psycopg2
+
+from jobs.particiones import db_params
+from services.idempotency import TTL_S
+
+log = logging.getLogger("jobs.idempotencia")
+
+BATCH = 10_000
+
+
+def purgar(conn, ttl_s: int = TTL_S) -> int:
+    """Borra en lotes para no tener un DELETE largo bloqueando vacuum."""
+    total = 0
+    cur = conn.cursor()
+    while True:
+        cur.execute(
+            """
+            DELETE FROM idempotency_keys
+            WHERE ctid IN (
+                SELECT ctid FROM idempotency_keys
+                WHERE created_at < NOW() - make_interval(secs => %s)
+                LIMIT %s
+            )
+            """,
+            (ttl_s, BATCH),
+        )
+        conn.commit()
+        total += cur.rowcount
+        if cur.rowcount < BATCH:
+            return total
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    conn = psycopg2.connect(**db_params())
+    try:
+        log.info("Idempotency-Keys vencidas borradas: %s", purgar(conn))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
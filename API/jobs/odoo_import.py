@@ -0,0 +1,341 @@
+"""
+Importación masiva de pacientes a Odoo (res.partner) al dar de alta una clínica.
+
+/odoo/clientes/seleccionar-o-crear hace hasta 6 search_read + create + read, y
+un authenticate() antes de cada uno, por paciente. Acá, por lote de
+ODOO_IMPORT_LOTE pacientes:
+  1 search_read (phone IN variantes OR mobile IN variantes),
+  1 create multi-registro con los que no existen,
+  1 write por grupo de vals idénticos (solo con --actualizar),
+con un solo authenticate() para toda la corrida.
+
+- Teléfonos normalizados con phone_store_pretty_plus1 y deduplicados por dígitos
+  antes de hablar con Odoo (gana la primera fila). Filas sin teléfono válido se
+  omiten: sin teléfono no hay con qué detectar duplicados, que las cargue
+  /odoo/clientes/seleccionar-o-crear (avisa por nombre).
+- Un partner existe si su phone o mobile, normalizado igual, da los mismos
+  dígitos. La búsqueda es por igualdad sobre las variantes de formato más
+  comunes (+1 829-993-4714, 8299934714, (829) 993-4714, ...): un formato raro en
+  Odoo no se detecta y ese paciente se crea de nuevo.
+- Reanudable: el estado (con una huella de la entrada) se guarda después de
+  cada lote. Si se corta a mitad de un lote, al reanudar ese lote se vuelve a
+  buscar y los ya creados aparecen como existentes: no se duplican.
+
+Desde API/ (CSV con columnas nombre,apellido,edad,telefono o JSON con una lista
+de objetos con esas claves):
+    python -m jobs.odoo_import pacientes.csv
+    python -m jobs.odoo_import pacientes.json --lote 200 --actualizar
+    python -m jobs.odoo_import pacientes.csv --checkpoint import.json   # reanuda si existe
+
+También como API: POST /odoo/clientes/importar (ver routers/odoo_customers.py).
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from routers.odoo_customers import phone_digits, phone_store_pretty_plus1
+from services import metrics
+
+log = logging.getLogger("jobs.odoo_import")
+
+LOTE = int(os.getenv("ODOO_IMPORT_LOTE", "200"))
+MAX_ERRORES = 200  # detalle guardado en el estado; el contador sigue sumando
+
+IMPORT_PARTNERS = metrics.counter(
+    "turnos_odoo_import_partners_total",
+    "Pacientes procesados por la importación masiva a Odoo, por resultado",
+    ("resultado",),
+)
+
+
+# =======================
+# Normalización
+# =======================
+
+def clave(raw: Optional[str]) -> Optional[str]:
+    """Dígitos del teléfono tal como quedaría guardado: 8299934714 y +1 (829) 993-4714 dan lo mismo."""
+    return phone_digits(phone_store_pretty_plus1(raw))
+
+
+def variantes(tel_store: str) -> List[str]:
+    """Formatos exactos con los que el mismo número puede estar guardado en Odoo."""
+    d = phone_digits(tel_store) or ""
+    out = [tel_store, d, f"+{d}"]
+    if len(d) == 11 and d.startswith("1"):
+        d10 = d[1:]
+        a, b, c = d10[0:3], d10[3:6], d10[6:10]
+        out += [d10, f"{a}-{b}-{c}", f"({a}) {b}-{c}", f"+1 ({a}) {b}-{c}", f"1-{a}-{b}-{c}", f"{a} {b} {c}"]
+    return list(dict.fromkeys(out))
+
+
+def preparar(filas: Iterable[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Devuelve (únicos, omitidos). Cada único lleva su teléfono normalizado y la
+    clave de dígitos; los omitidos, el número de fila (desde 1) y el motivo.
+    """
+    unicos: List[Dict[str, Any]] = []
+    omitidos: List[Dict[str, Any]] = []
+    vistos: Dict[str, int] = {}
+    for n, fila in enumerate(filas, start=1):
+        nombre = str(fila.get("nombre") or "").strip()
+        apellido = str(fila.get("apellido") or "").strip()
+        tel_store = phone_store_pretty_plus1(str(fila.get("telefono") or ""))
+        k = phone_digits(tel_store)
+        if not k or len(k) < 10:
+            omitidos.append({"fila": n, "motivo": "sin teléfono válido"})
+            continue
+        if k in vistos:
+            omitidos.append({"fila": n, "motivo": f"teléfono repetido (fila {vistos[k]})"})
+            continue
+        vistos[k] = n
+        edad = fila.get("edad")
+        try:
+            edad = int(edad) if edad not in (None, "") else None
+        except (TypeError, ValueError):
+            edad = None
+        unicos.append({
+            "fila": n,
+            "clave": k,
+            "nombre": f"{nombre} {apellido}".strip() or "Cliente sin nombre",
+            "telefono": tel_store,
+            "edad": edad,
+        })
+    return unicos, omitidos
+
+
+def huella(unicos: List[Dict[str, Any]]) -> str:
+    """Identifica la entrada ya normalizada: un checkpoint solo sirve para la misma lista."""
+    h = hashlib.sha256()
+    for u in unicos:
+        h.update(f"{u['clave']}\t{u['nombre']}\n".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def vals_partner(u: Dict[str, Any]) -> Dict[str, Any]:
+    """Mismos campos que OdooClient.create_partner."""
+    vals: Dict[str, Any] = {"name": u["nombre"], "phone": u["telefono"], "mobile": u["telefono"]}
+    if u.get("edad") is not None:
+        # Odoo estándar no trae edad: se guarda en notas
+        vals["comment"] = f"Edad: {u['edad']}"
+    return vals
+
+
+# =======================
+# Corrida
+# =======================
+
+class Importacion:
+    """
+    Una corrida sobre una lista ya preparada. `estado` es JSON-serializable:
+    es lo que se guarda como checkpoint y lo que devuelve la API como progreso.
+    """
+
+    def __init__(
+        self,
+        client,
+        filas: Iterable[Dict[str, Any]],
+        actualizar: bool = False,
+        lote: int = LOTE,
+        estado: Optional[Dict[str, Any]] = None,
+        on_progreso: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ):
+        self.client = client
+        self.unicos, omitidos = preparar(filas)
+        self.actualizar = actualizar
+        self.lote = max(1, int(lote))
+        self.on_progreso = on_progreso
+        h = huella(self.unicos)
+        if estado is not None:
+            if estado.get("huella") != h:
+                raise ValueError("El checkpoint es de otra lista de pacientes (huella distinta)")
+            self.estado = estado
+        else:
+            self.estado = {
+                "huella": h,
+                "estado": "pendiente",
+                "filas": len(self.unicos) + len(omitidos),
+                "total": len(self.unicos),
+                "procesados": 0,
+                "creados": 0,
+                "existentes": 0,
+                "actualizados": 0,
+                "omitidos": len(omitidos),
+                "errores": 0,
+                "detalle_omitidos": omitidos[:MAX_ERRORES],
+                "detalle_errores": [],
+                "lotes": 0,
+                "duracion_s": 0.0,
+                "ultimo_error": None,
+            }
+
+    def _existentes(self, items: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        terms = [t for u in items for t in variantes(u["telefono"])]
+        por_clave: Dict[str, Dict[str, Any]] = {}
+        for p in self.client.search_partners_by_phones(terms):
+            formateado = bool(p.get("phone")) and p["phone"] == phone_store_pretty_plus1(p["phone"])
+            for campo in ("phone", "mobile"):
+                k = clave(p.get(campo))
+                # Si hay varios partners con el número, gana el que ya tiene el formato guardado
+                if k and (k not in por_clave or formateado):
+                    por_clave[k] = p
+        return por_clave
+
+    def _crear(self, items: List[Dict[str, Any]], errores: List[Dict[str, Any]]) -> int:
+        """Devuelve cuántos se crearon; los rechazados por Odoo van a `errores`."""
+        if not items:
+            return 0
+        try:
+            self.client.create_partners([vals_partner(u) for u in items])
+            return len(items)
+        except RuntimeError as e:
+            if len(items) == 1:
+                raise
+            lote_error = e
+        # Un registro inválido hace fallar todo el create: de a uno para aislarlo.
+        # Tras un timeout Odoo pudo haber commiteado el lote: se vuelve a buscar
+        # antes, para no duplicar los que ya entraron.
+        log.warning("create del lote falló (%s); reintentando de a uno", lote_error)
+        ya = self._existentes(items)
+        pendientes = [u for u in items if u["clave"] not in ya]
+        rechazados = []
+        for u in pendientes:
+            try:
+                self.client.create_partners([vals_partner(u)])
+            except RuntimeError as e:
+                rechazados.append({"fila": u["fila"], "telefono": u["telefono"], "motivo": str(e)})
+        if len(rechazados) == len(items):
+            # Nada entró: Odoo caído más que datos malos. Se corta y se reanuda desde este lote.
+            raise lote_error
+        errores.extend(rechazados)
+        return len(items) - len(rechazados)
+
+    def _lote(self, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        por_clave = self._existentes(items)
+        nuevos: List[Dict[str, Any]] = []
+        existentes = 0
+        writes: Dict[str, Tuple[Dict[str, Any], List[int]]] = {}
+        for u in items:
+            p = por_clave.get(u["clave"])
+            if p is None:
+                nuevos.append(u)
+                continue
+            existentes += 1
+            if self.actualizar and (p.get("phone") != u["telefono"] or p.get("mobile") != u["telefono"]):
+                vals = {"phone": u["telefono"], "mobile": u["telefono"]}
+                writes.setdefault(json.dumps(vals, sort_keys=True), (vals, []))[1].append(int(p["id"]))
+
+        errores: List[Dict[str, Any]] = []
+        creados = self._crear(nuevos, errores)
+
+        # write no acepta vals distintos por registro: un RPC por grupo de vals iguales
+        actualizados = 0
+        for vals, ids in writes.values():
+            self.client.write_partners(ids, vals)
+            actualizados += len(ids)
+        return {"creados": creados, "existentes": existentes, "actualizados": actualizados, "errores": errores}
+
+    def correr(self, cancelado: Callable[[], bool] = lambda: False) -> Dict[str, Any]:
+        """Procesa desde estado["procesados"] hasta el final, o hasta cancelado()/error."""
+        est = self.estado
+        est["estado"] = "corriendo"
+        est["ultimo_error"] = None
+        t0 = time.monotonic() - est["duracion_s"]
+        try:
+            while est["procesados"] < est["total"]:
+                if cancelado():
+                    est["estado"] = "cancelado"
+                    return est
+                i = est["procesados"]
+                res = self._lote(self.unicos[i:i + self.lote])
+                # el estado se toca solo con el lote completo: reanudar no cuenta dos veces
+                for campo in ("creados", "existentes", "actualizados"):
+                    est[campo] += res[campo]
+                    IMPORT_PARTNERS.labels(campo[:-1]).inc(res[campo])
+                est["errores"] += len(res["errores"])
+                IMPORT_PARTNERS.labels("error").inc(len(res["errores"]))
+                est["detalle_errores"].extend(res["errores"][:MAX_ERRORES - len(est["detalle_errores"])])
+                est["procesados"] = min(i + self.lote, est["total"])
+                est["lotes"] += 1
+                est["duracion_s"] = round(time.monotonic() - t0, 3)
+                if self.on_progreso:
+                    self.on_progreso(est)
+            est["estado"] = "ok"
+            return est
+        except Exception as e:
+            # procesados no avanzó: reanudar repite este lote (los creados aparecen como existentes)
+            est["estado"] = "error"
+            est["ultimo_error"] = str(e)
+            raise
+        finally:
+            est["duracion_s"] = round(time.monotonic() - t0, 3)
+            if self.on_progreso and est["estado"] != "ok":  # con ok ya se reportó el último lote
+                self.on_progreso(est)
+
+
+# =======================
+# CLI
+# =======================
+
+def leer_filas(path: Path) -> List[Dict[str, Any]]:
+    if path.suffix.lower() == ".json":
+        data = json.loads(path.read_text(encoding="utf-8"))
+        if not isinstance(data, list):
+            raise ValueError("El JSON debe ser una lista de pacientes")
+        return data
+    with path.open(newline="", encoding="utf-8-sig") as f:
+        return [{(k or "").strip().lower(): v for k, v in row.items()} for row in csv.DictReader(f)]
+
+
+def guardar_checkpoint(path: Path, estado: Dict[str, Any]) -> None:
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps(estado, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+    os.replace(tmp, path)  # atómico: un corte nunca deja el checkpoint a medias
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Importación masiva de pacientes a Odoo")
+    ap.add_argument("archivo", type=Path, help="CSV (nombre,apellido,edad,telefono) o JSON")
+    ap.add_argument("--lote", type=int, default=LOTE, help="pacientes por RPC")
+    ap.add_argument("--actualizar", action="store_true",
+                    help="reescribe phone/mobile con el formato normalizado en los partners existentes")
+    ap.add_argument("--checkpoint", type=Path, help="archivo de estado (default: <archivo>.import.json)")
+    ap.add_argument("--desde-cero", action="store_true", help="ignora un checkpoint existente")
+    args = ap.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    from services.odoo_service import OdooClient
+
+    checkpoint = args.checkpoint or args.archivo.with_name(args.archivo.name + ".import.json")
+    estado = None
+    if checkpoint.exists() and not args.desde_cero:
+        estado = json.loads(checkpoint.read_text(encoding="utf-8"))
+        log.info("Reanudando desde %s: %s/%s procesados", checkpoint, estado["procesados"], estado["total"])
+
+    def progreso(est: Dict[str, Any]) -> None:
+        guardar_checkpoint(checkpoint, est)
+        ritmo = est["procesados"] / est["duracion_s"] if est["duracion_s"] else 0.0
+        log.info(
+            "%s/%s procesados (creados=%s existentes=%s actualizados=%s errores=%s) %.0f/s",
+            est["procesados"], est["total"], est["creados"], est["existentes"],
+            est["actualizados"], est["errores"], ritmo,
+        )
+
+    imp = Importacion(OdooClient(), leer_filas(args.archivo), args.actualizar, args.lote, estado, progreso)
+    try:
+        est = imp.correr()
+    except Exception:
+        log.exception("Importación cortada; volver a correr el mismo comando para reanudar")
+        sys.exit(1)
+    log.info("Listo: %s filas, %s omitidas (ver %s)", est["filas"], est["omitidos"], checkpoint)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Mantenimiento de las particiones mensuales de turnos (sql/002).
+
+Pensado para correr una vez por día desde cron, desde API/:
+    python -m jobs.particiones                      # crea meses futuros + archiva
+    python -m jobs.particiones --dry-run            # solo muestra qué haría
+    python -m jobs.particiones --modo exportar --dir /backups/turnos
+
+1) Crea las particiones de los próximos TURNOS_MESES_ADELANTE meses.
+2) Avisa si turnos_default tiene filas (el job no corrió a tiempo).
+3) Particiones con más de TURNOS_RETENCION_MESES meses:
+     - archivar (default): DETACH + mover al schema TURNOS_ARCHIVO_SCHEMA; se
+       siguen pudiendo consultar para auditorías pero salen de la tabla viva.
+     - exportar: DETACH + COPY a <dir>/<partición>.csv.gz + DROP.
+   Una partición con turnos todavía en espera/atendiendo no se toca.
+
+El DETACH toma un lock exclusivo breve sobre turnos: se intenta con
+lock_timeout corto y se reintenta en vez de encolar a la API detrás.
+"""
+
+import argparse
+import gzip
+import logging
+import os
+import re
+import sys
+import time
+from datetime import date
+from pathlib import Path
+from typing import List, Tuple
+
+import psycopg2
+from psycopg2 import sql
+
+from services import db
+
+log = logging.getLogger("jobs.particiones")
+
+RETENCION_MESES = int(os.getenv("TURNOS_RETENCION_MESES", "24"))
+MESES_ADELANTE = int(os.getenv("TURNOS_MESES_ADELANTE", "3"))
+ARCHIVO_SCHEMA = os.getenv("TURNOS_ARCHIVO_SCHEMA", "archivo")
+LOCK_TIMEOUT_MS = int(os.getenv("TURNOS_DETACH_LOCK_TIMEOUT_MS", "2000"))
+DETACH_REINTENTOS = 5
+
+_NOMBRE_RE = re.compile(r"^turnos_y(\d{4})m(\d{2})$")
+
+
+def db_params() -> dict:
+    # misma resolución que la API: DB_WRITE_DSN o DB_*
+    return db.write_params()
+
+
+def _meses_atras(hoy: date, meses: int) -> date:
+    total = hoy.year * 12 + (hoy.month - 1) - meses
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def particiones(conn) -> List[Tuple[str, date]]:
+    """(nombre, primer día del mes) de cada partición mensual adjunta a turnos."""
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'turnos'::regclass
+        """
+    )
+    out = []
+    for (nombre,) in cur.fetchall():
+        m = _NOMBRE_RE.match(nombre)
+        if m:
+            out.append((nombre, date(int(m.group(1)), int(m.group(2)), 1)))
+    return sorted(out, key=lambda p: p[1])
+
+
+def asegurar_futuras(conn, meses: int) -> int:
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT turnos_asegurar_particiones(NOW()::date, (NOW() + make_interval(months => %s))::date)",
+        (meses,),
+    )
+    conn.commit()
+    return cur.fetchone()[0]
+
+
+def revisar_default(conn) -> int:
+    cur = conn.cursor()
+    cur.execute("SELECT count(*) FROM turnos_default")
+    n = cur.fetchone()[0]
+    conn.rollback()
+    if n:
+        log.warning(
+            "turnos_default tiene %s filas: faltaron particiones. Moverlas a mano "
+            "(DETACH default, crear el mes, INSERT ... SELECT, re-ATTACH).", n
+        )
+    return n
+
+
+def tiene_activos(conn, nombre: str) -> bool:
+    cur = conn.cursor()
+    cur.execute(
+        sql.SQL("SELECT 1 FROM {} WHERE estado IN ('espera', 'atendiendo') LIMIT 1").format(sql.Identifier(nombre))
+    )
+    activo = cur.fetchone() is not None
+    conn.rollback()
+    return activo
+
+
+def detach(conn, nombre: str) -> None:
+    cur = conn.cursor()
+    for intento in range(1, DETACH_REINTENTOS + 1):
+        try:
+            cur.execute("SET LOCAL lock_timeout = %s", (f"{LOCK_TIMEOUT_MS}ms",))
+            cur.execute(sql.SQL("ALTER TABLE turnos DETACH PARTITION {}").format(sql.Identifier(nombre)))
+            conn.commit()
+            return
+        except psycopg2.errors.LockNotAvailable:
+            conn.rollback()
+            log.info("DETACH %s: turnos ocupada (intento %s/%s)", nombre, intento, DETACH_REINTENTOS)
+            time.sleep(min(2 ** intento, 30))
+    raise RuntimeError(f"No se pudo desprender {nombre}: lock no disponible")
+
+
+def archivar(conn, nombre: str) -> None:
+    detach(conn, nombre)
+    cur = conn.cursor()
+    cur.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(sql.Identifier(ARCHIVO_SCHEMA)))
+    cur.execute(
+        sql.SQL("ALTER TABLE {} SET SCHEMA {}").format(sql.Identifier(nombre), sql.Identifier(ARCHIVO_SCHEMA))
+    )
+    conn.commit()
+
+
+def exportar(conn, nombre: str, destino: Path) -> Path:
+    detach(conn, nombre)
+    destino.mkdir(parents=True, exist_ok=True)
+    path = destino / f"{nombre}.csv.gz"
+    tmp = path.with_suffix(".gz.tmp")
+    cur = conn.cursor()
+    with gzip.open(tmp, "wb") as fh:
+        cur.copy_expert(
+            sql.SQL("COPY {} TO STDOUT WITH (FORMAT csv, HEADER)").format(sql.Identifier(nombre)).as_string(conn),
+            fh,
+        )
+    os.replace(tmp, path)  # el DROP va solo después de tener el archivo completo
+    cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(nombre)))
+    conn.commit()
+    return path
+
+
+def run(conn, retener_meses: int, meses_adelante: int, modo: str, destino: Path, dry_run: bool) -> int:
+    creadas = 0 if dry_run else asegurar_futuras(conn, meses_adelante)
+    if creadas:
+        log.info("Particiones futuras aseguradas (%s meses)", creadas)
+    revisar_default(conn)
+
+    corte = _meses_atras(date.today(), retener_meses)
+    viejas = [(n, mes) for n, mes in particiones(conn) if mes < corte]
+    errores = 0
+    for nombre, _ in viejas:
+        if tiene_activos(conn, nombre):
+            log.warning("%s tiene turnos activos: no se archiva", nombre)
+            errores += 1
+            continue
+        if dry_run:
+            log.info("[dry-run] %s -> %s", nombre, modo)
+            continue
+        try:
+            if modo == "exportar":
+                log.info("%s exportada a %s", nombre, exportar(conn, nombre, destino))
+            else:
+                archivar(conn, nombre)
+                log.info("%s movida a %s.%s", nombre, ARCHIVO_SCHEMA, nombre)
+        except Exception:
+            conn.rollback()
+            log.exception("No se pudo archivar %s", nombre)
+            errores += 1
+    if not viejas:
+        log.info("Nada para archivar (corte %s)", corte.isoformat())
+    return errores
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Crea particiones futuras de turnos y archiva las viejas")
+    ap.add_argument("--retener-meses", type=int, default=RETENCION_MESES)
+    ap.add_argument("--meses-adelante", type=int, default=MESES_ADELANTE)
+    ap.add_argument("--modo", choices=("archivar", "exportar"), default="archivar")
+    ap.add_argument("--dir", default="archivo_turnos", help="destino de --modo exportar")
+    ap.add_argument("--dry-run", action="store_true")
+    args = ap.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    conn = psycopg2.connect(**db_params())
+    try:
+        errores = run(conn, args.retener_meses, args.meses_adelante, args.modo, Path(args.dir), args.dry_run)
+    finally:
+        conn.close()
+    sys.exit(1 if errores else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Compara dos resultados de loadtest.run (ej: main vs rama) y marca regresiones.
+
+    python -m loadtest.compare results/base.json results/rama.json --tolerance 0.10
+
+Sale con código 1 si algún p95/p99 empeora más que la tolerancia o si baja el throughput.
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+
+def _load(path: str) -> dict:
+    return json.loads(Path(path).read_text(encoding="utf-8"))
+
+
+def _delta(base: Optional[float], new: Optional[float]) -> Optional[float]:
+    if base in (None, 0) or new is None:
+        return None
+    return (new - base) / base
+
+
+def compare(base: dict, new: dict, tolerance: float) -> Tuple[List[str], List[str]]:
+    lines: List[str] = []
+    regressions: List[str] = []
+
+    def row(name: str, metric: str, b, n, higher_is_worse: bool = True):
+        d = _delta(b, n)
+        flag = ""
+        if d is not None and ((d > tolerance) if higher_is_worse else (d < -tolerance)):
+            flag = "  <-- REGRESIÓN"
+            regressions.append(f"{name} {metric}")
+        pct = f"{d:+.1%}" if d is not None else "   n/a"
+        lines.append(f"{name:<22} {metric:<8} {str(b):>10} -> {str(n):>10}  {pct}{flag}")
+
+    row("total", "rps", base.get("throughput_rps"), new.get("throughput_rps"), higher_is_worse=False)
+
+    endpoints = sorted(set(base.get("endpoints", {})) | set(new.get("endpoints", {})))
+    for ep in endpoints:
+        b = base.get("endpoints", {}).get(ep, {})
+        n = new.get("endpoints", {}).get(ep, {})
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            row(ep, metric, b.get(metric), n.get(metric))
+
+    bw = base.get("ws", {}).get("delivery", {})
+    nw = new.get("ws", {}).get("delivery", {})
+    for metric in ("p50_ms", "p95_ms", "p99_ms"):
+        row("ws write->recv", metric, bw.get(metric), nw.get(metric))
+
+    return lines, regressions
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Compara dos resultados de load test")
+    ap.add_argument("base")
+    ap.add_argument("new")
+    ap.add_argument("--tolerance", type=float, default=0.10, help="empeoramiento relativo permitido")
+    args = ap.parse_args()
+
+    base, new = _load(args.base), _load(args.new)
+    print(f"base: {base.get('git_rev')}  nuevo: {new.get('git_rev')}")
+    lines, regressions = compare(base, new, args.tolerance)
+    print("\n".join(lines))
+    if regressions:
+        print(f"\n{len(regressions)} regresión(es) por encima de {args.tolerance:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
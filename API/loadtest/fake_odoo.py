@@ -0,0 +1,234 @@
+"""
+Servidor XML-RPC que imita lo que la API usa de Odoo:
+  /xmlrpc/2/common  -> version, authenticate
+  /xmlrpc/2/db      -> list
+  /xmlrpc/2/object  -> execute_kw sobre res.partner (search_read, read, create, write)
+                       con write_date, order/offset y active (para el índice de partners)
+
+Latencia y tasa de error configurables para simular un Odoo lento o inestable.
+
+Uso:
+    python -m loadtest.fake_odoo --port 8069 --latency-ms 80 --jitter-ms 40 --error-rate 0.01
+"""
+
+import argparse
+import itertools
+import random
+import threading
+import time
+import xmlrpc.client
+from socketserver import ThreadingMixIn
+from typing import Any, Dict, List
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+
+
+class _Handler(SimpleXMLRPCRequestHandler):
+    rpc_paths = ("/xmlrpc/2/common", "/xmlrpc/2/object", "/xmlrpc/2/db")
+
+    def log_message(self, format, *args):  # silencio: miles de requests por segundo
+        pass
+
+
+class _ThreadingServer(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeOdoo:
+    def __init__(self, latency_ms: float = 50.0, jitter_ms: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._rnd = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._partners: Dict[int, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    # ---- simulación ----
+
+    def _simulate(self) -> None:
+        with self._lock:
+            self.calls += 1
+            delay = self.latency_ms + (self._rnd.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0)
+            fail = self._rnd.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        if fail:
+            raise xmlrpc.client.Fault(1, "fake_odoo: error simulado")
+
+    @staticmethod
+    def _now() -> str:
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+
+    def seed_partners(self, n: int) -> None:
+        for i in range(n):
+            pid = next(self._ids)
+            phone = f"+1 809-{i // 10000 % 1000:03d}-{i % 10000:04d}"
+            self._partners[pid] = {"id": pid, "name": f"Paciente {i}", "phone": phone, "mobile": False,
+                                   "active": True, "write_date": self._now()}
+
+    # ---- common ----
+
+    def version(self) -> Dict[str, Any]:
+        self._simulate()
+        return {"server_version": "17.0-fake", "protocol_version": 1}
+
+    def authenticate(self, db, user, password, ctx) -> int:
+        self._simulate()
+        return 2
+
+    # ---- db ----
+
+    def list(self) -> List[str]:
+        self._simulate()
+        return ["fake"]
+
+    # ---- object ----
+
+    def execute_kw(self, db, uid, password, model, method, args, kwargs=None):
+        self._simulate()
+        kwargs = kwargs or {}
+        if model != "res.partner":
+            raise xmlrpc.client.Fault(2, f"fake_odoo: modelo no soportado {model}")
+        handler = getattr(self, f"_partner_{method}", None)
+        if handler is None:
+            raise xmlrpc.client.Fault(2, f"fake_odoo: método no soportado {method}")
+        return handler(args, kwargs)
+
+    @staticmethod
+    def _match(p: Dict[str, Any], leaf) -> bool:
+        field, op, value = leaf
+        current = p.get(field)
+        if field == "id":
+            return current in value if op == "in" else current == value
+        if current is False or current is None:
+            return False
+        if op == "ilike":
+            return str(value).lower() in str(current).lower()
+        if op == "=ilike":
+            return str(value).lower() == str(current).lower()
+        if op == "=":
+            return current == value
+        if op == "in":
+            return current in value
+        if op == ">=":
+            return current >= value
+        if op == ">":
+            return current > value
+        return False
+
+    def _eval(self, p: Dict[str, Any], domain) -> bool:
+        # Dominio en notación polaca con "|" (y "&" implícito), suficiente para la API
+        def walk(it):
+            tok = next(it)
+            if tok == "|":
+                a = walk(it)
+                b = walk(it)
+                return a or b
+            if tok == "&":
+                a = walk(it)
+                b = walk(it)
+                return a and b
+            return self._match(p, tok)
+
+        if not domain:
+            return True
+        it = iter(domain)
+        result = True
+        while True:
+            try:
+                result = walk(it) and result
+            except StopIteration:
+                return result
+
+    def _project(self, p: Dict[str, Any], fields) -> Dict[str, Any]:
+        if not fields:
+            return dict(p)
+        return {f: p.get(f, False) for f in fields}
+
+    def _partner_search_read(self, args, kwargs):
+        domain = args[0] if args else []
+        limit = int(kwargs.get("limit") or 0)
+        offset = int(kwargs.get("offset") or 0)
+        fields = kwargs.get("fields")
+        active_test = (kwargs.get("context") or {}).get("active_test", True)
+        with self._lock:
+            partners = list(self._partners.values())
+        if (kwargs.get("order") or "").startswith("write_date"):
+            partners.sort(key=lambda p: (p.get("write_date") or "", p["id"]))
+        out = []
+        for p in partners:
+            if active_test and not p.get("active", True):
+                continue
+            if self._eval(p, domain):
+                if offset:
+                    offset -= 1
+                    continue
+                out.append(self._project(p, fields))
+                if limit and len(out) >= limit:
+                    break
+        return out
+
+    def _partner_read(self, args, kwargs):
+        ids = args[0] if args else []
+        fields = kwargs.get("fields")
+        with self._lock:
+            return [self._project(self._partners[i], fields) for i in ids if i in self._partners]
+
+    def _partner_create(self, args, kwargs):
+        vals_list = args[0] if isinstance(args[0], list) else [args[0]]
+        created = []
+        with self._lock:
+            for vals in vals_list:
+                pid = next(self._ids)
+                rec = {"id": pid, "name": vals.get("name", ""), "phone": vals.get("phone", False),
+                       "mobile": vals.get("mobile", False), "active": True, "write_date": self._now()}
+                self._partners[pid] = rec
+                created.append(pid)
+        return created if isinstance(args[0], list) else created[0]
+
+    def _partner_write(self, args, kwargs):
+        ids, vals = args[0], args[1]
+        with self._lock:
+            for i in ids:
+                if i in self._partners:
+                    self._partners[i].update(vals, write_date=self._now())
+        return True
+
+
+def serve(host: str, port: int, fake: FakeOdoo) -> _ThreadingServer:
+    server = _ThreadingServer((host, port), requestHandler=_Handler, allow_none=True, logRequests=False)
+    server.register_instance(fake)
+    return server
+
+
+def start_in_thread(host: str, port: int, fake: FakeOdoo) -> _ThreadingServer:
+    server = serve(host, port, fake)
+    threading.Thread(target=server.serve_forever, name="fake-odoo", daemon=True).start()
+    return server
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Odoo XML-RPC falso para load tests")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8069)
+    ap.add_argument("--latency-ms", type=float, default=50.0)
+    ap.add_argument("--jitter-ms", type=float, default=0.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--partners", type=int, default=5000, help="partners precargados")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    fake = FakeOdoo(args.latency_ms, args.jitter_ms, args.error_rate, args.seed)
+    fake.seed_partners(args.partners)
+    server = serve(args.host, args.port, fake)
+    print(f"fake_odoo escuchando en http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
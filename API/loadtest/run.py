@@ -0,0 +1,419 @@
+"""
+Load test end-to-end de la API de turnos.
+
+Levanta (opcionalmente) el Odoo falso y uvicorn con main:app apuntando a un
+Postgres local, y luego genera carga:
+  - escritores por sucursal: /crear-turno, /iniciar-turno, /finalizar-turno
+  - lectores: /turnos-espera/{sucursal_id}
+  - miles de suscriptores /ws/{sucursal_id}
+
+Mide throughput, p50/p95/p99 por endpoint y el retraso escritura -> recepción
+en cada pantalla. Escribe un JSON comparable entre commits (ver compare.py).
+
+Ejemplo (desde API/):
+    DB_NAME=turnos_load python -m loadtest.run --reset-db --duration 60 \
+        --sucursales 20 --ws-clients 2000 --out results/$(git rev-parse --short HEAD).json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import signal
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+import psycopg2
+import websockets
+
+from loadtest.fake_odoo import FakeOdoo, start_in_thread
+
+API_DIR = Path(__file__).resolve().parent.parent
+SCHEMA_SQL = API_DIR / "sql" / "001_schema.sql"
+ACTIVOS_SQL = API_DIR / "sql" / "003_turnos_activos_idempotencia.sql"
+CONSULTORIOS_SQL = API_DIR / "sql" / "004_consultorios.sql"
+
+# Mezcla por defecto (pesos relativos por iteración de un cliente)
+DEFAULT_MIX = {"crear": 3, "iniciar": 2, "finalizar": 2, "espera": 6}
+
+
+# =======================
+# Estadística
+# =======================
+
+def percentile(sorted_vals: List[float], q: float) -> Optional[float]:
+    if not sorted_vals:
+        return None
+    k = (len(sorted_vals) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (k - lo)
+
+
+def summarize(samples: List[float], duration: float) -> Dict[str, Optional[float]]:
+    s = sorted(samples)
+    ms = lambda v: None if v is None else round(v * 1000.0, 3)  # noqa: E731
+    return {
+        "count": len(s),
+        "rps": round(len(s) / duration, 2) if duration else None,
+        "p50_ms": ms(percentile(s, 0.50)),
+        "p95_ms": ms(percentile(s, 0.95)),
+        "p99_ms": ms(percentile(s, 0.99)),
+        "max_ms": ms(s[-1] if s else None),
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        # por sucursal: instante de inicio de cada escritura que dispara broadcast, en orden
+        self.write_marks: Dict[int, List[float]] = defaultdict(list)
+        self.ws_delays: List[float] = []
+        self.ws_unmatched = 0
+        self.ws_connect_errors = 0
+
+
+# =======================
+# Base de datos
+# =======================
+
+def db_params() -> dict:
+    return {
+        "dbname": os.getenv("DB_NAME", "turnos_load"),
+        "user": os.getenv("DB_USER", "postgres"),
+        "password": os.getenv("DB_PASSWORD", "123"),
+        "host": os.getenv("DB_HOST", "localhost"),
+        "port": os.getenv("DB_PORT", "5432"),
+    }
+
+
+def reset_db(n_sucursales: int) -> None:
+    conn = psycopg2.connect(**db_params())
+    try:
+        cur = conn.cursor()
+        cur.execute("DROP TABLE IF EXISTS idempotency_keys, turnos_activos, consultorios CASCADE")
+        cur.execute("DROP TABLE IF EXISTS turnos CASCADE")
+        cur.execute("DROP TABLE IF EXISTS sucursales CASCADE")
+        cur.execute(SCHEMA_SQL.read_text(encoding="utf-8"))
+        cur.execute(ACTIVOS_SQL.read_text(encoding="utf-8"))
+        cur.execute(CONSULTORIOS_SQL.read_text(encoding="utf-8"))
+        for i in range(1, n_sucursales + 1):
+            cur.execute(
+                "INSERT INTO sucursales (id, nombre, doctor_nombre, username, password_hash) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                (i, f"Sucursal {i}", f"Dr. {i}", f"sucursal{i}", "load"),
+            )
+            cur.execute("INSERT INTO consultorios (sucursal_id, numero, nombre) VALUES (%s, 1, 'Consultorio 1')", (i,))
+        cur.execute("SELECT setval('sucursales_id_seq', %s)", (n_sucursales,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# =======================
+# Procesos
+# =======================
+
+def start_api(port: int, odoo_url: str, workers: int) -> subprocess.Popen:
+    p = db_params()
+    env = dict(os.environ)
+    env.update({
+        "DB_NAME": p["dbname"],
+        "DB_USER": p["user"],
+        "DB_PASSWORD": p["password"],
+        "DB_HOST": p["host"],
+        "DB_PORT": p["port"],
+        "ODOO_URL": odoo_url,
+        "ODOO_DB": "fake",
+        "ODOO_USER": "load",
+        "ODOO_PASSWORD": "load",
+        "ODOO_ENABLED": "true",
+    })
+    cmd = [
+        sys.executable, "-m", "uvicorn", "main:app",
+        "--host", "127.0.0.1", "--port", str(port),
+        "--workers", str(workers), "--log-level", "warning",
+    ]
+    return subprocess.Popen(cmd, cwd=str(API_DIR), env=env)
+
+
+async def wait_http(base_url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as c:
+        while time.monotonic() < deadline:
+            try:
+                r = await c.get("/ready")
+                if r.status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"La API no quedó lista en {timeout}s ({base_url})")
+
+
+# =======================
+# Clientes
+# =======================
+
+async def timed(rec: Recorder, name: str, coro):
+    t0 = time.perf_counter()
+    try:
+        r = await coro
+        rec.latencies[name].append(time.perf_counter() - t0)
+        if r.status_code >= 400:
+            rec.errors[f"{name}:{r.status_code}"] += 1
+        return r
+    except httpx.HTTPError as e:
+        rec.errors[f"{name}:{type(e).__name__}"] += 1
+        return None
+
+
+async def writer(client: httpx.AsyncClient, rec: Recorder, sucursal_id: int, mix: Dict[str, int],
+                 stop_at: float, think_ms: float, rnd: random.Random):
+    """
+    Un "mostrador" por sucursal: las escrituras de una sucursal van en serie,
+    así el k-ésimo broadcast que ve una pantalla corresponde a la k-ésima marca.
+    """
+    en_espera: List[int] = []
+    atendiendo: List[int] = []
+    marks = rec.write_marks[sucursal_id]
+    seq = 0
+    names, weights = zip(*mix.items())
+
+    async def write(name: str, coro):
+        # La marca se registra ANTES de enviar: el broadcast sale antes de la respuesta HTTP.
+        # Si la escritura no dispara broadcast, se retira (las escrituras de la sucursal van en serie).
+        marks.append(time.perf_counter())
+        r = await timed(rec, name, coro)
+        if r is None or r.status_code != 200:
+            marks.pop()
+        return r
+
+    while time.monotonic() < stop_at:
+        op = rnd.choices(names, weights)[0]
+
+        if op == "crear":
+            seq += 1
+            tel = f"809{sucursal_id:03d}{seq:04d}"[-10:]
+            r = await write("crear-turno", client.post("/crear-turno", json={
+                "sucursal_id": sucursal_id, "nombre": f"Load {sucursal_id}-{seq}",
+                "edad": 30, "telefono": tel,
+            }))
+            if r is not None and r.status_code == 200:
+                new_id = r.json().get("id")
+                if new_id:
+                    en_espera.append(new_id)
+                else:
+                    marks.pop()  # ya tenía turno activo: no hubo broadcast
+
+        elif op == "iniciar" and en_espera:
+            tid = en_espera.pop(0)
+            r = await write("iniciar-turno", client.post("/iniciar-turno", json={"turno_id": tid}))
+            if r is not None and r.status_code == 200:
+                atendiendo.append(tid)
+
+        elif op == "finalizar" and (atendiendo or en_espera):
+            tid = atendiendo.pop(0) if atendiendo else en_espera.pop(0)
+            await write("finalizar-turno", client.post("/finalizar-turno", json={"turno_id": tid}))
+
+        elif op == "espera":
+            await timed(rec, "turnos-espera", client.get(f"/turnos-espera/{sucursal_id}"))
+
+        if think_ms:
+            await asyncio.sleep(rnd.expovariate(1000.0 / think_ms))
+
+
+async def subscriber(ws_url: str, rec: Recorder, sucursal_id: int, stop_at: float, ready: asyncio.Event):
+    received = 0
+    try:
+        async with websockets.connect(f"{ws_url}/ws/{sucursal_id}", open_timeout=30, max_queue=None) as ws:
+            await ws.recv()  # snapshot inicial
+            ready.set()
+            while time.monotonic() < stop_at:
+                try:
+                    raw = await asyncio.wait_for(ws.recv(), timeout=max(0.1, stop_at - time.monotonic()))
+                except asyncio.TimeoutError:
+                    break
+                now = time.perf_counter()
+                if json.loads(raw).get("type") != "turno_actual":
+                    continue
+                marks = rec.write_marks[sucursal_id]
+                if received < len(marks):
+                    rec.ws_delays.append(now - marks[received])
+                else:
+                    rec.ws_unmatched += 1
+                received += 1
+    except Exception:
+        rec.ws_connect_errors += 1
+        ready.set()
+
+
+# =======================
+# Main
+# =======================
+
+def git_rev() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=str(API_DIR), text=True).strip()
+    except Exception:
+        return None
+
+
+async def run(args) -> dict:
+    rec = Recorder()
+    base_url = args.base_url or f"http://127.0.0.1:{args.port}"
+    ws_url = base_url.replace("http", "ws", 1)
+
+    if args.reset_db:
+        reset_db(args.sucursales)
+
+    fake = None
+    api_proc = None
+    try:
+        if not args.odoo_url:
+            fake = FakeOdoo(args.odoo_latency_ms, args.odoo_jitter_ms, args.odoo_error_rate, args.seed)
+            fake.seed_partners(args.odoo_partners)
+            fake_srv = start_in_thread("127.0.0.1", args.odoo_port, fake)
+            odoo_url = f"http://127.0.0.1:{args.odoo_port}"
+        else:
+            fake_srv = None
+            odoo_url = args.odoo_url
+
+        if not args.base_url:
+            api_proc = start_api(args.port, odoo_url, args.workers)
+        await wait_http(base_url)
+
+        sucursales = list(range(1, args.sucursales + 1))
+        limits = httpx.Limits(max_connections=args.http_connections, max_keepalive_connections=args.http_connections)
+
+        # 1) suscriptores WS repartidos entre sucursales
+        warmup_stop = time.monotonic() + args.warmup + args.duration + 5
+        ready_events = []
+        ws_tasks = []
+        for i in range(args.ws_clients):
+            ev = asyncio.Event()
+            ready_events.append(ev)
+            ws_tasks.append(asyncio.create_task(
+                subscriber(ws_url, rec, sucursales[i % len(sucursales)], warmup_stop, ev)
+            ))
+            if args.ws_ramp and i % args.ws_ramp == args.ws_ramp - 1:
+                await asyncio.sleep(0.05)
+        await asyncio.wait_for(asyncio.gather(*(e.wait() for e in ready_events)), timeout=120)
+
+        # 2) escritores / lectores
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+            await asyncio.sleep(args.warmup)
+            t_start = time.monotonic()
+            stop_at = t_start + args.duration
+            tasks = []
+            for sid in sucursales:
+                rnd = random.Random(args.seed * 1000 + sid)
+                tasks.append(asyncio.create_task(writer(client, rec, sid, args.mix, stop_at, args.think_ms, rnd)))
+            for j in range(args.readers):
+                rnd = random.Random(args.seed * 7919 + j)
+                read_mix = {"espera": 1}
+                tasks.append(asyncio.create_task(
+                    writer(client, rec, sucursales[j % len(sucursales)], read_mix, stop_at, args.think_ms, rnd)
+                ))
+            await asyncio.gather(*tasks)
+            elapsed = time.monotonic() - t_start
+
+        # deja llegar los últimos broadcasts
+        await asyncio.sleep(1.0)
+        for t in ws_tasks:
+            t.cancel()
+        await asyncio.gather(*ws_tasks, return_exceptions=True)
+
+        total_requests = sum(len(v) for v in rec.latencies.values())
+        return {
+            "git_rev": git_rev(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "host": platform.node(),
+            "config": {
+                "duration_s": args.duration,
+                "sucursales": args.sucursales,
+                "ws_clients": args.ws_clients,
+                "readers": args.readers,
+                "workers": args.workers,
+                "mix": args.mix,
+                "think_ms": args.think_ms,
+                "odoo_latency_ms": args.odoo_latency_ms,
+                "odoo_jitter_ms": args.odoo_jitter_ms,
+                "odoo_error_rate": args.odoo_error_rate,
+            },
+            "throughput_rps": round(total_requests / elapsed, 2) if elapsed else None,
+            "endpoints": {name: summarize(v, elapsed) for name, v in sorted(rec.latencies.items())},
+            "errors": dict(rec.errors),
+            "ws": {
+                "delivery": summarize(rec.ws_delays, elapsed),
+                "unmatched_messages": rec.ws_unmatched,
+                "connect_errors": rec.ws_connect_errors,
+            },
+            "odoo_calls": fake.calls if fake else None,
+        }
+    finally:
+        if api_proc is not None:
+            api_proc.send_signal(signal.SIGINT)
+            try:
+                api_proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                api_proc.kill()
+        if fake is not None and fake_srv is not None:
+            fake_srv.shutdown()
+
+
+def parse_mix(raw: str) -> Dict[str, int]:
+    mix = {}
+    for part in raw.split(","):
+        k, _, v = part.partition("=")
+        if k.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"operación desconocida: {k}")
+        mix[k.strip()] = int(v)
+    return mix
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Load test de la API de turnos")
+    ap.add_argument("--base-url", help="usar una API ya levantada en vez de arrancar uvicorn")
+    ap.add_argument("--port", type=int, default=8102)
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--reset-db", action="store_true", help="recrea turnos/sucursales en DB_NAME (¡borra datos!)")
+    ap.add_argument("--duration", type=float, default=60.0)
+    ap.add_argument("--warmup", type=float, default=3.0)
+    ap.add_argument("--sucursales", type=int, default=10)
+    ap.add_argument("--readers", type=int, default=20, help="clientes que solo hacen /turnos-espera")
+    ap.add_argument("--ws-clients", type=int, default=1000)
+    ap.add_argument("--ws-ramp", type=int, default=200, help="conexiones WS por tanda de arranque")
+    ap.add_argument("--http-connections", type=int, default=200)
+    ap.add_argument("--think-ms", type=float, default=50.0, help="pausa media entre operaciones de un cliente")
+    ap.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="ej: crear=3,iniciar=2,finalizar=2,espera=6")
+    ap.add_argument("--odoo-url", help="Odoo real/externo (por defecto se levanta fake_odoo)")
+    ap.add_argument("--odoo-port", type=int, default=8169)
+    ap.add_argument("--odoo-latency-ms", type=float, default=80.0)
+    ap.add_argument("--odoo-jitter-ms", type=float, default=40.0)
+    ap.add_argument("--odoo-error-rate", type=float, default=0.0)
+    ap.add_argument("--odoo-partners", type=int, default=5000)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", help="archivo JSON de resultados (por defecto stdout)")
+    args = ap.parse_args()
+
+    result = asyncio.run(run(args))
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.out:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+        print(f"resultados en {args.out}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
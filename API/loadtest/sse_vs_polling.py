@@ -0,0 +1,249 @@
+"""
+Costo de pantallas por polling vs SSE con la misma carga de escritura.
+
+Corre dos fases con un uvicorn nuevo cada una (la CPU se mide por proceso):
+  - polling: N pantallas hacen GET /turno-actual/{sucursal_id} cada --intervalo s
+  - sse:     N pantallas abiertas en GET /sse/{sucursal_id}
+y en ambas un escritor por sucursal (crear/iniciar/finalizar, como loadtest.run).
+
+Por fase reporta: requests/s que recibió la API, llamadas a la DB por segundo
+(de /metrics), CPU de la API y el retraso escritura -> pantalla. En polling
+ese retraso es una cota superior: se mide desde la primera escritura posterior
+al poll anterior hasta el poll que ve el cambio.
+
+Ejemplo (desde API/):
+    DB_NAME=turnos_load python -m loadtest.sse_vs_polling --reset-db \\
+        --clientes 1000 --sucursales 20 --duration 60 --out results/sse_vs_polling.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+from loadtest.fake_odoo import FakeOdoo, start_in_thread
+from loadtest.run import Recorder, git_rev, reset_db, start_api, summarize, wait_http, writer
+
+WRITE_MIX = {"crear": 3, "iniciar": 2, "finalizar": 2}
+
+
+def cpu_seconds(pid: int) -> float:
+    """utime + stime del proceso y sus hijos directos (workers de uvicorn)."""
+    tick = os.sysconf("SC_CLK_TCK")
+    total = 0.0
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            fields = Path(f"/proc/{entry}/stat").read_text().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        # tras el ")" : estado(0) ppid(1) ... utime(11) stime(12)
+        if int(entry) == pid or int(fields[1]) == pid:
+            total += (int(fields[11]) + int(fields[12])) / tick
+    return total
+
+
+async def db_calls(client: httpx.AsyncClient) -> float:
+    r = await client.get("/metrics")
+    return sum(
+        float(line.rsplit(" ", 1)[1])
+        for line in r.text.splitlines()
+        if line.startswith("turnos_db_query_duration_seconds_count")
+    )
+
+
+async def poller(client: httpx.AsyncClient, rec: Recorder, sucursal_id: int, intervalo: float,
+                 stop_at: float, rnd: random.Random):
+    await asyncio.sleep(rnd.uniform(0, intervalo))  # repartir los polls en el intervalo
+    marks = rec.write_marks[sucursal_id]
+    last_body: Optional[bytes] = None
+    prev_sent = time.perf_counter()
+    while time.monotonic() < stop_at:
+        sent = time.perf_counter()
+        t0 = time.perf_counter()
+        try:
+            r = await client.get(f"/turno-actual/{sucursal_id}")
+            rec.latencies["turno-actual"].append(time.perf_counter() - t0)
+            if r.status_code >= 400:
+                rec.errors[f"turno-actual:{r.status_code}"] += 1
+            elif last_body is not None and r.content != last_body:
+                now = time.perf_counter()
+                first = next((m for m in marks if m >= prev_sent), None)
+                if first is not None:
+                    rec.ws_delays.append(now - first)
+            last_body = r.content
+        except httpx.HTTPError as e:
+            rec.errors[f"turno-actual:{type(e).__name__}"] += 1
+        prev_sent = sent
+        await asyncio.sleep(max(0.0, intervalo - (time.perf_counter() - sent)))
+
+
+async def sse_client(client: httpx.AsyncClient, rec: Recorder, sucursal_id: int, stop_at: float,
+                     ready: asyncio.Event):
+    received = 0
+    snapshot = True
+    try:
+        async with client.stream("GET", f"/sse/{sucursal_id}", timeout=None) as r:
+            event_type = None
+            async for line in r.aiter_lines():
+                if time.monotonic() >= stop_at:
+                    break
+                if line.startswith("event:"):
+                    event_type = line[6:].strip()
+                elif line == "" and event_type:
+                    if snapshot:
+                        snapshot = False
+                        ready.set()
+                    elif event_type == "turno_actual":
+                        marks = rec.write_marks[sucursal_id]
+                        if received < len(marks):
+                            rec.ws_delays.append(time.perf_counter() - marks[received])
+                        else:
+                            rec.ws_unmatched += 1
+                        received += 1
+                    event_type = None
+    except (httpx.HTTPError, asyncio.CancelledError):
+        pass
+    except Exception:
+        rec.ws_connect_errors += 1
+    finally:
+        ready.set()
+
+
+async def fase(modo: str, args, odoo_url: str) -> dict:
+    rec = Recorder()
+    base_url = f"http://127.0.0.1:{args.port}"
+    api_proc = start_api(args.port, odoo_url, args.workers)
+    try:
+        await wait_http(base_url)
+        sucursales = list(range(1, args.sucursales + 1))
+        limits = httpx.Limits(max_connections=args.clientes + 100, max_keepalive_connections=args.clientes + 100)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+            stop_at = time.monotonic() + args.warmup + args.duration
+            screens = []
+            if modo == "sse":
+                readies = []
+                for i in range(args.clientes):
+                    ev = asyncio.Event()
+                    readies.append(ev)
+                    screens.append(asyncio.create_task(
+                        sse_client(client, rec, sucursales[i % len(sucursales)], stop_at + 2, ev)))
+                await asyncio.wait_for(asyncio.gather(*(e.wait() for e in readies)), timeout=120)
+            else:
+                for i in range(args.clientes):
+                    rnd = random.Random(args.seed * 31 + i)
+                    screens.append(asyncio.create_task(
+                        poller(client, rec, sucursales[i % len(sucursales)], args.intervalo, stop_at, rnd)))
+
+            await asyncio.sleep(args.warmup)
+            cpu0, db0, t0 = cpu_seconds(api_proc.pid), await db_calls(client), time.monotonic()
+            rec.latencies.clear()
+            rec.ws_delays.clear()
+            writers = [
+                asyncio.create_task(writer(client, rec, sid, WRITE_MIX, stop_at, args.think_ms,
+                                           random.Random(args.seed * 1000 + sid)))
+                for sid in sucursales
+            ]
+            await asyncio.gather(*writers)
+            elapsed = time.monotonic() - t0
+            cpu1, db1 = cpu_seconds(api_proc.pid), await db_calls(client)
+
+            await asyncio.sleep(1.0)
+            for t in screens:
+                t.cancel()
+            await asyncio.gather(*screens, return_exceptions=True)
+
+        requests = sum(len(v) for v in rec.latencies.values())
+        return {
+            "api_rps": round(requests / elapsed, 2),
+            "db_calls_per_s": round((db1 - db0) / elapsed, 2),
+            "api_cpu_pct": round(100.0 * (cpu1 - cpu0) / elapsed, 1),
+            "endpoints": {name: summarize(v, elapsed) for name, v in sorted(rec.latencies.items())},
+            "delivery": summarize(rec.ws_delays, elapsed),
+            "errors": dict(rec.errors),
+            "connect_errors": rec.ws_connect_errors,
+        }
+    finally:
+        api_proc.send_signal(signal.SIGINT)
+        try:
+            api_proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            api_proc.kill()
+
+
+async def run(args) -> dict:
+    fake = FakeOdoo(args.odoo_latency_ms, 0.0, 0.0, args.seed)
+    srv = start_in_thread("127.0.0.1", args.odoo_port, fake)
+    odoo_url = f"http://127.0.0.1:{args.odoo_port}"
+    fases: Dict[str, dict] = {}
+    try:
+        for modo in args.modos:
+            if args.reset_db:
+                reset_db(args.sucursales)
+            print(f"fase {modo}: {args.clientes} pantallas, {args.duration:.0f}s ...", flush=True)
+            fases[modo] = await fase(modo, args, odoo_url)
+    finally:
+        srv.shutdown()
+    return {
+        "git_rev": git_rev(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {
+            "clientes": args.clientes, "sucursales": args.sucursales, "duration_s": args.duration,
+            "intervalo_s": args.intervalo, "workers": args.workers, "think_ms": args.think_ms,
+        },
+        "fases": fases,
+    }
+
+
+def tabla(result: dict) -> str:
+    fases = result["fases"]
+    rows = [
+        ("API req/s", lambda f: f["api_rps"]),
+        ("DB llamadas/s", lambda f: f["db_calls_per_s"]),
+        ("CPU API %", lambda f: f["api_cpu_pct"]),
+        ("entrega p50 ms", lambda f: f["delivery"]["p50_ms"]),
+        ("entrega p95 ms", lambda f: f["delivery"]["p95_ms"]),
+    ]
+    lines = [f"{'':<16}" + "".join(f"{m:>12}" for m in fases)]
+    for name, get in rows:
+        lines.append(f"{name:<16}" + "".join(f"{str(get(f)):>12}" for f in fases.values()))
+    return "\n".join(lines)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Load test: pantallas por polling vs SSE")
+    ap.add_argument("--port", type=int, default=8103)
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--reset-db", action="store_true", help="recrea turnos/sucursales en DB_NAME (¡borra datos!)")
+    ap.add_argument("--modos", nargs="+", choices=("polling", "sse"), default=["polling", "sse"])
+    ap.add_argument("--clientes", type=int, default=1000)
+    ap.add_argument("--sucursales", type=int, default=20)
+    ap.add_argument("--intervalo", type=float, default=1.0, help="segundos entre polls")
+    ap.add_argument("--duration", type=float, default=60.0)
+    ap.add_argument("--warmup", type=float, default=3.0)
+    ap.add_argument("--think-ms", type=float, default=500.0, help="pausa media entre escrituras por sucursal")
+    ap.add_argument("--odoo-port", type=int, default=8170)
+    ap.add_argument("--odoo-latency-ms", type=float, default=20.0)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", help="archivo JSON de resultados")
+    args = ap.parse_args()
+
+    result = asyncio.run(run(args))
+    print(tabla(result))
+    if args.out:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.out).write_text(json.dumps(result, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+        print(f"resultados en {args.out}")
+
+
+if __name__ == "__main__":
+    main()
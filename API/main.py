@@ -1,29 +1,71 @@
 import asyncio
 import json
+import logging
+import os
+import time
 from collections import defaultdict
-from typing import Dict, Optional, Set, List
+from typing import Dict, Optional, Set, List, Tuple
 from datetime import date
 import anyio
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2 import errors as pg_errors
+from psycopg2.extras import Json, RealDictCursor
 import re
-from services.odoo_service import OdooClient
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+from contextlib import asynccontextmanager
+import queries as q
+from services import auth_service as auth
+from services.cache import TTLCache
+from services import metrics
+from services import profiler
+from services import db
+from services import sharding
+from services import eta
+from services import encoding
+from services import odoo_health
+from services import admission
+from services import idempotency as idem
+from services import dashboard
+from services import dispatch
+from services import sse
+from services import partner_index
+from services import analytics
+from services import capacity
+from services import posiciones
+from services.metrics import timed_db
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response, StreamingResponse
 from fastapi import Query
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional as Opt
-from routers.odoo_customers import router as odoo_router
+from routers.odoo_customers import router as odoo_router, odoo_client
 from dotenv import load_dotenv
-from routers.odoo_customers import router as odoo_customers_router
 load_dotenv()
 
-app = FastAPI()
+log = logging.getLogger("uvicorn.error")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    odoo_health.monitor.start()
+    partner_index.index.start()
+    read_router.start()
+    warmup_task = asyncio.create_task(run_warmup())
+    try:
+        yield
+    finally:
+        warmup_task.cancel()
+        await odoo_health.monitor.stop()
+        await partner_index.index.stop()
+        await read_router.stop()
+        db_pool.closeall()
+        if read_pool is not None:
+            read_pool.closeall()
+        auth.shutdown_pool()
+
+app = FastAPI(lifespan=lifespan)
 
 # RUTAS AÑADIDAS
 app.include_router(odoo_router)
-app.include_router(odoo_customers_router)
 
 app.add_middleware(
     CORSMiddleware,
@@ -33,28 +75,69 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-db_params = {
-    "dbname": "turnos_db",
-    "user": "postgres",
-    "password": "123",
-    "host": "localhost",
-    "port": "5432",
-}
+# Modo afinidad por sucursal (SHARD_SELF / SHARD_WORKERS): proxy al worker dueño
+shard_router = sharding.router_from_env()
+if shard_router:
+    app.add_middleware(
+        sharding.ShardRouterMiddleware,
+        router=shard_router,
+        sucursal_de_turno=lambda turno_id: db_get_sucursal_de_turno(turno_id),
+        sucursal_de_token=lambda authorization: sucursal_de_token(authorization),
+    )
+
+# gzip/zstd y MessagePack negociados por Accept / Accept-Encoding (también lo que viene por proxy)
+app.add_middleware(encoding.EncodingMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+if profiler.ENABLED:
+    app.add_middleware(profiler.ProfilerMiddleware)
+
+# DSN libpq completos: pisan DB_* (escritura) / activan la réplica (lectura)
+db_params = db.write_params()
+DB_READ_DSN = os.getenv("DB_READ_DSN")
+
+db_pool = db.ConnectionPool(
+    db_params,
+    maxconn=int(os.getenv("DB_POOL_MAX", "20")),
+    timeout_s=float(os.getenv("DB_POOL_TIMEOUT", "10")),
+    # conexiones que solo toma el trabajo "critico" (services/capacity.py)
+    reserva=capacity.RESERVA_CRITICA,
+)
+
+read_pool = db.ConnectionPool(
+    {"dsn": DB_READ_DSN},
+    maxconn=int(os.getenv("DB_READ_POOL_MAX", os.getenv("DB_POOL_MAX", "20"))),
+    timeout_s=float(os.getenv("DB_POOL_TIMEOUT", "10")),
+) if DB_READ_DSN else None
+read_router = db.ReadRouter(db_pool, read_pool)
 
 def get_db_connection():
-    return psycopg2.connect(**db_params)
+    # Conexión del pool con cursores instrumentados; conn.close() la devuelve al pool
+    return db_pool.getconn()
+
+def get_read_connection():
+    # Reportes y listados: réplica si hay y está al día; si no, primario.
+    # Nada que tenga que ver la escritura recién hecha (snapshot post-transición) usa esto.
+    return read_router.getconn_read()
+
+# Si es true, todas las rutas de turnos exigen "Authorization: Bearer <token>"
+# (y el WS ?token=...). Si es false, el token es opcional pero si viene se valida.
+AUTH_REQUIRED = os.getenv("AUTH_REQUIRED", "false").lower() in ("1", "true", "yes", "y", "on")
+
+# Perfil de sucursal (nombre, doctor_nombre): cambia casi nunca
+sucursal_cache = TTLCache(
+    maxsize=int(os.getenv("SUCURSAL_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("SUCURSAL_CACHE_TTL", "600")),
+)
 
 # --------- DB helpers (SYNC) ---------
-def db_get_turnos_espera(sucursal_id: int) -> list[dict]:
-    conn = get_db_connection()
+@timed_db
+def db_get_turnos_en_curso_lectura(sucursal_id: int) -> list[dict]:
+    # Como db_get_turnos_en_curso pero de la réplica: para el polling de /turnos-espera
+    conn = get_read_connection()
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         cur.execute(
-            """
-            SELECT * FROM turnos
-            WHERE sucursal_id = %s AND estado = 'espera'
-            ORDER BY created_at ASC
-            """,
+            q.TURNOS_EN_CURSO,
             (sucursal_id,),
         )
         rows = cur.fetchall()
@@ -62,90 +145,139 @@ def db_get_turnos_espera(sucursal_id: int) -> list[dict]:
     finally:
         conn.close()
 
+@timed_db
 def db_get_turno_actual(sucursal_id: int) -> Optional[dict]:
-    conn = get_db_connection()
+    conn = get_read_connection()
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         cur.execute(
-            """
-            SELECT * FROM turnos
-            WHERE sucursal_id = %s AND estado = 'espera'
-            ORDER BY created_at ASC
-            LIMIT 1
-            """,
+            q.TURNO_ACTUAL,
             (sucursal_id,),
         )
         return cur.fetchone()
     finally:
         conn.close()
 
+def _insertar_turno(
+    cur, sucursal_id: int, nombre: str, edad: int, telefono: Optional[str], prioridad: int
+) -> Optional[tuple]:
+    """
+    INSERT bajo savepoint: (id, created_at), o None si el paciente ya tiene
+    turno activo, sin abortar la transacción.
+    """
+    cur.execute("SAVEPOINT crear_turno")
+    try:
+        cur.execute(q.CREAR_TURNO_SEGURO, (sucursal_id, nombre, edad, telefono, prioridad))
+    except pg_errors.UniqueViolation:
+        cur.execute("ROLLBACK TO SAVEPOINT crear_turno")
+        return None
+    return tuple(cur.fetchone())
+
+@timed_db
 def db_crear_turno_seguro(
     sucursal_id: int,
     nombre: str,
     edad: int,
     telefono: Optional[str],
-) -> Optional[int]:
+    prioridad: int = dispatch.PRIORIDAD_DEFAULT,
+) -> Optional[tuple]:
     """
     Crea un turno SOLO si no existe otro activo.
-    Devuelve el id si se creó, o None si ya existía.
+    Devuelve (id, created_at) si se creó, o None si ya existía.
     """
     conn = get_db_connection()
     try:
         cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO turnos (sucursal_id, nombre, edad, telefono, estado)
-            SELECT %s, %s, %s, %s, 'espera'
-            WHERE NOT EXISTS (
-                SELECT 1
-                FROM turnos
-                WHERE sucursal_id = %s
-                  AND estado IN ('espera', 'atendiendo')
-                  AND (
-                        (%s IS NOT NULL AND telefono = %s)
-                     OR (%s IS NULL AND nombre = %s)
-                  )
-            )
-            RETURNING id
-            """,
-            (
-                sucursal_id, nombre, edad, telefono,
-                sucursal_id,
-                telefono, telefono,
-                telefono, nombre,
-            ),
-        )
-
+        cur.execute(q.CREAR_TURNO_SEGURO, (sucursal_id, nombre, edad, telefono, prioridad))
         row = cur.fetchone()
         conn.commit()
-        return row[0] if row else None
+        return tuple(row) if row else None
+    except pg_errors.UniqueViolation:
+        # turnos_activos (sql/003): ya hay un turno activo para este paciente
+        conn.rollback()
+        return None
     except Exception:
         conn.rollback()
         raise
     finally:
         conn.close()
 
+def respuesta_crear_turno(new_id: Optional[int], nombre: str) -> dict:
+    if not new_id:
+        return {"status": "ok", "mensaje": "El cliente ya tiene un turno activo"}
+    return {"id": new_id, "status": "creado", "nombre": nombre}
 
-def db_finalizar_turno(turno_id: int) -> int:
+@timed_db
+def db_crear_turno_idempotente(
+    sucursal_id: int,
+    key: str,
+    request_hash: str,
+    nombre: str,
+    edad: int,
+    telefono: Optional[str],
+    prioridad: int = dispatch.PRIORIDAD_DEFAULT,
+) -> Tuple[dict, Optional[tuple], bool]:
+    """
+    Reclama la Idempotency-Key y crea el turno en UNA transacción.
+    Devuelve (respuesta guardada, (id, created_at) creado, replay). Si la clave ya existía
+    (replay=True) la respuesta es la del primer request y no se crea nada.
+    """
+    params = {"sucursal_id": sucursal_id, "key": key, "request_hash": request_hash, "ttl_s": idem.TTL_S}
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(q.IDEMPOTENCIA_RECLAMAR, params)
+        if cur.fetchone() is None:
+            cur.execute(q.IDEMPOTENCIA_OBTENER, params)
+            row = cur.fetchone()
+            conn.rollback()
+            return idem.stored(row[0], row[1], row[2]), None, True
+
+        creado = _insertar_turno(cur, sucursal_id, nombre, edad, telefono, prioridad)
+        body = respuesta_crear_turno(creado[0] if creado else None, nombre)
+        cur.execute(q.IDEMPOTENCIA_GUARDAR, {**params, "status_code": 200, "response": Json(body)})
+        conn.commit()
+        return idem.stored(request_hash, 200, body), creado, False
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+@timed_db
+def db_get_idempotencia(sucursal_id: int, key: str) -> Optional[dict]:
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(q.IDEMPOTENCIA_OBTENER, {"sucursal_id": sucursal_id, "key": key, "ttl_s": idem.TTL_S})
+        row = cur.fetchone()
+        return idem.stored(row[0], row[1], row[2]) if row else None
+    finally:
+        conn.close()
+
+
+@timed_db
+def db_finalizar_turno(turno_id: int, sucursal_id: Optional[int] = None) -> int:
     """
     Finaliza un turno y retorna sucursal_id del turno finalizado.
+    Con sucursal_id (la de la sesión) solo toca turnos de esa sucursal.
     """
     conn = get_db_connection()
     try:
         cur = conn.cursor()
         cur.execute(
-            """
-            UPDATE turnos
-            SET estado='finalizado', updated_at=NOW()
-            WHERE id=%s
-            RETURNING sucursal_id
-            """,
-            (turno_id,),
+            q.FINALIZAR_TURNO,
+            (turno_id, sucursal_id),
         )
         row = cur.fetchone()
+        if not row:
+            # Turno fuera de la ventana de activos: búsqueda en todas las particiones
+            cur.execute(q.FINALIZAR_TURNO_HISTORICO, (turno_id, sucursal_id))
+            row = cur.fetchone()
         if not row:
             raise ValueError("Turno no encontrado")
         conn.commit()
+        eta.estimator.on_finalizado(row[0], row[1], row[2])
         return row[0]
     except Exception:
         conn.rollback()
@@ -153,28 +285,187 @@ def db_finalizar_turno(turno_id: int) -> int:
     finally:
         conn.close()
 
+@timed_db
+def db_get_sucursal_login(username: str) -> Optional[dict]:
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(
+            "SELECT id, nombre, doctor_nombre, password_hash FROM sucursales WHERE username=%s",
+            (username,),
+        )
+        row = cur.fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+@timed_db
+def db_actualizar_password_hash(sucursal_id: int, password_hash: str) -> None:
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE sucursales SET password_hash=%s WHERE id=%s",
+            (password_hash, sucursal_id),
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+@timed_db
+def db_get_sucursal_perfil(sucursal_id: int) -> Optional[dict]:
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(
+            "SELECT id, nombre, doctor_nombre FROM sucursales WHERE id=%s",
+            (sucursal_id,),
+        )
+        row = cur.fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+async def get_sucursal_perfil(sucursal_id: int) -> Optional[dict]:
+    perfil = sucursal_cache.get(sucursal_id)
+    if perfil is not None:
+        return perfil
+    perfil = await capacity.run("db", db_get_sucursal_perfil, sucursal_id)
+    if perfil is not None:
+        sucursal_cache.set(sucursal_id, perfil)
+    return perfil
+
+@timed_db
+def db_get_sucursal_de_turno(turno_id: int) -> Optional[int]:
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(q.SUCURSAL_DE_TURNO, (turno_id,))
+        row = cur.fetchone()
+        if not row:
+            cur.execute(q.SUCURSAL_DE_TURNO_HISTORICO, (turno_id,))
+            row = cur.fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+# --------- Sesiones (token firmado, validación sin DB) ---------
+
+def get_sesion(authorization: Opt[str] = Header(None)) -> Optional[dict]:
+    token = auth.token_from_header(authorization)
+    if not token:
+        if AUTH_REQUIRED:
+            raise HTTPException(status_code=401, detail="Sesión requerida")
+        return None
+    claims = auth.verify_token(token)
+    if not claims:
+        raise HTTPException(status_code=401, detail="Token inválido o expirado")
+    return claims
+
+def check_sucursal(sesion: Optional[dict], sucursal_id: int) -> None:
+    if sesion is not None and int(sesion["sid"]) != int(sucursal_id):
+        raise HTTPException(status_code=403, detail="El token es de otra sucursal")
+
+def require_admin(x_admin_key: Opt[str] = Header(None)) -> None:
+    admin_key = (os.getenv("ADMIN_KEY", "") or "").strip()
+    if not admin_key or not x_admin_key or not auth.secret_equals(x_admin_key, admin_key):
+        raise HTTPException(status_code=403, detail="Acceso de administrador requerido")
+
+def sucursal_de_token(authorization: Optional[str]) -> Optional[int]:
+    claims = auth.verify_token(auth.token_from_header(authorization))
+    return int(claims["sid"]) if claims else None
+
+def dashboard_key_valida(key: Optional[str]) -> bool:
+    # Tablero de supervisores: DASHBOARD_KEY (o ADMIN_KEY). Sin clave configurada, como el WS sin token.
+    expected = (os.getenv("DASHBOARD_KEY") or os.getenv("ADMIN_KEY") or "").strip()
+    if not expected:
+        return not AUTH_REQUIRED
+    return bool(key) and auth.secret_equals(key, expected)
+
+def ws_sesion_valida(token: Optional[str], sucursal_id: int) -> bool:
+    if not token:
+        return not AUTH_REQUIRED
+    claims = auth.verify_token(token)
+    return bool(claims) and int(claims["sid"]) == int(sucursal_id)
+
+@asynccontextmanager
+async def admitir(sucursal_id: Optional[int]):
+    """
+    Slot de alta de turnos de la sucursal (token bucket + cola justa); 429 +
+    Retry-After si no hay lugar. Solo /crear-turno: iniciar, finalizar y
+    llamar-siguiente hacen avanzar la cola y no pasan por acá.
+    """
+    if sucursal_id is None or not admission.ENABLED:
+        yield
+        return
+    try:
+        await admission.controller.acquire(sucursal_id)
+    except admission.Rejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Demasiadas solicitudes para la sucursal ({e.reason})",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    try:
+        yield
+    finally:
+        admission.controller.release(sucursal_id)
+
 # --------- Evento estándar (SIEMPRE JSON-safe) ---------
 
-async def build_turno_actual_event(sucursal_id: int) -> dict:
-    turno_actual = await anyio.to_thread.run_sync(db_get_turno_actual, sucursal_id)
+def annotar_eta(sucursal_id: int, cola: list[dict]) -> list[dict]:
+    # tantos servidores como consultorios activos tenga el despacho (sql/004)
+    return eta.estimator.annotate(sucursal_id, cola, servidores=dispatcher.consultorios_activos(sucursal_id))
+
+async def build_turno_actual_event(sucursal_id: int, pool: str = "db") -> dict:
+    # Una sola query: la cola completa trae el turno actual y permite calcular las ETAs.
+    # pool="critico" para el evento que se difunde tras iniciar/finalizar/llamar (services/capacity.py)
+    cola = await capacity.run(pool, db_get_turnos_en_curso, sucursal_id)
+    annotar_eta(sucursal_id, cola)
+    turno_actual = next((t for t in cola if t.get("estado") == "espera"), None)
     payload = {
         "type": "turno_actual",
         "sucursal_id": sucursal_id,
-        "turno": dict(turno_actual) if turno_actual else None,  # RealDictRow -> dict
+        "turno": turno_actual,
+        "cola": [
+            {"id": t["id"], "eta": t["eta"], "espera_estimada_seg": t["espera_estimada_seg"]}
+            for t in cola
+            if t.get("estado") == "espera"
+        ],
     }
     return jsonable_encoder(payload)  # datetime -> string ISO
 
+@timed_db
+def db_get_dashboard(ids: Optional[frozenset]) -> list[dict]:
+    # Primario: el snapshot no puede quedar detrás de los eventos que le siguen
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(q.DASHBOARD_SNAPSHOT, {"ids": sorted(ids) if ids is not None else None})
+        return [dict(r) for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+async def build_dashboard_snapshot(ids: Optional[frozenset]) -> dict:
+    rows = await capacity.run("db", db_get_dashboard, ids)
+    return jsonable_encoder({"type": "dashboard_snapshot", "sucursales": rows})
+
 # --------- WebSocket Manager ---------
 
 class ConnectionManager:
     def __init__(self):
         self._by_sucursal: Dict[int, Set[WebSocket]] = defaultdict(set)
+        self._dashboards: Set[dashboard.DashboardSubscriber] = set()
         self._lock = asyncio.Lock()
 
     async def connect(self, sucursal_id: int, websocket: WebSocket):
         await websocket.accept()
         async with self._lock:
             self._by_sucursal[sucursal_id].add(websocket)
+            metrics.WS_CONNECTIONS.set_or_remove(len(self._by_sucursal[sucursal_id]), sucursal_id)
 
     async def disconnect(self, sucursal_id: int, websocket: WebSocket):
         async with self._lock:
@@ -182,15 +473,38 @@ class ConnectionManager:
             if not conns:
                 return
             conns.discard(websocket)
+            metrics.WS_CONNECTIONS.set_or_remove(len(conns), sucursal_id)
             if not conns:
                 self._by_sucursal.pop(sucursal_id, None)
 
+    async def add_dashboard(self, sub: dashboard.DashboardSubscriber):
+        async with self._lock:
+            self._dashboards.add(sub)
+            dashboard.DASHBOARD_CONNECTIONS.set(len(self._dashboards))
+
+    async def remove_dashboard(self, sub: dashboard.DashboardSubscriber):
+        async with self._lock:
+            self._dashboards.discard(sub)
+            dashboard.DASHBOARD_CONNECTIONS.set(len(self._dashboards))
+
     async def broadcast(self, sucursal_id: int, event: dict):
         # event debe ser dict (NO string)
+        t0 = time.perf_counter()
         msg = json.dumps(event, ensure_ascii=False)
 
         async with self._lock:
             targets = list(self._by_sucursal.get(sucursal_id, set()))
+            tableros = [d for d in self._dashboards if d.wants(sucursal_id)]
+
+        # SSE: mismo JSON que el WS, al buffer de cada stream (no bloquea)
+        sse.hub.publish(sucursal_id, event.get("type", "message"), msg)
+
+        # Tableros: no bloquea, cada uno tiene su tarea de envío
+        if tableros:
+            if "sucursal_id" not in event:
+                event = {**event, "sucursal_id": sucursal_id}
+            for d in tableros:
+                d.publish(sucursal_id, event)
 
         dead: List[WebSocket] = []
         for ws in targets:
@@ -204,11 +518,57 @@ class ConnectionManager:
                 conns = self._by_sucursal.get(sucursal_id, set())
                 for ws in dead:
                     conns.discard(ws)
+                metrics.WS_CONNECTIONS.set_or_remove(len(conns), sucursal_id)
                 if not conns:
                     self._by_sucursal.pop(sucursal_id, None)
 
+        metrics.BROADCAST_MESSAGES.labels("ok").inc(len(targets) - len(dead))
+        if dead:
+            metrics.BROADCAST_MESSAGES.labels("dead").inc(len(dead))
+        metrics.BROADCAST_SECONDS.observe(time.perf_counter() - t0)
+
+    async def sucursales(self) -> List[int]:
+        async with self._lock:
+            return list(self._by_sucursal.keys())
+
+    async def close_dashboards(self, code: int = 1012):
+        """Cierra los tableros (reconectan solos y rearman los relays)."""
+        async with self._lock:
+            targets = list(self._dashboards)
+        for d in targets:
+            try:
+                await d.websocket.close(code=code)
+            except Exception:
+                pass
+
+    async def close_sucursal(self, sucursal_id: int, code: int = 1012):
+        """Cierra todas las pantallas de una sucursal (reconectan solas)."""
+        async with self._lock:
+            targets = list(self._by_sucursal.pop(sucursal_id, set()))
+            metrics.WS_CONNECTIONS.remove(sucursal_id)
+        for ws in targets:
+            try:
+                await ws.close(code=code)
+            except Exception:
+                pass
+
 manager = ConnectionManager()
 
+async def _on_rebalance(router: sharding.ShardRouter):
+    # Las pantallas de sucursales que ya no son nuestras reconectan y el
+    # proxy / balanceador las lleva al nuevo dueño.
+    for sid in await manager.sucursales():
+        if not router.is_local(sid):
+            await manager.close_sucursal(sid)
+    for sid in posiciones_hub.sucursales():
+        if not router.is_local(sid):
+            await posiciones_hub.close_sucursal(sid)
+    # sus relays apuntan a la lista de workers vieja
+    await manager.close_dashboards()
+
+if shard_router:
+    shard_router.add_listener(_on_rebalance)
+
 # --------- Models ---------
 
 class LoginRequest(BaseModel):
@@ -220,6 +580,8 @@ class TurnoCreate(BaseModel):
     nombre: str
     edad: int
     telefono: Opt[str] = None
+    # 0 urgente, 1 preferente, 2 normal (dispatch.PRIORIDADES)
+    prioridad: int = Field(dispatch.PRIORIDAD_DEFAULT, ge=0, le=2)
 
 class FinalizarTurno(BaseModel):
     turno_id: int
@@ -240,8 +602,14 @@ async def _get_odoo_name_by_phone(telefono: Optional[str]) -> Optional[str]:
     d = _phone_digits(telefono)
     if not d:
         return None
+    if partner_index.index.fresh:
+        # índice local sincronizado hace poco: sin RPCs, y su "no está" vale
+        return partner_index.index.nombre_por_telefono(d)
+    if not odoo_health.monitor.is_up():
+        # Odoo caído: el turno se crea con el nombre tal como lo escribieron
+        return None
 
-    client = OdooClient()
+    client = odoo_client()
 
     last4 = d[-4:] if len(d) >= 4 else None
     last7 = d[-7:] if len(d) >= 7 else None
@@ -264,7 +632,7 @@ async def _get_odoo_name_by_phone(telefono: Optional[str]) -> Optional[str]:
             continue
         seen.add(t)
 
-        candidates = await anyio.to_thread.run_sync(client.search_partners, t, 25)
+        candidates = await capacity.run("odoo", client.search_partners, t, 25)
         for p in candidates:
             if _phone_digits(p.get("phone")) == d or _phone_digits(p.get("mobile")) == d:
                 name = (p.get("name") or "").strip()
@@ -277,33 +645,54 @@ async def _get_odoo_name_by_phone(telefono: Optional[str]) -> Optional[str]:
 # --------- Endpoints HTTP ---------
 
 @app.post("/login")
-def login(data: LoginRequest):
-    conn = get_db_connection()
-    try:
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute(
-            "SELECT id, nombre, doctor_nombre FROM sucursales WHERE username=%s AND password_hash=%s",
-            (data.username, data.password),
-        )
-        user = cur.fetchone()
-        if not user:
-            raise HTTPException(status_code=400, detail="Credenciales incorrectas")
-        return dict(user)
-    finally:
-        conn.close()
+async def login(data: LoginRequest):
+    user = await capacity.run("db", db_get_sucursal_login, data.username)
+
+    # PBKDF2 corre en un ProcessPool: no bloquea el event loop ni los hilos de anyio
+    ok, necesita_rehash = await auth.verify_password_async(
+        data.password, user["password_hash"] if user else None
+    )
+    if not user or not ok:
+        raise HTTPException(status_code=400, detail="Credenciales incorrectas")
+
+    # Migración transparente: texto plano / iteraciones viejas -> pbkdf2 actual
+    if necesita_rehash:
+        nuevo_hash = await auth.hash_password_async(data.password)
+        await capacity.run("db", db_actualizar_password_hash, user["id"], nuevo_hash)
+
+    perfil = {"id": user["id"], "nombre": user["nombre"], "doctor_nombre": user["doctor_nombre"]}
+    sucursal_cache.set(user["id"], perfil)
+
+    token, exp = auth.issue_token(user["id"])
+    return {**perfil, "token": token, "token_type": "bearer", "expires_at": exp}
+
+@app.get("/sesion")
+async def sesion_actual(sesion: Optional[dict] = Depends(get_sesion)):
+    if sesion is None:
+        raise HTTPException(status_code=401, detail="Sesión requerida")
+    perfil = await get_sucursal_perfil(int(sesion["sid"]))
+    if not perfil:
+        raise HTTPException(status_code=404, detail="Sucursal no encontrada")
+    return {**perfil, "expires_at": sesion["exp"]}
 
 @app.get("/turno-actual/{sucursal_id}")
-def get_turno_actual(sucursal_id: int):
-    row = db_get_turno_actual(sucursal_id)
+async def get_turno_actual(sucursal_id: int, sesion: Optional[dict] = Depends(get_sesion)):
+    check_sucursal(sesion, sucursal_id)
+    row = await capacity.run("db", db_get_turno_actual, sucursal_id)
     return dict(row) if row else None
 
 @app.get("/turnos-espera/{sucursal_id}")
-def get_turnos_espera(sucursal_id: int):
+async def get_turnos_espera(sucursal_id: int, sesion: Optional[dict] = Depends(get_sesion)):
+    check_sucursal(sesion, sucursal_id)
+    # ETA sobre la cola en curso (cuenta lo que le falta al que está en consultorio,
+    # igual que el evento del WS/SSE) y después se dejan solo los de espera.
     # FastAPI convertirá datetimes bien en HTTP
-    return db_get_turnos_espera(sucursal_id)
+    cola = annotar_eta(sucursal_id, await capacity.run("db", db_get_turnos_en_curso_lectura, sucursal_id))
+    return [t for t in cola if t.get("estado") == "espera"]
 
 
 
+@timed_db
 def db_turno_activo_existente(
     sucursal_id: int,
     telefono: Optional[str],
@@ -314,26 +703,12 @@ def db_turno_activo_existente(
         cur = conn.cursor()
         if telefono:
             cur.execute(
-                """
-                SELECT 1
-                FROM turnos
-                WHERE sucursal_id = %s
-                  AND telefono = %s
-                  AND estado IN ('espera', 'atendiendo')
-                LIMIT 1
-                """,
+                q.TURNO_ACTIVO_POR_TELEFONO,
                 (sucursal_id, telefono),
             )
         else:
             cur.execute(
-                """
-                SELECT 1
-                FROM turnos
-                WHERE sucursal_id = %s
-                  AND nombre = %s
-                  AND estado IN ('espera', 'atendiendo')
-                LIMIT 1
-                """,
+                q.TURNO_ACTIVO_POR_NOMBRE,
                 (sucursal_id, nombre),
             )
 
@@ -343,53 +718,106 @@ def db_turno_activo_existente(
 
 
 
-@app.post("/crear-turno")
-async def crear_turno(turno: TurnoCreate):
-    try:
-        # 1) Normalizar nombre usando Odoo si existe
-        odoo_name = await _get_odoo_name_by_phone(turno.telefono)
-        nombre_final = (odoo_name or turno.nombre).strip()
-
-        # 2) Crear turno de forma ATÓMICA (sin race conditions)
-        new_id = await anyio.to_thread.run_sync(
-            db_crear_turno_seguro,   # 👈 función segura
-            turno.sucursal_id,
-            nombre_final,
-            turno.edad,
-            turno.telefono,
-        )
-
-        # 3) Si no se creó, ya existía un turno activo
-        if not new_id:
-            return {
-                "status": "ok",
-                "mensaje": "El cliente ya tiene un turno activo",
-            }
-
-        # 4) Broadcast del estado actual
-        payload = await build_turno_actual_event(turno.sucursal_id)
-        await manager.broadcast(turno.sucursal_id, payload)
-
-        return {
-            "id": new_id,
-            "status": "creado",
-            "nombre": nombre_final,
-        }
+def _replay_idempotente(entry: dict) -> Response:
+    return Response(
+        content=json.dumps(entry["body"], ensure_ascii=False),
+        media_type="application/json",
+        status_code=entry["status_code"],
+        headers={idem.REPLAY_HEADER: "true"},
+    )
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+@app.post("/crear-turno")
+async def crear_turno(
+    turno: TurnoCreate,
+    sesion: Optional[dict] = Depends(get_sesion),
+    idempotency_key: Opt[str] = Header(None),
+):
+    check_sucursal(sesion, turno.sucursal_id)
+
+    # 0) Reintento con Idempotency-Key: responder lo mismo sin rehacer nada
+    try:
+        key = idem.valid_key(idempotency_key)
+        req_hash = idem.request_hash(turno.model_dump()) if key else None
+        if key:
+            entry = idem.cache.get((turno.sucursal_id, key))
+            if entry is None:
+                entry = await capacity.run("db", db_get_idempotencia, turno.sucursal_id, key)
+            if entry is not None:
+                idem.cache.set((turno.sucursal_id, key), entry)
+                return _replay_idempotente(idem.check(entry, req_hash))
+    except idem.IdempotencyError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    async with admitir(turno.sucursal_id):
+        try:
+            # 1) Normalizar nombre usando Odoo si existe
+            odoo_name = await _get_odoo_name_by_phone(turno.telefono)
+            nombre_final = (odoo_name or turno.nombre).strip()
+
+            # 2) Crear turno de forma ATÓMICA (turnos_activos garantiza un activo por paciente)
+            if key:
+                entry, creado, replay = await capacity.run(
+                    "db",
+                    db_crear_turno_idempotente,
+                    turno.sucursal_id,
+                    key,
+                    req_hash,
+                    nombre_final,
+                    turno.edad,
+                    turno.telefono,
+                    turno.prioridad,
+                )
+                idem.cache.set((turno.sucursal_id, key), entry)
+                if replay:
+                    # otro request con la misma clave ganó la carrera
+                    return _replay_idempotente(idem.check(entry, req_hash))
+            else:
+                creado = await capacity.run(
+                    "db",
+                    db_crear_turno_seguro,
+                    turno.sucursal_id,
+                    nombre_final,
+                    turno.edad,
+                    turno.telefono,
+                    turno.prioridad,
+                )
+
+            # 3) Si no se creó, ya existía un turno activo
+            if not creado:
+                return respuesta_crear_turno(None, nombre_final)
+            new_id, created_at = creado
+            dispatcher.on_nuevo(turno.sucursal_id, new_id, turno.prioridad, created_at)
+
+            # 4) Broadcast del estado actual
+            payload = await build_turno_actual_event(turno.sucursal_id)
+            await manager.broadcast(turno.sucursal_id, payload)
+
+            return respuesta_crear_turno(new_id, nombre_final)
+
+        except idem.IdempotencyError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 
 
 @app.post("/finalizar-turno")
-async def finalizar_turno(data: FinalizarTurno):
+async def finalizar_turno(data: FinalizarTurno, sesion: Optional[dict] = Depends(get_sesion)):
+    # sin admisión: lo que hace avanzar la cola no espera detrás de la ráfaga del kiosco
+    sid = int(sesion["sid"]) if sesion else None
     try:
-        sucursal_id = await anyio.to_thread.run_sync(db_finalizar_turno, data.turno_id)
+        # con sesión, un turno de otra sucursal no matchea: 404
+        sucursal_id = await capacity.run("critico", db_finalizar_turno, data.turno_id, sid)
 
         # 🔥 clave: broadcast del estado ACTUAL ya calculado (pasa al siguiente)
-        payload = await build_turno_actual_event(sucursal_id)
+        payload = await build_turno_actual_event(sucursal_id, pool="critico")
         await manager.broadcast(sucursal_id, payload)
 
+        # el trigger de sql/004 ya liberó el consultorio en la DB
+        consultorio = dispatcher.on_finalizado(sucursal_id, data.turno_id)
+        if consultorio is not None:
+            await manager.broadcast(sucursal_id, consultorio_event(sucursal_id, consultorio, None))
+
         return {"status": "ok"}
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -405,45 +833,45 @@ async def finalizar_turno(data: FinalizarTurno):
 # Estisticas 
 
 
-def db_iniciar_turno(turno_id: int) -> Optional[int]:
+@timed_db
+def db_iniciar_turno(turno_id: int, sucursal_id: Optional[int] = None) -> Optional[int]:
     """
     Marca inicio_atencion y estado=atendiendo si estaba en espera.
     Retorna sucursal_id si se actualizó, o None si no se pudo.
+    Con sucursal_id (la de la sesión) solo toca turnos de esa sucursal.
     """
     conn = get_db_connection()
     try:
         cur = conn.cursor()
         cur.execute(
-            """
-            UPDATE turnos
-            SET estado='atendiendo', inicio_atencion=NOW(), updated_at=NOW()
-            WHERE id=%s AND estado='espera'
-            RETURNING sucursal_id
-            """,
-            (turno_id,),
+            q.INICIAR_TURNO,
+            (turno_id, sucursal_id),
         )
         row = cur.fetchone()
+        if not row:
+            cur.execute(q.INICIAR_TURNO_HISTORICO, (turno_id, sucursal_id))
+            row = cur.fetchone()
         conn.commit()
-        return row[0] if row else None
+        if not row:
+            return None
+        return row[0]
     except Exception:
         conn.rollback()
         raise
     finally:
         conn.close()
 
+@timed_db
 def db_get_turnos_en_curso(sucursal_id: int) -> list[dict]:
     """
-    Devuelve la lista de turnos no finalizados (atendiendo primero, luego espera)
+    Devuelve la lista de turnos no finalizados (atendiendo primero, luego espera).
+    Siempre del primario: es el snapshot que se emite justo después de cada transición.
     """
     conn = get_db_connection()
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         cur.execute(
-            """
-            SELECT * FROM turnos
-            WHERE sucursal_id=%s AND estado IN ('atendiendo','espera')
-            ORDER BY (estado='atendiendo') DESC, created_at ASC
-            """,
+            q.TURNOS_EN_CURSO,
             (sucursal_id,),
         )
         rows = cur.fetchall()
@@ -451,47 +879,31 @@ def db_get_turnos_en_curso(sucursal_id: int) -> list[dict]:
     finally:
         conn.close()
 
+@timed_db
+def db_get_eta_warmup() -> list[tuple]:
+    conn = get_read_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            q.ETA_WARMUP,
+            {
+                "dias": eta.WARM_DAYS,
+                "min_seg": eta.MIN_SERVICE_SEG,
+                "max_seg": eta.MAX_SERVICE_SEG,
+            },
+        )
+        return cur.fetchall()
+    finally:
+        conn.close()
+
+@timed_db
 def db_get_estadisticas_por_fecha(sucursal_id: int, fecha: str) -> dict:
-    conn = get_db_connection()
+    conn = get_read_connection()
     try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
         cur.execute(
-            """
-            WITH base AS (
-              SELECT
-                id, nombre, edad, telefono,
-                created_at,
-                inicio_atencion,
-                updated_at AS finalizado_at,
-                LAG(updated_at) OVER (ORDER BY created_at ASC) AS prev_finalizado
-              FROM turnos
-              WHERE sucursal_id = %s
-                AND estado = 'finalizado'
-                AND DATE(created_at) = %s::date
-            ),
-            calc AS (
-              SELECT
-                *,
-                COALESCE(
-                  inicio_atencion,
-                  GREATEST(created_at, COALESCE(prev_finalizado, created_at))
-                ) AS inicio_calculado
-              FROM base
-            )
-            SELECT
-              id, nombre, edad, telefono,
-              created_at,
-              inicio_atencion,
-              inicio_calculado,
-              finalizado_at,
-
-              EXTRACT(EPOCH FROM GREATEST(inicio_calculado - created_at, interval '0')) AS espera_seg,
-              EXTRACT(EPOCH FROM GREATEST(finalizado_at - inicio_calculado, interval '0')) AS atencion_seg,
-              EXTRACT(EPOCH FROM GREATEST(finalizado_at - created_at, interval '0')) AS total_seg
-            FROM calc
-            ORDER BY created_at DESC
-            """,
-            (sucursal_id, fecha),
+            q.ESTADISTICAS_POR_FECHA,
+            {"sucursal_id": sucursal_id, "fecha": fecha},
         )
 
         clientes = cur.fetchall()
@@ -517,37 +929,413 @@ def db_get_estadisticas_por_fecha(sucursal_id: int, fecha: str) -> dict:
         conn.close()
 
 
+@timed_db
+def db_get_heatmap_columnas(sucursal_id: int, desde: date, hasta: date) -> dict:
+    # meses de turnos en una sola fila de arrays: a la réplica
+    conn = get_read_connection()
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(q.HEATMAP_COLUMNAS, {"sucursal_id": sucursal_id, "desde": desde, "hasta": hasta})
+        return cur.fetchone()
+    finally:
+        conn.close()
+
 
 class IniciarTurno(BaseModel):
     turno_id: int
 
 @app.post("/iniciar-turno")
-async def iniciar_turno(data: IniciarTurno):
+async def iniciar_turno(data: IniciarTurno, sesion: Optional[dict] = Depends(get_sesion)):
+    # sin admisión: lo que hace avanzar la cola no espera detrás de la ráfaga del kiosco
+    sid = int(sesion["sid"]) if sesion else None
     try:
-        sucursal_id = await anyio.to_thread.run_sync(db_iniciar_turno, data.turno_id)
+        sucursal_id = await capacity.run("critico", db_iniciar_turno, data.turno_id, sid)
         # si no se pudo iniciar (ya estaba atendiendo/finalizado), igual devolvemos ok
         if sucursal_id:
-            payload = await build_turno_actual_event(sucursal_id)
+            dispatcher.on_iniciado(sucursal_id, data.turno_id)
+            payload = await build_turno_actual_event(sucursal_id, pool="critico")
             await manager.broadcast(sucursal_id, payload)
+        elif sid is not None and await capacity.run("db", db_get_sucursal_de_turno, data.turno_id) != sid:
+            # ...salvo que no exista o sea de otra sucursal
+            raise HTTPException(status_code=404, detail="Turno no encontrado")
         return {"status": "ok"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# IMPORTANTE: para recepción (cola completa con "actual" arriba)
-@app.get("/turnos-espera/{sucursal_id}")
-def get_turnos_espera(sucursal_id: int):
-    return db_get_turnos_en_curso(sucursal_id)
+# --------- Despacho multi-consultorio ---------
+
+@timed_db
+def db_dispatch_cargar(sucursal_id: int) -> Tuple[list[tuple], list[dict]]:
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(q.DISPATCH_ESPERA, (sucursal_id,))
+        espera = cur.fetchall()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(q.DISPATCH_CONSULTORIOS, (sucursal_id,))
+        return espera, [dict(r) for r in cur.fetchall()]
+    finally:
+        conn.close()
+
+@timed_db
+def db_dispatch_reclamar(sucursal_id: int, numero: int, turno_id: int) -> Optional[dict]:
+    """
+    Ocupa el consultorio y pasa el turno a 'atendiendo', todo o nada.
+    None si el turno ya no estaba en espera; ConsultorioOcupado si el consultorio no estaba libre.
+    """
+    params = {"sucursal_id": sucursal_id, "numero": numero, "turno_id": turno_id}
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(q.CONSULTORIO_OCUPAR, params)
+        if cur.fetchone() is None:
+            conn.rollback()
+            raise dispatch.ConsultorioOcupado(f"Consultorio {numero} ocupado")
+        cur.execute(q.RECLAMAR_TURNO, params)
+        turno = cur.fetchone()
+        if turno is None:
+            conn.rollback()
+            return None
+        conn.commit()
+        return jsonable_encoder(dict(turno))
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+@timed_db
+def db_guardar_consultorio(sucursal_id: int, numero: int, nombre: Optional[str], activo: bool) -> None:
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            q.CONSULTORIO_GUARDAR,
+            {"sucursal_id": sucursal_id, "numero": numero, "nombre": nombre, "activo": activo},
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+dispatcher = dispatch.DispatchEngine(db_dispatch_cargar, db_dispatch_reclamar)
+posiciones_hub = posiciones.PosicionesHub(dispatcher)
+
+def consultorio_event(sucursal_id: int, consultorio: int, turno: Optional[dict]) -> dict:
+    return {"type": "consultorio_actual", "sucursal_id": sucursal_id, "consultorio": consultorio, "turno": turno}
+
+class LlamarSiguiente(BaseModel):
+    sucursal_id: int
+    consultorio: Opt[int] = None  # None: el libre de menor número
+
+class Consultorio(BaseModel):
+    nombre: Opt[str] = None
+    activo: bool = True
+
+@app.post("/consultorios/llamar-siguiente")
+async def llamar_siguiente(data: LlamarSiguiente, sesion: Optional[dict] = Depends(get_sesion)):
+    check_sucursal(sesion, data.sucursal_id)
+    try:
+        consultorio, turno = await dispatcher.llamar_siguiente(data.sucursal_id, data.consultorio)
+    except dispatch.ConsultorioNoDisponible as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if turno is not None:
+        await manager.broadcast(data.sucursal_id, consultorio_event(data.sucursal_id, consultorio, turno))
+        payload = await build_turno_actual_event(data.sucursal_id, pool="critico")
+        await manager.broadcast(data.sucursal_id, payload)
+    return {"status": "ok", "consultorio": consultorio, "turno": turno}
+
+@app.get("/consultorios/{sucursal_id}")
+async def get_consultorios(sucursal_id: int, sesion: Optional[dict] = Depends(get_sesion)):
+    check_sucursal(sesion, sucursal_id)
+    return await dispatcher.estado(sucursal_id)
+
+@app.put("/admin/consultorios/{sucursal_id}/{numero}", dependencies=[Depends(require_admin)])
+async def admin_guardar_consultorio(sucursal_id: int, numero: int, data: Consultorio):
+    await capacity.run("db", db_guardar_consultorio, sucursal_id, numero, data.nombre, data.activo)
+    # con sharding el dueño de la sucursal lo ve en su próxima resincronización (DISPATCH_RESYNC_S)
+    dispatcher.invalidate(sucursal_id)
+    return {"status": "ok"}
+
+# Para la app de pacientes: solo la posición de su turno, sin bajar la cola (services/posiciones.py)
+@app.get("/turnos-espera/{sucursal_id}/posicion/{turno_id}")
+async def get_posicion_turno(sucursal_id: int, turno_id: int, sesion: Optional[dict] = Depends(get_sesion)):
+    check_sucursal(sesion, sucursal_id)
+    pos = await dispatcher.posicion(sucursal_id, turno_id)
+    if pos is None:
+        raise HTTPException(status_code=404, detail="El turno no está en la cola de esta sucursal")
+    return posiciones.evento(sucursal_id, turno_id, pos)
 
 # Endpoint de estadísticas por fecha
 @app.get("/estadisticas/{sucursal_id}")
-def estadisticas(sucursal_id: int, fecha: str = Query(..., description="YYYY-MM-DD")):
-    data = db_get_estadisticas_por_fecha(sucursal_id, fecha)
+async def estadisticas(
+    sucursal_id: int,
+    fecha: str = Query(..., description="YYYY-MM-DD"),
+    sesion: Optional[dict] = Depends(get_sesion),
+):
+    check_sucursal(sesion, sucursal_id)
+    data = await capacity.run("db", db_get_estadisticas_por_fecha, sucursal_id, fecha)
     return jsonable_encoder(data)
 
+@app.get("/estadisticas/{sucursal_id}/heatmap")
+async def estadisticas_heatmap(
+    sucursal_id: int,
+    desde: Opt[date] = Query(None, description="YYYY-MM-DD; default: 12 semanas antes de hasta"),
+    hasta: Opt[date] = Query(None, description="YYYY-MM-DD inclusive; se recorta a ayer"),
+    sesion: Optional[dict] = Depends(get_sesion),
+):
+    """Llegadas y tiempo de atención (mediana, p90) por día de semana × hora, para staffing."""
+    check_sucursal(sesion, sucursal_id)
+    try:
+        desde, hasta = analytics.rango(desde, hasta, date.today())
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    key = (sucursal_id, desde, hasta)
+    data = analytics.cache.get(key)
+    if data is None:
+        analytics.ANALYTICS_CACHE.labels("miss").inc()
+        cols = await capacity.run("db", db_get_heatmap_columnas, sucursal_id, desde, hasta)
+        # NumPy fuera del loop, en el limiter por defecto: no retiene conexión de la DB
+        data = {"sucursal_id": sucursal_id, **await anyio.to_thread.run_sync(analytics.heatmap, cols, desde, hasta)}
+        analytics.cache.set(key, data)
+    else:
+        analytics.ANALYTICS_CACHE.labels("hit").inc()
+    return data
+
+# --------- Arranque (warm-up) y readiness ---------
+
+STARTUP_SECONDS = metrics.gauge(
+    "turnos_startup_phase_seconds",
+    "Duración de cada fase del warm-up; phase=total es el time-to-ready",
+    ("phase",),
+)
+
+# /ready responde 200 solo cuando ready=True
+startup_state: dict = {"ready": False, "started_at": time.time(), "phases": {}, "odoo": None}
+
+READY_REQUIRE_ODOO = os.getenv("READY_REQUIRE_ODOO", "false").lower() in ("1", "true", "yes", "y", "on")
+
+@timed_db
+def db_get_colas_activas() -> Dict[int, list[dict]]:
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(q.COLAS_ACTIVAS)
+        colas: Dict[int, list[dict]] = defaultdict(list)
+        for r in cur.fetchall():
+            colas[r["sucursal_id"]].append(dict(r))
+        return colas
+    finally:
+        conn.close()
+
+def _warm_serializers(colas: Dict[int, list[dict]]) -> None:
+    # Primer uso de pydantic/jsonable_encoder/openapi: que no lo pague un cliente
+    TurnoCreate.model_validate({"sucursal_id": 1, "nombre": "warmup", "edad": 1, "telefono": None})
+    FinalizarTurno.model_validate({"turno_id": 1})
+    for sucursal_id, cola in colas.items():
+        annotar_eta(sucursal_id, cola)
+        json.dumps(jsonable_encoder({"type": "turno_actual", "cola": cola}), ensure_ascii=False)
+    app.openapi()
+
+async def _warm_odoo() -> None:
+    # El primer sondeo del monitor de salud hace de warm-up (version + authenticate)
+    t0 = time.perf_counter()
+    await odoo_health.monitor.wait_first_probe()
+    STARTUP_SECONDS.labels("odoo").set(time.perf_counter() - t0)
+    snap = odoo_health.monitor.snapshot()
+    startup_state["odoo"] = {"ok": snap["ok"], "uid": snap["uid"], "error": snap["last_error"]}
+    if not snap["ok"]:
+        log.warning("Warm-up de Odoo falló: %s", snap["last_error"])
+
+async def run_warmup() -> None:
+    """
+    Fases (en orden): DB pool, ETA, colas activas, serializers. Odoo autentica
+    en paralelo y solo bloquea readiness si READY_REQUIRE_ODOO=true.
+    Si una fase falla se reintenta todo con backoff: mejor no-ready que frío.
+    """
+    t_start = time.perf_counter()
+    odoo_task = asyncio.create_task(_warm_odoo())
+    delay = 1.0
+    eta_listo = False  # warm_from_rows suma muestras: en un reintento no se repite
+
+    async def phase(name: str, fn, *args):
+        t0 = time.perf_counter()
+        result = await anyio.to_thread.run_sync(fn, *args)
+        dt = time.perf_counter() - t0
+        STARTUP_SECONDS.labels(name).set(dt)
+        startup_state["phases"][name] = round(dt, 4)
+        return result
+
+    while True:
+        try:
+            await phase("db_pool", db_pool.warm, int(os.getenv("DB_POOL_WARM", "4")))
+            if not eta_listo:
+                rows = await phase("eta", db_get_eta_warmup)
+                eta.estimator.warm_from_rows(rows)
+                eta_listo = True
+            colas = await phase("colas", db_get_colas_activas)
+            await phase("serializers", _warm_serializers, colas)
+            break
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            startup_state["error"] = str(e)
+            log.warning("Warm-up falló (%s); reintento en %.0fs", e, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    if READY_REQUIRE_ODOO:
+        await odoo_task
+
+    total = time.perf_counter() - t_start
+    STARTUP_SECONDS.labels("total").set(total)
+    startup_state.pop("error", None)
+    startup_state["time_to_ready_s"] = round(total, 4)
+    startup_state["ready"] = True
+    log.info("API lista en %.2fs %s", total, startup_state["phases"])
+
+@app.get("/ready")
+def ready():
+    body = jsonable_encoder(startup_state)
+    return Response(
+        content=json.dumps(body, ensure_ascii=False),
+        media_type="application/json",
+        status_code=200 if startup_state["ready"] else 503,
+    )
+
+# --------- Métricas (Prometheus) ---------
+
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint():
+    return Response(content=metrics.render_latest(), media_type=metrics.CONTENT_TYPE)
+
+# --------- Shards ---------
+
+@app.get("/shard/owner/{sucursal_id}")
+def shard_owner(sucursal_id: int):
+    if not shard_router:
+        return {"sucursal_id": sucursal_id, "worker": None, "url": None, "local": True}
+    return {
+        "sucursal_id": sucursal_id,
+        "worker": shard_router.owner(sucursal_id),
+        "url": shard_router.owner_url(sucursal_id),
+        "local": shard_router.is_local(sucursal_id),
+    }
+
+# --------- Admin ---------
+
+@app.get("/admin/db/top-statements", dependencies=[Depends(require_admin)])
+def admin_db_top_statements(
+    n: int = Query(db.TOP_N, ge=1, le=200),
+    order_by: str = Query("total", pattern="^(total|mean|max|calls)$"),
+):
+    return db.stats.top(n, order_by)
+
+@app.get("/admin/db/replica", dependencies=[Depends(require_admin)])
+def admin_db_replica():
+    return read_router.status()
+
+@app.get("/admin/threads", dependencies=[Depends(require_admin)])
+async def admin_threads():
+    return capacity.status()
+
+# --------- Tablero multi-sucursal ---------
+
+@app.get("/dashboard")
+async def get_dashboard(
+    sucursales: Opt[str] = Query(None, description="ids separados por coma; vacío = todas"),
+    x_dashboard_key: Opt[str] = Header(None),
+):
+    if not dashboard_key_valida(x_dashboard_key):
+        raise HTTPException(status_code=403, detail="Clave de tablero inválida")
+    try:
+        ids = dashboard.parse_sucursales(sucursales)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return await build_dashboard_snapshot(ids)
+
+# Antes que /ws/{sucursal_id}: si no, "dashboard" matchea como sucursal_id
+@app.websocket("/ws/dashboard")
+async def websocket_dashboard(websocket: WebSocket, key: Opt[str] = None, sucursales: Opt[str] = None):
+    if not dashboard_key_valida(key):
+        await websocket.close(code=4401)
+        return
+    try:
+        ids = dashboard.parse_sucursales(sucursales)
+    except ValueError:
+        await websocket.close(code=4422)
+        return
+
+    await websocket.accept()
+    sub = dashboard.DashboardSubscriber(websocket, ids)
+    # suscribir antes del snapshot: lo que cambie mientras tanto llega después
+    await manager.add_dashboard(sub)
+    # relay de otro worker (services/dashboard.py): solo sus eventos locales
+    relayed = shard_router is not None and shard_router.es_reenvio(
+        websocket.headers.get(sharding.FORWARD_HEADER), websocket.scope.get("client")
+    )
+    sender = None
+    relays: List[asyncio.Task] = []
+    try:
+        if not relayed:
+            payload = await build_dashboard_snapshot(ids)
+            await websocket.send_text(json.dumps(payload, ensure_ascii=False))
+            if shard_router:
+                headers = {sharding.FORWARD_HEADER: shard_router.forward_value()}
+                relays = [
+                    asyncio.create_task(dashboard.relay(sub, dashboard.relay_url(url, key, sucursales), headers))
+                    for worker_id, url in shard_router.workers.items()
+                    if worker_id != shard_router.self_id
+                ]
+        sender = asyncio.create_task(sub.run())
+        while True:
+            await websocket.receive_text()  # pings
+    except WebSocketDisconnect:
+        pass
+    except Exception:
+        pass
+    finally:
+        await manager.remove_dashboard(sub)
+        for task in relays:
+            task.cancel()
+        if sender is not None:
+            sender.cancel()
+
+# --------- SSE por sucursal ---------
+
+@app.get("/sse/{sucursal_id}")
+async def sse_stream(
+    sucursal_id: int,
+    token: Opt[str] = None,
+    last_event_id: Opt[str] = Header(None),
+    lastEventId: Opt[str] = Query(None, include_in_schema=False),
+):
+    # Como el WS: EventSource no deja mandar headers, el token viaja como ?token=
+    if not ws_sesion_valida(token, sucursal_id):
+        raise HTTPException(status_code=401, detail="Sesión inválida para esta sucursal")
+    return StreamingResponse(
+        # ?lastEventId= para polyfills de EventSource que no mandan el header
+        sse.hub.stream(sucursal_id, last_event_id or lastEventId, lambda: build_turno_actual_event(sucursal_id)),
+        media_type="text/event-stream",
+        headers=sse.HEADERS,
+    )
+
 # --------- WebSocket por sucursal ---------
 
 @app.websocket("/ws/{sucursal_id}")
-async def websocket_endpoint(websocket: WebSocket, sucursal_id: int):
+async def websocket_endpoint(websocket: WebSocket, sucursal_id: int, token: Opt[str] = None):
+    # El navegador no deja mandar headers en el WS: el token viaja como ?token=
+    if not ws_sesion_valida(token, sucursal_id):
+        await websocket.close(code=4401)
+        return
+
     await manager.connect(sucursal_id, websocket)
 
     # estado inicial
@@ -561,3 +1349,29 @@ async def websocket_endpoint(websocket: WebSocket, sucursal_id: int):
         await manager.disconnect(sucursal_id, websocket)
     except Exception:
         await manager.disconnect(sucursal_id, websocket)
+
+# Un turno: mensajes solo cuando cambia su posición; al salir de la cola se cierra
+@app.websocket("/ws/{sucursal_id}/posicion/{turno_id}")
+async def websocket_posicion(websocket: WebSocket, sucursal_id: int, turno_id: int, token: Opt[str] = None):
+    if not ws_sesion_valida(token, sucursal_id):
+        await websocket.close(code=4401)
+        return
+
+    await websocket.accept()
+    sub = posiciones.PosicionSubscriber(websocket, sucursal_id, turno_id)
+    # suscribir antes de calcular: lo que cambie mientras tanto llega después
+    posiciones_hub.add(sub)
+    sender = None
+    try:
+        sub.publish(posiciones.evento(sucursal_id, turno_id, await dispatcher.posicion(sucursal_id, turno_id)))
+        sender = asyncio.create_task(sub.run())
+        while True:
+            await websocket.receive_text()  # pings
+    except WebSocketDisconnect:
+        pass
+    except Exception:
+        pass
+    finally:
+        posiciones_hub.remove(sub)
+        if sender is not None:
+            sender.cancel()
@@ -0,0 +1,289 @@
+"""
+SQL de producción de la API de turnos.
+
+Vive aquí (y no inline en main.py) para que bench/query_plans.py pueda
+correr EXPLAIN sobre exactamente las mismas sentencias.
+
+turnos está particionada por mes sobre created_at (sql/002). Las consultas
+calientes llevan una cota sobre created_at para que Postgres pode las
+particiones viejas: los turnos vivos son siempre de los últimos días.
+"""
+
+import os
+
+# Un turno en espera/atendiendo más viejo que esto se considera abandonado
+VENTANA_ACTIVOS_DIAS = int(os.getenv("TURNOS_VENTANA_ACTIVOS_DIAS", "7"))
+
+# NOW() es estable: la poda ocurre al iniciar la ejecución (también con el plan cacheado)
+_RECIENTES = f"created_at >= NOW() - interval '{VENTANA_ACTIVOS_DIAS} days'"
+
+# Orden de la cola: prioridad (0 urgente .. 2 normal, sql/004) y después llegada
+TURNO_ACTUAL = f"""
+SELECT * FROM turnos
+WHERE sucursal_id = %s AND estado = 'espera'
+  AND {_RECIENTES}
+ORDER BY prioridad, created_at ASC
+LIMIT 1
+"""
+
+# La regla "un turno activo por paciente" la aplica turnos_activos (sql/003):
+# si ya hay uno, el INSERT falla con unique_violation. Una sola operación indexada.
+CREAR_TURNO_SEGURO = """
+INSERT INTO turnos (sucursal_id, nombre, edad, telefono, prioridad, estado)
+VALUES (%s, %s, %s, %s, %s, 'espera')
+RETURNING id, created_at
+"""
+
+# sucursal_id NULL = sin sesión (AUTH_REQUIRED=false): cualquier sucursal
+_FINALIZAR_TURNO = """
+UPDATE turnos
+SET estado='finalizado', updated_at=NOW()
+WHERE id=%s AND sucursal_id = COALESCE(%s, sucursal_id){ventana}
+RETURNING sucursal_id, inicio_atencion, updated_at
+"""
+FINALIZAR_TURNO = _FINALIZAR_TURNO.format(ventana=f" AND {_RECIENTES}")
+# Respaldo sin cota (recorre todas las particiones): solo si la versión acotada no encontró el turno
+FINALIZAR_TURNO_HISTORICO = _FINALIZAR_TURNO.format(ventana="")
+
+TURNO_ACTIVO_POR_TELEFONO = f"""
+SELECT 1
+FROM turnos
+WHERE sucursal_id = %s
+  AND telefono = %s
+  AND estado IN ('espera', 'atendiendo')
+  AND {_RECIENTES}
+LIMIT 1
+"""
+
+TURNO_ACTIVO_POR_NOMBRE = f"""
+SELECT 1
+FROM turnos
+WHERE sucursal_id = %s
+  AND nombre = %s
+  AND estado IN ('espera', 'atendiendo')
+  AND {_RECIENTES}
+LIMIT 1
+"""
+
+_INICIAR_TURNO = """
+UPDATE turnos
+SET estado='atendiendo', inicio_atencion=NOW(), updated_at=NOW()
+WHERE id=%s AND sucursal_id = COALESCE(%s, sucursal_id) AND estado='espera'{ventana}
+RETURNING sucursal_id, inicio_atencion
+"""
+INICIAR_TURNO = _INICIAR_TURNO.format(ventana=f" AND {_RECIENTES}")
+INICIAR_TURNO_HISTORICO = _INICIAR_TURNO.format(ventana="")
+
+TURNOS_EN_CURSO = f"""
+SELECT * FROM turnos
+WHERE sucursal_id=%s AND estado IN ('atendiendo','espera')
+  AND {_RECIENTES}
+ORDER BY (estado='atendiendo') DESC, prioridad, created_at ASC
+"""
+
+ESTADISTICAS_POR_FECHA = """
+WITH base AS (
+  SELECT
+    id, nombre, edad, telefono,
+    created_at,
+    inicio_atencion,
+    updated_at AS finalizado_at,
+    LAG(updated_at) OVER (ORDER BY created_at ASC) AS prev_finalizado
+  FROM turnos
+  WHERE sucursal_id = %(sucursal_id)s
+    AND estado = 'finalizado'
+    -- rango sargable (usa el índice sucursal_id, created_at); equivale a DATE(created_at) = fecha
+    AND created_at >= %(fecha)s::date
+    AND created_at <  %(fecha)s::date + 1
+),
+calc AS (
+  SELECT
+    *,
+    COALESCE(
+      inicio_atencion,
+      GREATEST(created_at, COALESCE(prev_finalizado, created_at))
+    ) AS inicio_calculado
+  FROM base
+)
+SELECT
+  id, nombre, edad, telefono,
+  created_at,
+  inicio_atencion,
+  inicio_calculado,
+  finalizado_at,
+
+  EXTRACT(EPOCH FROM GREATEST(inicio_calculado - created_at, interval '0')) AS espera_seg,
+  EXTRACT(EPOCH FROM GREATEST(finalizado_at - inicio_calculado, interval '0')) AS atencion_seg,
+  EXTRACT(EPOCH FROM GREATEST(finalizado_at - created_at, interval '0')) AS total_seg
+FROM calc
+ORDER BY created_at DESC
+"""
+
+# Heatmaps de staffing (services/analytics.py): una fila con las columnas como
+# arrays float8 (epoch de hora local de la sesión), sin una tupla por turno.
+# Atención = finalizado - inicio, con el mismo inicio_calculado que
+# ESTADISTICAS_POR_FECHA cuando falta inicio_atencion (LAG dentro del día).
+HEATMAP_COLUMNAS = """
+WITH rango AS (
+  SELECT created_at, inicio_atencion, estado, updated_at
+  FROM turnos
+  WHERE sucursal_id = %(sucursal_id)s
+    AND created_at >= %(desde)s::date
+    AND created_at <  %(hasta)s::date + 1
+),
+fin AS (
+  SELECT
+    created_at, inicio_atencion,
+    updated_at AS finalizado_at,
+    LAG(updated_at) OVER (PARTITION BY created_at::date ORDER BY created_at) AS prev_finalizado
+  FROM rango
+  WHERE estado = 'finalizado'
+),
+calc AS (
+  SELECT
+    finalizado_at,
+    COALESCE(
+      inicio_atencion,
+      GREATEST(created_at, COALESCE(prev_finalizado, created_at))
+    ) AS inicio_calculado
+  FROM fin
+)
+SELECT
+  (SELECT COALESCE(array_agg(EXTRACT(EPOCH FROM created_at::timestamp)::float8), '{}') FROM rango) AS llegada,
+  COALESCE(array_agg(EXTRACT(EPOCH FROM inicio_calculado::timestamp)::float8), '{}') AS inicio,
+  COALESCE(array_agg(EXTRACT(EPOCH FROM GREATEST(finalizado_at - inicio_calculado, interval '0'))::float8), '{}')
+    AS atencion_seg
+FROM calc
+"""
+
+_SUCURSAL_DE_TURNO = """
+SELECT sucursal_id FROM turnos WHERE id = %s{ventana}
+"""
+SUCURSAL_DE_TURNO = _SUCURSAL_DE_TURNO.format(ventana=f" AND {_RECIENTES}")
+SUCURSAL_DE_TURNO_HISTORICO = _SUCURSAL_DE_TURNO.format(ventana="")
+
+# Precarga del estimador de ETA: promedio de atención por sucursal y hora del día
+ETA_WARMUP = """
+SELECT
+  sucursal_id,
+  EXTRACT(HOUR FROM inicio_atencion)::int AS hora,
+  AVG(EXTRACT(EPOCH FROM updated_at - inicio_atencion)) AS promedio_seg,
+  COUNT(*) AS n
+FROM turnos
+WHERE estado = 'finalizado'
+  AND inicio_atencion IS NOT NULL
+  AND created_at >= NOW() - make_interval(days => %(dias)s)
+  AND updated_at - inicio_atencion
+      BETWEEN make_interval(secs => %(min_seg)s) AND make_interval(secs => %(max_seg)s)
+GROUP BY 1, 2
+"""
+
+# Warm-up: todas las colas vivas de una vez (mismo orden que TURNOS_EN_CURSO)
+COLAS_ACTIVAS = f"""
+SELECT * FROM turnos
+WHERE estado IN ('atendiendo','espera')
+  AND {_RECIENTES}
+ORDER BY sucursal_id, (estado='atendiendo') DESC, prioridad, created_at ASC
+"""
+
+# Despacho multi-consultorio (services/dispatch.py, sql/004). La cola en memoria
+# se arma con DISPATCH_ESPERA; el estado de los consultorios trae el turno en atención.
+# También vienen los 'atendiendo': los iniciados con /iniciar-turno no tienen consultorio.
+DISPATCH_ESPERA = f"""
+SELECT id, prioridad, created_at, estado FROM turnos
+WHERE sucursal_id = %s AND estado IN ('espera', 'atendiendo')
+  AND {_RECIENTES}
+"""
+
+DISPATCH_CONSULTORIOS = f"""
+SELECT c.numero, c.nombre, to_jsonb(t) AS turno
+FROM consultorios c
+LEFT JOIN turnos t
+  ON t.id = c.turno_id AND t.estado = 'atendiendo' AND t.{_RECIENTES}
+WHERE c.sucursal_id = %s AND c.activo
+ORDER BY c.numero
+"""
+
+# Reclamo atómico, en una transacción: ocupar el consultorio (lock de la fila)
+# y pasar el turno a 'atendiendo' solo si sigue en espera.
+CONSULTORIO_OCUPAR = """
+UPDATE consultorios SET turno_id = %(turno_id)s, updated_at = NOW()
+WHERE sucursal_id = %(sucursal_id)s AND numero = %(numero)s AND activo AND turno_id IS NULL
+RETURNING numero
+"""
+
+RECLAMAR_TURNO = f"""
+UPDATE turnos
+SET estado = 'atendiendo', inicio_atencion = NOW(), updated_at = NOW(), consultorio = %(numero)s
+WHERE id = %(turno_id)s AND sucursal_id = %(sucursal_id)s AND estado = 'espera'
+  AND {_RECIENTES}
+RETURNING *
+"""
+
+CONSULTORIO_GUARDAR = """
+INSERT INTO consultorios (sucursal_id, numero, nombre, activo)
+VALUES (%(sucursal_id)s, %(numero)s, %(nombre)s, %(activo)s)
+ON CONFLICT (sucursal_id, numero) DO UPDATE
+    SET nombre = EXCLUDED.nombre, activo = EXCLUDED.activo, updated_at = NOW()
+"""
+
+# Tablero multi-sucursal: snapshot de N sucursales (NULL = todas) en una sola
+# query. DISTINCT ON da el turno actual de cada una (mismo criterio que
+# TURNO_ACTUAL) y los conteos salen del mismo recorrido de turnos activos.
+DASHBOARD_SNAPSHOT = f"""
+WITH activos AS (
+  SELECT * FROM turnos
+  WHERE estado IN ('atendiendo','espera')
+    AND {_RECIENTES}
+    AND (%(ids)s::int[] IS NULL OR sucursal_id = ANY(%(ids)s::int[]))
+),
+conteos AS (
+  SELECT sucursal_id,
+         COUNT(*) FILTER (WHERE estado = 'espera') AS en_espera,
+         COUNT(*) FILTER (WHERE estado = 'atendiendo') AS atendiendo,
+         MIN(created_at) FILTER (WHERE estado = 'espera') AS espera_desde
+  FROM activos
+  GROUP BY sucursal_id
+),
+actual AS (
+  SELECT DISTINCT ON (sucursal_id) *
+  FROM activos
+  WHERE estado = 'espera'
+  ORDER BY sucursal_id, prioridad, created_at ASC
+)
+SELECT s.id AS sucursal_id, s.nombre,
+       COALESCE(c.en_espera, 0) AS en_espera,
+       COALESCE(c.atendiendo, 0) AS atendiendo,
+       c.espera_desde,
+       to_jsonb(a) AS turno
+FROM sucursales s
+LEFT JOIN conteos c ON c.sucursal_id = s.id
+LEFT JOIN actual a ON a.sucursal_id = s.id
+WHERE %(ids)s::int[] IS NULL OR s.id = ANY(%(ids)s::int[])
+ORDER BY s.id
+"""
+
+# Idempotency-Key de /crear-turno. Reclamar la clave y crear el turno van en la
+# misma transacción: un reintento concurrente espera el lock de la PK y, al
+# confirmarse la primera, lee la respuesta guardada. Una clave vencida se reutiliza.
+IDEMPOTENCIA_RECLAMAR = """
+INSERT INTO idempotency_keys (sucursal_id, key, request_hash)
+VALUES (%(sucursal_id)s, %(key)s, %(request_hash)s)
+ON CONFLICT (sucursal_id, key) DO UPDATE
+    SET request_hash = EXCLUDED.request_hash, status_code = NULL, response = NULL, created_at = NOW()
+    WHERE idempotency_keys.created_at < NOW() - make_interval(secs => %(ttl_s)s)
+RETURNING 1
+"""
+
+IDEMPOTENCIA_OBTENER = """
+SELECT request_hash, status_code, response
+FROM idempotency_keys
+WHERE sucursal_id = %(sucursal_id)s AND key = %(key)s
+  AND created_at >= NOW() - make_interval(secs => %(ttl_s)s)
+"""
+
+IDEMPOTENCIA_GUARDAR = """
+UPDATE idempotency_keys
+SET status_code = %(status_code)s, response = %(response)s
+WHERE sucursal_id = %(sucursal_id)s AND key = %(key)s
+"""
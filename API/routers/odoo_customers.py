@@ -1,12 +1,20 @@
+import asyncio
 import logging
+import os
 import re
+import secrets
+from collections import OrderedDict
 from typing import Iterable, List, Optional
 
 import anyio
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field
 
-from services.odoo_service import OdooClient
+from services import auth_service as auth
+from services import capacity
+from services import odoo_health as health
+from services import partner_index
 
 router = APIRouter(prefix="/odoo", tags=["odoo"])
 log = logging.getLogger("uvicorn.error")
@@ -16,6 +24,13 @@ log = logging.getLogger("uvicorn.error")
 # Helpers (PHONE / NAME)
 # =======================
 
+def odoo_client():
+    """Import diferido: xmlrpc y el cliente de Odoo no se cargan al arrancar la API."""
+    from services.odoo_service import OdooClient
+
+    return OdooClient()
+
+
 def phone_digits(raw: Optional[str]) -> Optional[str]:
     """Devuelve SOLO dígitos. Ignora +, espacios, guiones, paréntesis, etc."""
     if not raw:
@@ -144,6 +159,19 @@ class SelectOrCreateOut(BaseModel):
     partner: PartnerOut
 
 
+class ClienteImportIn(BaseModel):
+    nombre: str = ""
+    apellido: Optional[str] = None
+    edad: Optional[int] = None
+    telefono: Optional[str] = None
+
+
+class ImportarIn(BaseModel):
+    clientes: List[ClienteImportIn] = Field(..., min_length=1, max_length=50_000)
+    actualizar: bool = False
+    lote: int = Field(200, ge=1, le=1000)
+
+
 # =======================
 # Routes
 # =======================
@@ -151,55 +179,76 @@ class SelectOrCreateOut(BaseModel):
 @router.get("/health")
 async def odoo_health():
     """
-    Te dice:
-      - version de Odoo
-      - si autentica (uid)
-      - (si permite) lista de DBs
+    Estado de Odoo desde el monitor en segundo plano (no hace RPCs):
+    version, uid, dbs del último sondeo + p50/p99, tasa de error y tiempo
+    desde el último éxito. 503 si Odoo está caído o deshabilitado.
     """
-    try:
-        client = OdooClient()
-        version = await anyio.to_thread.run_sync(client.version)
-        uid = await anyio.to_thread.run_sync(client.authenticate)
+    snap = health.monitor.snapshot()
+    return JSONResponse(content=snap, status_code=200 if snap["ok"] else 503)
 
-        dbs = None
-        try:
-            dbs = await anyio.to_thread.run_sync(client.list_dbs)
-        except Exception:
-            dbs = None
 
-        return {"ok": True, "version": version, "uid": uid, "dbs": dbs}
-    except Exception as e:
-        log.exception("Odoo health failed")
-        raise HTTPException(status_code=500, detail=str(e))
+def require_odoo() -> None:
+    """Dependencia: falla rápido con 503 en vez de esperar el timeout de XML-RPC."""
+    if not health.monitor.is_up():
+        snap = health.monitor.snapshot()
+        raise HTTPException(
+            status_code=503,
+            detail=f"Odoo no disponible ({snap['status']}): {snap['last_error'] or 'sin detalle'}",
+        )
 
 
 @router.get("/clientes/buscar", response_model=List[PartnerOut])
 async def buscar_clientes(
     q: str = Query(..., min_length=2),
     limit: int = Query(10, ge=1, le=25),
+    x_search_session: Optional[str] = Header(None),
 ):
+    """
+    Autocompletado: con el índice local cargado responde en memoria sin tocar
+    Odoo (services/partner_index.py). Si no, va a Odoo; con X-Search-Session
+    (un id por cuadro de búsqueda) la búsqueda anterior que siga en vuelo se
+    cancela y responde 409.
+    """
+    if partner_index.index.ready:
+        return partner_index.index.buscar(q, limit)
+
+    require_odoo()
     try:
-        client = OdooClient()
-        partners = await anyio.to_thread.run_sync(client.search_partners, q, limit)
-        return partners
+        client = odoo_client()
+
+        async def remota():
+            with partner_index.PARTNER_SEARCH_SECONDS.labels("odoo").time():
+                # abandon_on_cancel: al reemplazarla se responde ya; el RPC termina solo en su hilo
+                return await capacity.run("odoo", client.search_partners, q, limit, abandon_on_cancel=True)
+
+        return await partner_index.en_vuelo.correr(x_search_session, remota())
+    except partner_index.Superseded:
+        raise HTTPException(status_code=409, detail="Búsqueda reemplazada por una más nueva")
     except Exception as e:
         log.exception("Odoo buscar_clientes failed")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/clientes/{partner_id}/telefono", response_model=PartnerOut)
+@router.get("/clientes/indice")
+async def indice_clientes():
+    """Estado del índice local de autocompletado (tamaño, última sincronización)."""
+    return partner_index.index.status()
+
+
+@router.post("/clientes/{partner_id}/telefono", response_model=PartnerOut, dependencies=[Depends(require_odoo)])
 async def actualizar_telefono(partner_id: int, data: UpdateTelefonoIn):
     """
     Actualiza el teléfono guardándolo SIEMPRE como: +1 XXX-XXX-XXXX
     y mantiene compatibilidad de comparación por dígitos en otras rutas.
     """
     try:
-        client = OdooClient()
+        client = odoo_client()
         tel_store = phone_store_pretty_plus1(data.telefono)
 
-        updated = await anyio.to_thread.run_sync(
-            client.update_partner_phone, partner_id, tel_store
+        updated = await capacity.run(
+            "odoo", client.update_partner_phone, partner_id, tel_store
         )
+        partner_index.index.upsert(updated)
 
         # Devuelve bonito hacia la UI (sin tocar DB extra)
         updated = dict(updated)
@@ -214,7 +263,7 @@ async def actualizar_telefono(partner_id: int, data: UpdateTelefonoIn):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/clientes/seleccionar-o-crear")
+@router.post("/clientes/seleccionar-o-crear", dependencies=[Depends(require_odoo)])
 async def seleccionar_o_crear(data: PartnerCreateIn):
     """
     Flujo nuevo:
@@ -226,7 +275,7 @@ async def seleccionar_o_crear(data: PartnerCreateIn):
     3) Si no encuentra nada: crea el cliente en Odoo.
     """
     try:
-        client = OdooClient()
+        client = odoo_client()
 
         nombre = data.nombre.strip()
         apellido = (data.apellido or "").strip()
@@ -266,7 +315,7 @@ async def seleccionar_o_crear(data: PartnerCreateIn):
 
             by_id = {}
             for term in search_terms:
-                candidates = await anyio.to_thread.run_sync(client.search_partners, term, 25)
+                candidates = await capacity.run("odoo", client.search_partners, term, 25)
                 for p in candidates:
                     pid = p.get("id")
                     if pid is not None:
@@ -324,7 +373,7 @@ async def seleccionar_o_crear(data: PartnerCreateIn):
 
             by_id = {}
             for term in name_terms:
-                candidates = await anyio.to_thread.run_sync(client.search_partners, term, 50)
+                candidates = await capacity.run("odoo", client.search_partners, term, 50)
                 for p in candidates:
                     pid = p.get("id")
                     if pid is not None:
@@ -359,13 +408,15 @@ async def seleccionar_o_crear(data: PartnerCreateIn):
         # ==========================================================
         # 3) Si no hubo match ni por teléfono ni por nombre, crear
         # ==========================================================
-        created = await anyio.to_thread.run_sync(
+        created = await capacity.run(
+            "odoo",
             client.create_partner,
             nombre,
             (apellido or None),
             data.edad,
             tel_store,
         )
+        partner_index.index.upsert(created)
 
         created = partner_for_ui(created)
 
@@ -381,3 +432,85 @@ async def seleccionar_o_crear(data: PartnerCreateIn):
     except Exception as e:
         log.exception("Odoo seleccionar_o_crear failed")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+# =======================
+# Importación masiva (jobs/odoo_import.py)
+# =======================
+
+MAX_IMPORTACIONES = 20  # terminadas que se guardan para consultar
+
+importaciones: "OrderedDict[str, dict]" = OrderedDict()
+
+
+def require_admin(x_admin_key: Optional[str] = Header(None)) -> None:
+    """Misma regla que main.require_admin (el router no importa main)."""
+    admin_key = (os.getenv("ADMIN_KEY", "") or "").strip()
+    if not admin_key or not x_admin_key or not auth.secret_equals(x_admin_key, admin_key):
+        raise HTTPException(status_code=403, detail="Acceso de administrador requerido")
+
+
+def _progreso(job_id: str) -> dict:
+    job = importaciones.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Importación no encontrada")
+    est = job["importacion"].estado
+    return {"id": job_id, **{k: v for k, v in est.items() if k != "huella"}}
+
+
+def _lanzar(job_id: str) -> None:
+    job = importaciones[job_id]
+    job["importacion"].estado["estado"] = "corriendo"  # antes de la tarea: un segundo POST ve el 409
+
+    async def correr():
+        try:
+            # un solo hilo por minutos: va al limiter por defecto para no quedarse
+            # con un token de "odoo" que necesitan las búsquedas interactivas
+            await anyio.to_thread.run_sync(job["importacion"].correr)
+        except Exception:
+            # queda en estado "error" con ultimo_error; se reanuda con POST .../reanudar
+            log.exception("Importación Odoo %s cortada", job_id)
+
+    job["task"] = asyncio.create_task(correr())
+
+
+@router.post("/clientes/importar", status_code=202, dependencies=[Depends(require_admin), Depends(require_odoo)])
+async def importar_clientes(data: ImportarIn):
+    """
+    Alta masiva de pacientes (onboarding de una clínica) en segundo plano.
+    Normaliza y deduplica por teléfono, busca existentes y crea/actualiza en
+    lotes de `lote`. Devuelve el id para consultar el progreso.
+    """
+    from jobs.odoo_import import Importacion
+
+    if any(j["importacion"].estado["estado"] == "corriendo" for j in importaciones.values()):
+        raise HTTPException(status_code=409, detail="Ya hay una importación corriendo")
+
+    filas = [c.model_dump() for c in data.clientes]
+    imp = Importacion(odoo_client(), filas, data.actualizar, data.lote)
+    job_id = secrets.token_hex(8)
+    importaciones[job_id] = {"importacion": imp, "task": None}
+    while len(importaciones) > MAX_IMPORTACIONES:
+        viejo = next(iter(importaciones))
+        if importaciones[viejo]["importacion"].estado["estado"] == "corriendo":
+            break
+        importaciones.pop(viejo)
+    _lanzar(job_id)
+    return _progreso(job_id)
+
+
+@router.get("/clientes/importar/{job_id}", dependencies=[Depends(require_admin)])
+async def progreso_importacion(job_id: str):
+    return _progreso(job_id)
+
+
+@router.post("/clientes/importar/{job_id}/reanudar", status_code=202,
+             dependencies=[Depends(require_admin), Depends(require_odoo)])
+async def reanudar_importacion(job_id: str):
+    """Sigue desde el último lote completo de una importación cortada por error."""
+    _progreso(job_id)
+    job = importaciones[job_id]
+    if job["importacion"].estado["estado"] != "error":
+        raise HTTPException(status_code=409, detail="Solo se reanuda una importación con error")
+    _lanzar(job_id)
+    return _progreso(job_id)
@@ -0,0 +1,217 @@
+"""
+Control de admisión por sucursal para las altas de turnos (/crear-turno).
+Iniciar, finalizar y llamar-siguiente quedan afuera: hacen avanzar la cola y
+no pueden esperar detrás de la ráfaga de un kiosco.
+
+Cada alta pide un "slot" para su sucursal:
+  1) token bucket por sucursal (ADMISSION_RATE por segundo, ráfaga
+     ADMISSION_BURST). Si falta un token y llega antes de ADMISSION_MAX_WAIT_S
+     se espera; si no, se rechaza con el tiempo hasta el próximo token.
+  2) tope de requests en vuelo por sucursal (ADMISSION_MAX_INFLIGHT_SUCURSAL)
+     y global (ADMISSION_MAX_INFLIGHT).
+  3) si no hay lugar, el request espera en la cola de SU sucursal (como mucho
+     ADMISSION_MAX_QUEUE por sucursal). Al liberarse un slot se atiende a las
+     sucursales en round-robin, así una ráfaga de un kiosco no deja sin
+     turno a las demás.
+
+El rechazo es la excepción Rejected con retry_after (segundos), que main.py
+convierte en 429 + Retry-After. Todo corre en el event loop: sin locks.
+En modo sharding cada sucursal vive en un solo worker, así que los límites
+por sucursal son exactos; los globales son por proceso.
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict
+
+from services import metrics
+
+ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes", "y", "on")
+RATE = float(os.getenv("ADMISSION_RATE", "2"))
+BURST = float(os.getenv("ADMISSION_BURST", "10"))
+MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "32"))
+MAX_INFLIGHT_SUCURSAL = int(os.getenv("ADMISSION_MAX_INFLIGHT_SUCURSAL", "4"))
+MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "50"))
+MAX_WAIT_S = float(os.getenv("ADMISSION_MAX_WAIT_S", "2"))
+
+ADMISSION_QUEUE_DEPTH = metrics.gauge(
+    "turnos_admission_queue_depth",
+    "Requests de escritura esperando slot, por sucursal",
+    ("sucursal_id",),
+)
+ADMISSION_INFLIGHT = metrics.gauge(
+    "turnos_admission_inflight",
+    "Requests de escritura en vuelo (todas las sucursales)",
+)
+ADMISSION_REJECTED = metrics.counter(
+    "turnos_admission_rejected_total",
+    "Requests rechazados con 429, por motivo (rate, queue_full, timeout)",
+    ("reason",),
+)
+ADMISSION_WAIT_SECONDS = metrics.histogram(
+    "turnos_admission_wait_seconds",
+    "Espera hasta obtener slot (token + cola) de los requests admitidos",
+)
+
+
+class Rejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class _Sucursal:
+    __slots__ = ("tokens", "updated", "inflight", "waiters")
+
+    def __init__(self, burst: float):
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.inflight = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        rate: float = RATE,
+        burst: float = BURST,
+        max_inflight: int = MAX_INFLIGHT,
+        max_inflight_sucursal: int = MAX_INFLIGHT_SUCURSAL,
+        max_queue: int = MAX_QUEUE,
+        max_wait_s: float = MAX_WAIT_S,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_inflight = max_inflight
+        self.max_inflight_sucursal = max_inflight_sucursal
+        self.max_queue = max_queue
+        self.max_wait_s = max_wait_s
+        self.inflight = 0
+        self._sucursales: Dict[int, _Sucursal] = {}
+        self._rr: Deque[int] = deque()  # sucursales con requests esperando, en orden de turno
+
+    def _state(self, sucursal_id: int) -> _Sucursal:
+        st = self._sucursales.get(sucursal_id)
+        if st is None:
+            st = self._sucursales[sucursal_id] = _Sucursal(self.burst)
+        return st
+
+    def _reserve_token(self, st: _Sucursal, now: float) -> float:
+        """Reserva un token; devuelve cuánto hay que esperar para que sea válido."""
+        st.tokens = min(self.burst, st.tokens + (now - st.updated) * self.rate)
+        st.updated = now
+        st.tokens -= 1.0
+        return 0.0 if st.tokens >= 0 else -st.tokens / self.rate
+
+    def _can_run(self, st: _Sucursal) -> bool:
+        return self.inflight < self.max_inflight and st.inflight < self.max_inflight_sucursal
+
+    def _grant(self, st: _Sucursal) -> None:
+        st.inflight += 1
+        self.inflight += 1
+        ADMISSION_INFLIGHT.set(self.inflight)
+
+    def _depth(self, sucursal_id: int, st: _Sucursal) -> None:
+        ADMISSION_QUEUE_DEPTH.set_or_remove(len(st.waiters), sucursal_id)
+
+    async def acquire(self, sucursal_id: int) -> None:
+        t0 = time.monotonic()
+        st = self._state(sucursal_id)
+
+        wait = self._reserve_token(st, t0)
+        if wait > self.max_wait_s:
+            st.tokens += 1.0  # devolver la reserva
+            ADMISSION_REJECTED.labels("rate").inc()
+            raise Rejected("rate", wait)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                st.tokens += 1.0
+                raise
+
+        # Camino rápido: hay lugar y nadie de esta sucursal esperando antes
+        if not st.waiters and self._can_run(st):
+            self._grant(st)
+            ADMISSION_WAIT_SECONDS.observe(time.monotonic() - t0)
+            return
+
+        if len(st.waiters) >= self.max_queue:
+            ADMISSION_REJECTED.labels("queue_full").inc()
+            raise Rejected("queue_full", 1.0 / self.rate if self.rate > 0 else 1.0)
+
+        fut = asyncio.get_running_loop().create_future()
+        st.waiters.append(fut)
+        if sucursal_id not in self._rr:
+            self._rr.append(sucursal_id)
+        self._depth(sucursal_id, st)
+
+        remaining = max(0.0, self.max_wait_s - (time.monotonic() - t0))
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), remaining)
+        except asyncio.TimeoutError:
+            if not (fut.done() and not fut.cancelled()):
+                self._abandon(sucursal_id, st, fut)
+                ADMISSION_REJECTED.labels("timeout").inc()
+                raise Rejected("timeout", self.max_wait_s)
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release(sucursal_id)  # ya tenía slot: devolverlo
+            else:
+                self._abandon(sucursal_id, st, fut)
+            raise
+        ADMISSION_WAIT_SECONDS.observe(time.monotonic() - t0)
+
+    def _abandon(self, sucursal_id: int, st: _Sucursal, fut: asyncio.Future) -> None:
+        fut.cancel()
+        try:
+            st.waiters.remove(fut)
+        except ValueError:
+            pass
+        self._depth(sucursal_id, st)
+
+    def release(self, sucursal_id: int) -> None:
+        st = self._state(sucursal_id)
+        st.inflight -= 1
+        self.inflight -= 1
+        ADMISSION_INFLIGHT.set(self.inflight)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Reparte slots libres en round-robin entre las sucursales con cola."""
+        skipped = 0
+        while self._rr and self.inflight < self.max_inflight and skipped < len(self._rr):
+            sid = self._rr.popleft()
+            st = self._sucursales[sid]
+            while st.waiters and st.waiters[0].cancelled():
+                st.waiters.popleft()
+            if not st.waiters:
+                self._depth(sid, st)
+                continue
+            if st.inflight >= self.max_inflight_sucursal:
+                # esta sucursal ya usa su tope: le toca a la siguiente
+                self._rr.append(sid)
+                skipped += 1
+                continue
+            self._grant(st)
+            st.waiters.popleft().set_result(None)
+            self._depth(sid, st)
+            if st.waiters:
+                self._rr.append(sid)
+            skipped = 0
+
+    @asynccontextmanager
+    async def slot(self, sucursal_id: int):
+        await self.acquire(sucursal_id)
+        try:
+            yield
+        finally:
+            self.release(sucursal_id)
+
+
+controller = AdmissionController()
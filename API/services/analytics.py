@@ -0,0 +1,130 @@
+"""
+Heatmaps día de semana × hora para planificar staffing: llegadas y tiempo de
+atención (mediana y p90) por sucursal sobre un rango de meses.
+
+La DB devuelve una sola fila con las columnas como arrays (queries.HEATMAP_COLUMNAS,
+epoch de hora local) y todo se calcula vectorizado con NumPy:
+  - bin = día_semana * 24 + hora, contado con bincount;
+  - percentiles por bin ordenando una vez por (bin, valor) con lexsort e
+    interpolando como np.percentile (método linear) en cada grupo.
+
+Solo se usan días cerrados (hasta ayer): un día en curso cambiaría el resultado
+a cada turno. El cache es por (sucursal, desde, hasta efectivo): cuando cierra
+un día, los rangos abiertos pasan a otra clave y se recalculan; los rangos del
+pasado siguen sirviendo hasta ANALYTICS_CACHE_TTL_S.
+
+NumPy se importa recién en el primer cálculo: no suma al arranque de la API.
+"""
+
+import os
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from services import metrics
+from services.cache import TTLCache
+
+MAX_DIAS = int(os.getenv("ANALYTICS_MAX_DIAS", "400"))
+DIAS_DEFAULT = int(os.getenv("ANALYTICS_DIAS_DEFAULT", "84"))  # 12 semanas
+CACHE_TTL_S = float(os.getenv("ANALYTICS_CACHE_TTL_S", "86400"))
+
+DIAS_SEMANA = ("lunes", "martes", "miercoles", "jueves", "viernes", "sabado", "domingo")
+BINS = 7 * 24
+
+cache = TTLCache(maxsize=int(os.getenv("ANALYTICS_CACHE_MAX", "256")), ttl=CACHE_TTL_S)
+
+ANALYTICS_CACHE = metrics.counter(
+    "turnos_analytics_cache_total",
+    "Heatmaps de staffing servidos desde cache (hit) o calculados (miss)",
+    ("outcome",),
+)
+
+
+def rango(desde: Optional[date], hasta: Optional[date], hoy: date) -> Tuple[date, date]:
+    """
+    (desde, hasta) inclusivo y recortado a días cerrados. ValueError si queda
+    vacío o supera MAX_DIAS.
+    """
+    ayer = hoy - timedelta(days=1)
+    hasta = min(hasta or ayer, ayer)
+    desde = desde or (hasta - timedelta(days=DIAS_DEFAULT - 1))
+    if desde > hasta:
+        raise ValueError(f"Rango vacío: solo hay días cerrados hasta {ayer.isoformat()}")
+    if (hasta - desde).days + 1 > MAX_DIAS:
+        raise ValueError(f"Rango demasiado largo (máx {MAX_DIAS} días)")
+    return desde, hasta
+
+
+def _bins(epoch_local):
+    """Epoch de hora local -> día_semana * 24 + hora (lunes = 0)."""
+    import numpy as np
+
+    seg = epoch_local.astype(np.int64)
+    dias = seg // 86400
+    # 1970-01-01 fue jueves: +3 deja lunes en 0
+    return ((dias + 3) % 7) * 24 + (seg % 86400) // 3600
+
+
+def percentiles_por_bin(bins, valores, qs: Sequence[float], nbins: int = BINS):
+    """
+    Percentiles de `valores` agrupados por `bins`, sin loop por grupo.
+    Devuelve una matriz (len(qs), nbins) con NaN en los bins vacíos.
+    """
+    import numpy as np
+
+    out = np.full((len(qs), nbins), np.nan)
+    if len(valores) == 0:
+        return out
+    orden = np.lexsort((valores, bins))  # por bin y, dentro del bin, por valor
+    v = valores[orden]
+    n = np.bincount(bins, minlength=nbins)
+    inicio = np.concatenate(([0], np.cumsum(n)[:-1]))
+    con_datos = n > 0
+    for i, q in enumerate(qs):
+        pos = inicio[con_datos] + q * (n[con_datos] - 1)
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.ceil(pos).astype(np.int64)
+        out[i, con_datos] = v[lo] + (v[hi] - v[lo]) * (pos - lo)
+    return out
+
+
+def _matriz(a, decimales: int) -> List[List[Optional[float]]]:
+    """(168,) -> 7 filas de 24; NaN -> None para JSON."""
+    import numpy as np
+
+    m = np.round(a.reshape(7, 24).astype(float), decimales)
+    return [[None if np.isnan(x) else float(x) for x in fila] for fila in m]
+
+
+def heatmap(cols: Dict[str, Sequence[float]], desde: date, hasta: date) -> Dict[str, Any]:
+    """cols: llegada, inicio, atencion_seg (arrays de HEATMAP_COLUMNAS)."""
+    import numpy as np
+
+    llegada = np.asarray(cols["llegada"], dtype=np.float64)
+    inicio = np.asarray(cols["inicio"], dtype=np.float64)
+    atencion = np.asarray(cols["atencion_seg"], dtype=np.float64)
+
+    llegadas = np.bincount(_bins(llegada), minlength=BINS)
+
+    # cuántos lunes, martes, ... tiene el rango: para el promedio por día
+    ordinales = np.arange(desde.toordinal(), hasta.toordinal() + 1)
+    dias = np.bincount((ordinales - 1) % 7, minlength=7)  # ordinal 1 (0001-01-01) fue lunes
+    por_dia = llegadas / np.repeat(np.maximum(dias, 1), 24)
+
+    bins_inicio = _bins(inicio)
+    atendidos = np.bincount(bins_inicio, minlength=BINS)
+    p50, p90 = percentiles_por_bin(bins_inicio, atencion, (0.5, 0.9))
+
+    return {
+        "desde": desde.isoformat(),
+        "hasta": hasta.isoformat(),
+        "dias_semana": list(DIAS_SEMANA),
+        "dias_en_rango": dict(zip(DIAS_SEMANA, (int(x) for x in dias))),
+        "total_llegadas": int(llegada.size),
+        "total_atendidos": int(atencion.size),
+        # filas = día de semana (lunes primero), columnas = hora 0..23
+        "llegadas": _matriz(llegadas, 0),
+        "llegadas_promedio_por_dia": _matriz(por_dia, 2),
+        "atendidos": _matriz(atendidos, 0),
+        "atencion_mediana_seg": _matriz(p50, 1),
+        "atencion_p90_seg": _matriz(p90, 1),
+    }
@@ -0,0 +1,160 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+log = logging.getLogger("uvicorn.error")
+
+# Formato guardado en sucursales.password_hash:
+#   pbkdf2_sha256$<iteraciones>$<salt_b64>$<hash_b64>
+HASH_PREFIX = "pbkdf2_sha256"
+HASH_ITERATIONS = int(os.getenv("AUTH_HASH_ITERATIONS", "260000"))
+
+TOKEN_TTL_SEG = int(os.getenv("AUTH_TOKEN_TTL", str(12 * 3600)))
+
+
+def _b64e(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _b64d(s: str) -> bytes:
+    return base64.urlsafe_b64decode(s + "=" * (-len(s) % 4))
+
+
+# =======================
+# Password hashing (corre en procesos hijos)
+# =======================
+
+def hash_password(password: str, iterations: int = HASH_ITERATIONS) -> str:
+    salt = secrets.token_bytes(16)
+    dk = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return f"{HASH_PREFIX}${iterations}${_b64e(salt)}${_b64e(dk)}"
+
+
+def is_hashed(stored: Optional[str]) -> bool:
+    return bool(stored) and stored.startswith(HASH_PREFIX + "$")
+
+
+def verify_password(password: str, stored: Optional[str]) -> Tuple[bool, bool]:
+    """
+    Devuelve (ok, necesita_rehash).
+    - Hash pbkdf2: compara en tiempo constante; pide rehash si las iteraciones quedaron viejas.
+    - Legado (texto plano en password_hash): compara directo y pide rehash si coincide.
+    """
+    if not stored:
+        # Igual gastamos el mismo CPU para no filtrar qué usuarios existen
+        hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), b"\0" * 16, HASH_ITERATIONS)
+        return False, False
+
+    if not is_hashed(stored):
+        ok = hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+        return ok, ok
+
+    try:
+        _, iters_s, salt_s, hash_s = stored.split("$", 3)
+        iterations = int(iters_s)
+        salt = _b64d(salt_s)
+        expected = _b64d(hash_s)
+    except ValueError:
+        return False, False
+
+    dk = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    ok = hmac.compare_digest(dk, expected)
+    return ok, ok and iterations < HASH_ITERATIONS
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        workers = int(os.getenv("AUTH_HASH_WORKERS", "2"))
+        _pool = ProcessPoolExecutor(max_workers=max(1, workers))
+    return _pool
+
+
+async def verify_password_async(password: str, stored: Optional[str]) -> Tuple[bool, bool]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_pool(), verify_password, password, stored)
+
+
+async def hash_password_async(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_pool(), hash_password, password)
+
+
+def shutdown_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+# =======================
+# Tokens de sesión firmados (HMAC-SHA256, sin estado)
+# =======================
+
+def _load_secret() -> bytes:
+    raw = (os.getenv("SESSION_SECRET", "") or "").strip()
+    if raw:
+        return raw.encode("utf-8")
+    log.warning(
+        "SESSION_SECRET no configurado: se usa uno aleatorio (los tokens no "
+        "sobreviven reinicios ni se comparten entre workers)"
+    )
+    return secrets.token_bytes(32)
+
+
+_SECRET = _load_secret()
+
+
+def _sign(body: str) -> str:
+    return _b64e(hmac.new(_SECRET, body.encode("ascii"), hashlib.sha256).digest())
+
+
+def secret_equals(given: str, expected: str) -> bool:
+    """compare_digest sobre bytes: con str falla (TypeError) si hay caracteres no ASCII."""
+    return hmac.compare_digest(given.encode("utf-8"), expected.encode("utf-8"))
+
+
+def issue_token(sucursal_id: int, ttl: int = TOKEN_TTL_SEG) -> Tuple[str, int]:
+    """Devuelve (token, expira_epoch)."""
+    now = int(time.time())
+    exp = now + int(ttl)
+    claims = {"sid": int(sucursal_id), "iat": now, "exp": exp}
+    body = _b64e(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    return f"{body}.{_sign(body)}", exp
+
+
+def verify_token(token: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Valida firma y expiración. Devuelve los claims o None. No toca la DB."""
+    if not token or "." not in token:
+        return None
+    body, sig = token.rsplit(".", 1)
+    try:
+        # viene del cliente: no ASCII o base64 roto es un token inválido, no un 500
+        if not secret_equals(sig, _sign(body)):
+            return None
+        claims = json.loads(_b64d(body))
+        if not isinstance(claims, dict) or int(claims.get("exp", 0)) < time.time():
+            return None
+    except (UnicodeError, ValueError, TypeError):
+        return None
+    return claims
+
+
+def token_from_header(authorization: Optional[str]) -> Optional[str]:
+    if not authorization:
+        return None
+    scheme, _, value = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not value.strip():
+        return None
+    return value.strip()
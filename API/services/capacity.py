@@ -0,0 +1,98 @@
+"""
+Capacidad de hilos separada por tipo de trabajo bloqueante.
+
+Antes todo iba por el limiter por defecto de anyio (40 tokens): cuando Odoo se
+ponía lento, los search_partners de 20 s de crear-turno y seleccionar-o-crear
+ocupaban los 40 y /finalizar-turno o el snapshot del WS esperaban detrás.
+Ahora cada llamada elige su pool con capacity.run(pool, fn, *args):
+
+- "odoo":    RPCs XML-RPC (THREADS_ODOO). Odoo lento llena solo este.
+- "db":      queries de la API (THREADS_DB; default DB_POOL_MAX - reserva, así
+             los hilos no se amontonan esperando conexión).
+- "critico": lo que hace avanzar la cola (iniciar, finalizar, llamar-siguiente
+             y el snapshot que se difunde después). Tokens propios
+             (THREADS_CRITICO) y, en el hilo, EN_CRITICO: puede usar las
+             conexiones que el pool reserva (DB_POOL_RESERVA_CRITICA).
+- el limiter por defecto queda para lo que no toca la DB ni Odoo: endpoints
+  `def` de FastAPI (ninguno hace queries), dependencias sync, compresión,
+  perfiles, NumPy del heatmap, armado del índice de partners.
+
+turnos_thread_queue_wait_seconds{pool} mide cuánto se esperó un token antes
+de entrar al hilo; turnos_thread_in_use{pool} cuántos están ocupados.
+
+Con abandon_on_cancel el token se devuelve al cancelar aunque el hilo siga
+corriendo: el pool puede pasarse transitoriamente de su tamaño.
+"""
+
+import math
+import os
+import time
+from typing import Any, Callable, Dict
+
+import anyio
+
+from services import db, metrics, profiler
+
+RESERVA_CRITICA = int(os.getenv("DB_POOL_RESERVA_CRITICA", "4"))
+
+SIZES: Dict[str, int] = {
+    "db": int(os.getenv("THREADS_DB", str(max(1, int(os.getenv("DB_POOL_MAX", "20")) - RESERVA_CRITICA)))),
+    "critico": int(os.getenv("THREADS_CRITICO", str(max(1, RESERVA_CRITICA)))),
+    "odoo": int(os.getenv("THREADS_ODOO", "10")),
+}
+
+THREAD_QUEUE_WAIT_SECONDS = metrics.histogram(
+    "turnos_thread_queue_wait_seconds",
+    "Espera por un hilo libre antes de correr el trabajo bloqueante, por pool",
+    ("pool",),
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+THREAD_IN_USE = metrics.gauge(
+    "turnos_thread_in_use",
+    "Hilos ocupados por pool",
+    ("pool",),
+)
+
+_limiters: Dict[str, anyio.CapacityLimiter] = {name: anyio.CapacityLimiter(n) for name, n in SIZES.items()}
+# El token ya se tomó con el limiter del pool: el hilo en sí no se vuelve a limitar
+_SIN_LIMITE = anyio.CapacityLimiter(math.inf)
+
+
+def _en_critico(fn: Callable[..., Any], *args: Any) -> Any:
+    token = db.EN_CRITICO.set(True)
+    try:
+        return fn(*args)
+    finally:
+        db.EN_CRITICO.reset(token)
+
+
+async def run(pool: str, fn: Callable[..., Any], *args: Any, abandon_on_cancel: bool = False) -> Any:
+    limiter = _limiters[pool]
+    t0 = time.perf_counter()
+    async with limiter:
+        espera = time.perf_counter() - t0
+        THREAD_QUEUE_WAIT_SECONDS.labels(pool).observe(espera)
+        profiler.add_time("pool_wait", espera)  # en el desglose del perfil, junto a db/odoo
+        THREAD_IN_USE.labels(pool).set(limiter.borrowed_tokens)
+        try:
+            if pool == "critico":
+                return await anyio.to_thread.run_sync(
+                    _en_critico, fn, *args, limiter=_SIN_LIMITE, abandon_on_cancel=abandon_on_cancel
+                )
+            return await anyio.to_thread.run_sync(fn, *args, limiter=_SIN_LIMITE, abandon_on_cancel=abandon_on_cancel)
+        finally:
+            THREAD_IN_USE.labels(pool).set(limiter.borrowed_tokens - 1)
+
+
+def status() -> Dict[str, Any]:
+    out = {
+        name: {"total": lim.total_tokens, "en_uso": lim.borrowed_tokens, "esperando": lim.statistics().tasks_waiting}
+        for name, lim in _limiters.items()
+    }
+    default = anyio.to_thread.current_default_thread_limiter()
+    out["default"] = {
+        "total": default.total_tokens,
+        "en_uso": default.borrowed_tokens,
+        "esperando": default.statistics().tasks_waiting,
+    }
+    return out
@@ -0,0 +1,125 @@
+"""
+Tablero multi-sucursal (sala de supervisores).
+
+Una sola conexión para muchas o todas las sucursales, en vez de un
+/ws/{sucursal_id} por clínica:
+- GET /dashboard y el primer mensaje de WS /ws/dashboard son un snapshot
+  armado con UNA query (queries.DASHBOARD_SNAPSHOT), no una
+  build_turno_actual_event por sucursal;
+- después ConnectionManager.broadcast publica cada evento también en los
+  tableros suscriptos a esa sucursal: un stream multiplexado donde cada
+  mensaje lleva su sucursal_id.
+
+El tablero no frena el fan-out de las pantallas: publish() solo deja el evento
+pendiente y una tarea por tablero lo envía. Los eventos de broadcast son el
+estado completo de la sucursal, así que si el tablero se atrasa se manda solo
+el último por (sucursal, tipo, consultorio): la memoria queda acotada por
+la cantidad de sucursales y consultorios.
+
+Con sharding cada worker publica solo sus sucursales y /ws/dashboard cae en
+cualquier worker (no tiene sucursal para enrutar). El worker que recibe al
+tablero hace de agregador: además de sus eventos abre un relay() a
+/ws/dashboard de cada otro worker (con X-Shard-Forwarded: sin snapshot ni
+relays propios) y publica lo que llega en el mismo tablero. Así el cliente
+sigue teniendo UNA conexión con todas las sucursales. Si la lista de workers
+cambia, los tableros se cierran (1012) y al reconectar arman los relays nuevos.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Optional, Tuple
+from urllib.parse import urlencode
+
+from services import metrics
+
+log = logging.getLogger("uvicorn.error")
+
+MAX_SUCURSALES = 500
+RELAY_RETRY_S = float(os.getenv("DASHBOARD_RELAY_RETRY_S", "2"))
+
+DASHBOARD_CONNECTIONS = metrics.gauge(
+    "turnos_dashboard_connections",
+    "Tableros multi-sucursal conectados por WebSocket",
+)
+DASHBOARD_RELAYS = metrics.gauge(
+    "turnos_dashboard_relays",
+    "Conexiones a otros workers que alimentan tableros (modo sharding)",
+)
+DASHBOARD_COALESCED = metrics.counter(
+    "turnos_dashboard_coalesced_total",
+    "Eventos reemplazados por uno más nuevo antes de llegar al tablero",
+)
+
+
+def parse_sucursales(raw: Optional[str]) -> Optional[FrozenSet[int]]:
+    """"1,2,3" -> {1, 2, 3}; vacío o "all" -> None (todas)."""
+    raw = (raw or "").strip()
+    if not raw or raw.lower() == "all":
+        return None
+    try:
+        ids = frozenset(int(x) for x in raw.split(",") if x.strip())
+    except ValueError:
+        raise ValueError("sucursales debe ser una lista de ids separados por coma")
+    if len(ids) > MAX_SUCURSALES:
+        raise ValueError(f"Demasiadas sucursales (máx {MAX_SUCURSALES}); omitir para todas")
+    return ids
+
+
+class DashboardSubscriber:
+    def __init__(self, websocket, sucursales: Optional[FrozenSet[int]]):
+        self.websocket = websocket
+        self.sucursales = sucursales  # None = todas
+        self._pending: "OrderedDict[Tuple[int, str, Optional[int]], dict]" = OrderedDict()
+        self._wake = asyncio.Event()
+
+    def wants(self, sucursal_id: int) -> bool:
+        return self.sucursales is None or sucursal_id in self.sucursales
+
+    def publish(self, sucursal_id: int, event: dict) -> None:
+        key = (sucursal_id, event.get("type", ""), event.get("consultorio"))
+        if key in self._pending:
+            DASHBOARD_COALESCED.inc()
+            del self._pending[key]  # el nuevo va al final: orden de llegada
+        self._pending[key] = event
+        self._wake.set()
+
+    async def run(self) -> None:
+        """Envía los pendientes al WS hasta que se corte o se cancele."""
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            while self._pending:
+                _, event = self._pending.popitem(last=False)
+                await self.websocket.send_text(json.dumps(event, ensure_ascii=False))
+
+
+def relay_url(base_url: str, key: Optional[str], sucursales: Optional[str]) -> str:
+    params = {k: v for k, v in (("key", key), ("sucursales", sucursales)) if v}
+    url = base_url.replace("http", "ws", 1) + "/ws/dashboard"
+    return url + (f"?{urlencode(params)}" if params else "")
+
+
+async def relay(sub: DashboardSubscriber, url: str, headers: Dict[str, str]) -> None:
+    """Publica en `sub` los eventos del tablero de otro worker. Reconecta hasta que se cancele."""
+    from websockets.asyncio.client import connect as ws_connect
+
+    DASHBOARD_RELAYS.labels().inc()
+    try:
+        while True:
+            try:
+                async with ws_connect(url, additional_headers=headers) as upstream:
+                    async for raw in upstream:
+                        event = json.loads(raw)
+                        sid = event.get("sucursal_id")
+                        if isinstance(sid, int):
+                            sub.publish(sid, event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("Relay de tablero desde %s cortado: %r", url, e)
+            await asyncio.sleep(RELAY_RETRY_S)
+    finally:
+        DASHBOARD_RELAYS.labels().dec()
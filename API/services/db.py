@@ -0,0 +1,532 @@
+"""
+Pool de conexiones y cursores instrumentados para los helpers db_* de main.py.
+
+- get_db_connection() devuelve una PooledConnection: mismo uso que una
+  conexión psycopg2 (cursor/commit/rollback/close), pero close() la devuelve
+  al pool en vez de cerrarla.
+- Cada cur.execute(...) registra: fingerprint de la sentencia, duración,
+  filas y espera por el pool. Las sentencias lentas (DB_SLOW_QUERY_MS) se
+  loguean con los parámetros redactados (solo tipos).
+- Se mantiene un top-N rodante (ventana DB_STATS_WINDOW_S) de las sentencias
+  más caras, expuesto en /admin/db/top-statements.
+- ReadRouter manda las lecturas de reportes/listados a una réplica
+  (DB_READ_DSN) mientras su lag sea menor a DB_REPLICA_MAX_LAG_S; si no,
+  al primario. Escrituras y lecturas "read-your-writes" usan siempre el primario.
+
+Probar con dos Postgres locales (réplica por streaming en el 5433):
+    pg_basebackup -h localhost -p 5432 -U postgres -D /tmp/replica -R
+    pg_ctl -D /tmp/replica -o "-p 5433" start
+    DB_READ_DSN="host=localhost port=5433 dbname=turnos_db user=postgres password=123" uvicorn main:app
+    python -m bench.replica   # lag, visibilidad de escrituras y decisión de ruteo
+En la réplica conviene hot_standby_feedback=on: si no, los reportes largos
+pueden cancelarse por conflicto con la recuperación.
+"""
+
+import asyncio
+import hashlib
+import heapq
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import RealDictCursor
+
+from services import metrics
+
+log = logging.getLogger("uvicorn.error")
+
+SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+STATS_WINDOW_S = float(os.getenv("DB_STATS_WINDOW_S", "900"))
+TOP_N = int(os.getenv("DB_TOP_N", "20"))
+REPLICA_MAX_LAG_S = float(os.getenv("DB_REPLICA_MAX_LAG_S", "5"))
+REPLICA_CHECK_S = float(os.getenv("DB_REPLICA_CHECK_S", "2"))
+
+DB_POOL_WAIT_SECONDS = metrics.histogram(
+    "turnos_db_pool_wait_seconds",
+    "Espera para obtener una conexión del pool",
+)
+DB_STATEMENT_SECONDS = metrics.histogram(
+    "turnos_db_statement_duration_seconds",
+    "Duración de cada cur.execute por fingerprint",
+    ("fingerprint",),
+)
+
+
+DB_REPLICA_LAG_SECONDS = metrics.gauge(
+    "turnos_db_replica_lag_seconds",
+    "Lag de replay de la réplica de lectura (-1 si no responde)",
+)
+DB_READS = metrics.counter(
+    "turnos_db_reads_total",
+    "Conexiones de lectura entregadas por ReadRouter, por destino",
+    ("target",),
+)
+
+
+class PoolTimeout(RuntimeError):
+    pass
+
+
+def write_params() -> dict:
+    """Conexión al primario: DB_WRITE_DSN (DSN libpq completo) pisa DB_*. La usan la API y los jobs."""
+    if os.getenv("DB_WRITE_DSN"):
+        return {"dsn": os.getenv("DB_WRITE_DSN")}
+    return {
+        "dbname": os.getenv("DB_NAME", "turnos_db"),
+        "user": os.getenv("DB_USER", "postgres"),
+        "password": os.getenv("DB_PASSWORD", "123"),
+        "host": os.getenv("DB_HOST", "localhost"),
+        "port": os.getenv("DB_PORT", "5432"),
+    }
+
+
+# =======================
+# Fingerprint + redacción
+# =======================
+
+_ws_re = re.compile(r"\s+")
+_comment_re = re.compile(r"--[^\n]*")
+_literal_re = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%\(\w+\)s|%s")
+
+
+def normalize_sql(sql: str) -> str:
+    s = _comment_re.sub(" ", sql)
+    s = _literal_re.sub("?", s)
+    return _ws_re.sub(" ", s).strip()
+
+
+_fp_cache: Dict[str, Tuple[str, str]] = {}
+
+
+def fingerprint(sql: str) -> Tuple[str, str]:
+    """Devuelve (id corto, sql normalizado). Cacheado: las sentencias de la API son fijas."""
+    hit = _fp_cache.get(sql)
+    if hit is None:
+        norm = normalize_sql(sql)
+        hit = (hashlib.sha1(norm.encode("utf-8")).hexdigest()[:12], norm)
+        if len(_fp_cache) < 4096:
+            _fp_cache[sql] = hit
+    return hit
+
+
+def redact_params(params: Any) -> Any:
+    """Nunca loguear teléfonos/nombres: solo el tipo de cada parámetro."""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {k: f"<{type(v).__name__}>" for k, v in params.items()}
+    if isinstance(params, (list, tuple)):
+        return [f"<{type(v).__name__}>" for v in params]
+    return f"<{type(params).__name__}>"
+
+
+# =======================
+# Estadísticas rodantes
+# =======================
+
+class _Agg:
+    __slots__ = ("sql", "calls", "total_s", "max_s", "rows", "pool_wait_s")
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.calls = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+        self.rows = 0
+        self.pool_wait_s = 0.0
+
+
+class StatementStats:
+    """
+    Dos ventanas (actual + anterior) que rotan cada `window_s`: el top-N
+    refleja siempre entre window_s y 2*window_s de historia reciente.
+    """
+
+    def __init__(self, window_s: float, top_n: int):
+        self.window_s = window_s
+        self.top_n = top_n
+        self._lock = threading.Lock()
+        self._cur: Dict[str, _Agg] = {}
+        self._prev: Dict[str, _Agg] = {}
+        self._slowest: List[Tuple[float, int, dict]] = []  # min-heap de ejecuciones individuales
+        self._slowest_prev: List[Tuple[float, int, dict]] = []
+        self._seq = 0
+        self._rotated_at = time.monotonic()
+
+    def _maybe_rotate(self, now: float) -> None:
+        if now - self._rotated_at >= self.window_s:
+            self._prev, self._cur = self._cur, {}
+            self._slowest_prev, self._slowest = self._slowest, []
+            self._rotated_at = now
+
+    def record(self, fp: str, sql: str, seconds: float, rows: int, pool_wait_s: float, params: Any) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._maybe_rotate(now)
+            agg = self._cur.get(fp)
+            if agg is None:
+                agg = self._cur[fp] = _Agg(sql)
+            agg.calls += 1
+            agg.total_s += seconds
+            agg.rows += max(rows, 0)
+            agg.pool_wait_s += pool_wait_s
+            if seconds > agg.max_s:
+                agg.max_s = seconds
+
+            if len(self._slowest) < self.top_n or seconds > self._slowest[0][0]:
+                self._seq += 1
+                item = (seconds, self._seq, {
+                    "fingerprint": fp,
+                    "ms": round(seconds * 1000.0, 3),
+                    "rows": rows,
+                    "pool_wait_ms": round(pool_wait_s * 1000.0, 3),
+                    "params": redact_params(params),
+                    "at": time.time(),
+                })
+                if len(self._slowest) < self.top_n:
+                    heapq.heappush(self._slowest, item)
+                else:
+                    heapq.heapreplace(self._slowest, item)
+
+    def top(self, n: Optional[int] = None, order_by: str = "total") -> dict:
+        n = n or self.top_n
+        with self._lock:
+            self._maybe_rotate(time.monotonic())
+            merged: Dict[str, dict] = {}
+            for src in (self._prev, self._cur):
+                for fp, a in src.items():
+                    m = merged.setdefault(fp, {
+                        "fingerprint": fp, "sql": a.sql, "calls": 0, "total_ms": 0.0,
+                        "max_ms": 0.0, "rows": 0, "pool_wait_ms": 0.0,
+                    })
+                    m["calls"] += a.calls
+                    m["total_ms"] += a.total_s * 1000.0
+                    m["max_ms"] = max(m["max_ms"], a.max_s * 1000.0)
+                    m["rows"] += a.rows
+                    m["pool_wait_ms"] += a.pool_wait_s * 1000.0
+            slowest = sorted(self._slowest + self._slowest_prev, reverse=True)[:n]
+
+        for m in merged.values():
+            m["mean_ms"] = m["total_ms"] / m["calls"] if m["calls"] else 0.0
+            for k in ("total_ms", "max_ms", "mean_ms", "pool_wait_ms"):
+                m[k] = round(m[k], 3)
+
+        key = {"total": "total_ms", "mean": "mean_ms", "max": "max_ms", "calls": "calls"}.get(order_by, "total_ms")
+        statements = sorted(merged.values(), key=lambda m: m[key], reverse=True)[:n]
+        return {
+            "window_s": self.window_s,
+            "order_by": key,
+            "statements": statements,
+            "slowest_executions": [item for _, _, item in slowest],
+        }
+
+
+stats = StatementStats(STATS_WINDOW_S, TOP_N)
+
+
+# =======================
+# Cursores instrumentados
+# =======================
+
+class _TimedCursorMixin:
+    # lo setea PooledConnection.cursor()
+    _pool_wait_s: float = 0.0
+
+    def execute(self, query, vars=None):
+        sql = query if isinstance(query, str) else query.decode("utf-8", "replace")
+        fp, norm = fingerprint(sql)
+        t0 = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            dt = time.perf_counter() - t0
+            rows = self.rowcount
+            wait = self._pool_wait_s
+            self._pool_wait_s = 0.0  # la espera del pool se atribuye solo a la primera sentencia
+            DB_STATEMENT_SECONDS.labels(fp).observe(dt)
+            stats.record(fp, norm, dt, rows, wait, vars)
+            if dt * 1000.0 >= SLOW_QUERY_MS:
+                log.warning(
+                    "slow query fp=%s %.1fms rows=%s pool_wait=%.1fms params=%s sql=%s",
+                    fp, dt * 1000.0, rows, wait * 1000.0, redact_params(vars), norm,
+                )
+
+
+class TimedCursor(_TimedCursorMixin, psycopg2.extensions.cursor):
+    pass
+
+
+class TimedRealDictCursor(_TimedCursorMixin, RealDictCursor):
+    pass
+
+
+_TIMED_FACTORIES = {
+    None: TimedCursor,
+    psycopg2.extensions.cursor: TimedCursor,
+    RealDictCursor: TimedRealDictCursor,
+}
+
+
+# =======================
+# Pool
+# =======================
+
+# True en el hilo de una operación que avanza la cola (services/capacity.py, pool
+# "critico"): puede usar las conexiones reservadas del pool.
+EN_CRITICO: ContextVar[bool] = ContextVar("db_en_critico", default=False)
+
+
+class PooledConnection:
+    """Envuelve una conexión del pool. close() la devuelve (no la cierra)."""
+
+    def __init__(self, pool: "ConnectionPool", raw, pool_wait_s: float, sem: threading.BoundedSemaphore):
+        self._pool = pool
+        self._raw = raw
+        self._sem = sem
+        self._pending_wait = pool_wait_s
+        self.pool_wait_s = pool_wait_s
+
+    @property
+    def raw(self):
+        return self._raw
+
+    def cursor(self, cursor_factory=None, **kwargs):
+        factory = _TIMED_FACTORIES.get(cursor_factory)
+        if factory is None:
+            # factory desconocida: se usa tal cual, sin instrumentar
+            return self._raw.cursor(cursor_factory=cursor_factory, **kwargs)
+        cur = self._raw.cursor(cursor_factory=factory, **kwargs)
+        cur._pool_wait_s, self._pending_wait = self._pending_wait, 0.0
+        return cur
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def close(self):
+        if self._raw is None:
+            return
+        raw, self._raw = self._raw, None
+        self._pool.putconn(raw, self._sem)
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+class ConnectionPool:
+    """
+    `reserva` conexiones de maxconn quedan para EN_CRITICO (iniciar, finalizar,
+    llamar-siguiente): lecturas lentas o una ráfaga de pantallas no pueden
+    dejar sin conexión a lo que hace avanzar la cola.
+    """
+
+    def __init__(self, params: dict, maxconn: int, timeout_s: float, reserva: int = 0):
+        self.params = params
+        self.maxconn = maxconn
+        self.timeout_s = timeout_s
+        self.reserva = max(0, min(reserva, maxconn - 1))
+        self._idle: Deque[Any] = deque()
+        self._lock = threading.Lock()
+        self._sem = threading.BoundedSemaphore(maxconn - self.reserva)
+        self._sem_reserva = threading.BoundedSemaphore(self.reserva) if self.reserva else None
+
+    def _connect(self):
+        return psycopg2.connect(**self.params)
+
+    def _acquire(self) -> threading.BoundedSemaphore:
+        if self._sem_reserva is None or not EN_CRITICO.get():
+            if not self._sem.acquire(timeout=self.timeout_s):
+                raise PoolTimeout(f"Sin conexiones libres en el pool tras {self.timeout_s}s")
+            return self._sem
+        # crítico: una reservada o una general, la que se libere primero
+        deadline = time.monotonic() + self.timeout_s
+        while True:
+            if self._sem_reserva.acquire(blocking=False):
+                return self._sem_reserva
+            if self._sem.acquire(blocking=False):
+                return self._sem
+            if time.monotonic() >= deadline:
+                raise PoolTimeout(f"Sin conexiones libres (ni reservadas) tras {self.timeout_s}s")
+            if self._sem_reserva.acquire(timeout=0.005):
+                return self._sem_reserva
+
+    def getconn(self) -> PooledConnection:
+        t0 = time.perf_counter()
+        sem = self._acquire()
+        wait = time.perf_counter() - t0
+        DB_POOL_WAIT_SECONDS.observe(wait)
+        try:
+            raw = None
+            with self._lock:
+                while self._idle and raw is None:
+                    raw = self._idle.pop()
+                    if raw.closed:
+                        raw = None
+            if raw is None:
+                raw = self._connect()
+        except Exception:
+            sem.release()
+            raise
+        return PooledConnection(self, raw, wait, sem)
+
+    def putconn(self, raw, sem: Optional[threading.BoundedSemaphore] = None) -> None:
+        try:
+            if not raw.closed:
+                # Terminar la transacción implícita que abre cualquier SELECT
+                if raw.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    raw.rollback()
+                with self._lock:
+                    self._idle.append(raw)
+                raw = None
+        except Exception:
+            pass
+        finally:
+            if raw is not None and not raw.closed:
+                try:
+                    raw.close()
+                except Exception:
+                    pass
+            (sem or self._sem).release()
+
+    def warm(self, n: int) -> int:
+        """Pre-abre hasta n conexiones ociosas. Devuelve cuántas quedaron listas."""
+        conns = []
+        try:
+            for _ in range(min(n, self.maxconn - self.reserva)):
+                conns.append(self.getconn())
+        finally:
+            for c in conns:
+                c.close()
+        return len(conns)
+
+    def closeall(self) -> None:
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for raw in idle:
+            try:
+                raw.close()
+            except Exception:
+                pass
+
+
+# =======================
+# Ruteo de lecturas a réplica
+# =======================
+
+# Lag 0 si la réplica ya reprodujo todo lo que escribió el primario; si no,
+# antigüedad de la última transacción reproducida (con el primario ocioso el
+# timestamp envejece aunque no falte nada: por eso se compara primero el LSN).
+_PRIMARY_LSN = "SELECT pg_current_wal_lsn()::text"
+_REPLICA_LAG = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_replay_lsn() >= %s::pg_lsn THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+
+class ReadRouter:
+    """
+    getconn_read(): réplica si está configurada, responde y su lag es menor
+    a max_lag_s; si no, primario. El lag lo mide un task de fondo (start()).
+    """
+
+    def __init__(self, primary: ConnectionPool, replica: Optional[ConnectionPool], max_lag_s: float = REPLICA_MAX_LAG_S):
+        self.primary = primary
+        self.replica = replica
+        self.max_lag_s = max_lag_s
+        self.lag_s: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._task = None
+
+    @property
+    def use_replica(self) -> bool:
+        return self.replica is not None and self.lag_s is not None and self.lag_s <= self.max_lag_s
+
+    def getconn_read(self) -> PooledConnection:
+        if self.use_replica:
+            try:
+                conn = self.replica.getconn()
+                DB_READS.labels("replica").inc()
+                return conn
+            except (PoolTimeout, psycopg2.OperationalError) as e:
+                self._mark_down(e)
+        DB_READS.labels("primary").inc()
+        return self.primary.getconn()
+
+    def _mark_down(self, e: Exception) -> None:
+        if self.lag_s is not None:
+            log.warning("No se pudo medir la réplica de lectura, lecturas al primario: %r", e)
+        self.lag_s = None
+        self.last_error = repr(e)
+        DB_REPLICA_LAG_SECONDS.set(-1)
+
+    def check_lag(self) -> Optional[float]:
+        """Mide el lag (sync, corre en un hilo). None = réplica no disponible."""
+        if self.replica is None:
+            return None
+        try:
+            p = self.primary.getconn()
+            try:
+                cur = p.raw.cursor()  # sin instrumentar: no ensucia el top-N
+                cur.execute(_PRIMARY_LSN)
+                lsn = cur.fetchone()[0]
+            finally:
+                p.close()
+            r = self.replica.getconn()
+            try:
+                cur = r.raw.cursor()
+                cur.execute(_REPLICA_LAG, (lsn,))
+                lag = float(cur.fetchone()[0])
+            finally:
+                r.close()
+        except Exception as e:
+            self._mark_down(e)
+            return None
+
+        was_ok = self.use_replica
+        self.lag_s = lag
+        self.last_error = None
+        DB_REPLICA_LAG_SECONDS.set(lag)
+        if was_ok and not self.use_replica:
+            log.warning("Réplica con %.1fs de lag (> %.1fs): lecturas al primario", lag, self.max_lag_s)
+        return lag
+
+    def status(self) -> dict:
+        return {
+            "replica_configured": self.replica is not None,
+            "use_replica": self.use_replica,
+            "lag_s": self.lag_s,
+            "max_lag_s": self.max_lag_s,
+            "last_error": self.last_error,
+        }
+
+    async def _run(self) -> None:
+        import anyio
+
+        while True:
+            await anyio.to_thread.run_sync(self.check_lag)
+            await asyncio.sleep(REPLICA_CHECK_S)
+
+    def start(self) -> None:
+        if self.replica is not None and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,359 @@
+"""
+Despacho multi-consultorio: varias consultas en paralelo por sucursal.
+
+Por sucursal se mantiene en memoria:
+- la cola de espera como heap de (prioridad, llegada, turno_id): el próximo
+  paciente sale en O(log n), sin recorrer la cola en cada llamada;
+- los consultorios activos (numero -> turno en atención) y un heap de libres.
+
+El estado persistente es la DB (turnos.prioridad, consultorios.turno_id,
+sql/004): la primera vez que se usa una sucursal, o tras invalidate(), se
+reconstruye con DISPATCH_ESPERA + DISPATCH_CONSULTORIOS. El reclamo en la DB es
+atómico (ocupa el consultorio y pasa el turno a 'atendiendo' solo si sigue en
+espera), así que la memoria puede estar atrasada sin romper nada: un turno que
+ya no está en espera se descarta y se prueba el siguiente.
+
+Los turnos que salen de la cola por otro camino (/iniciar-turno,
+/finalizar-turno desde espera) se marcan con on_salio() y se descartan al
+llegar al tope del heap (borrado perezoso).
+
+Para la posición de cada turno ("sos el #7") se mantiene además `orden`: las
+mismas claves en una lista ordenada. La posición es bisect_left (O(log n)) y
+altas/bajas mueven la cola detrás con un memmove, despreciable con colas de
+cientos. Cada cambio avisa a los listeners (services/posiciones.py) con la
+clave más chica que cambió: los turnos de adelante no se movieron.
+
+El estado es por proceso: con varios workers hay que usar sharding por
+sucursal (services/sharding.py). Si la cola en memoria se vacía se relee la DB
+(como mucho cada DISPATCH_RELOAD_MIN_S) por si otro proceso creó turnos, y
+cada DISPATCH_RESYNC_S se resincroniza igual.
+"""
+
+import asyncio
+import bisect
+import heapq
+import math
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from services import capacity, metrics
+
+PRIORIDADES = {0: "urgente", 1: "preferente", 2: "normal"}
+PRIORIDAD_DEFAULT = 2
+RELOAD_MIN_S = float(os.getenv("DISPATCH_RELOAD_MIN_S", "5"))
+# Resincronización periódica con la DB (cambios de consultorios, escrituras de otros procesos)
+RESYNC_S = float(os.getenv("DISPATCH_RESYNC_S", "60"))
+
+DISPATCH_QUEUE_DEPTH = metrics.gauge(
+    "turnos_dispatch_queue_depth",
+    "Turnos en espera en la cola en memoria del despacho, por sucursal",
+    ("sucursal_id",),
+)
+DISPATCH_CLAIMS = metrics.counter(
+    "turnos_dispatch_claims_total",
+    "Llamados a consultorio por resultado (ok, vacia, descartado, ocupado)",
+    ("outcome",),
+)
+
+_Key = Tuple[int, float, int]  # (prioridad, llegada epoch, turno_id)
+# Mayor que cualquier clave: cambió algo que no mueve a nadie en espera (un turno atendido terminó)
+_FIN = (math.inf, math.inf, math.inf)
+
+# listener(sucursal_id, desde): la clave más chica que cambió; None = pudo cambiar todo
+CambioListener = Callable[[int, Optional[_Key]], None]
+
+
+class ConsultorioNoDisponible(Exception):
+    """No existe, está inactivo, está ocupado o no hay ninguno libre: 409."""
+
+
+class ConsultorioOcupado(ConsultorioNoDisponible):
+    """El reclamo en la DB encontró el consultorio ocupado (estado en memoria viejo)."""
+
+
+def _epoch(ts: Any) -> float:
+    return ts.timestamp() if hasattr(ts, "timestamp") else float(ts or time.time())
+
+
+class _Sucursal:
+    __slots__ = (
+        "heap", "vivos", "orden", "consultorios", "nombres", "en_atencion", "libres", "lock", "loaded", "loaded_at",
+    )
+
+    def __init__(self):
+        self.heap: List[_Key] = []
+        self.vivos: Dict[int, _Key] = {}
+        self.orden: List[_Key] = []  # las claves de vivos, ordenadas
+        self.consultorios: Dict[int, Optional[dict]] = {}
+        self.nombres: Dict[int, Optional[str]] = {}
+        self.en_atencion: Dict[int, Optional[int]] = {}  # turno_id -> consultorio (None: /iniciar-turno)
+        self.libres: List[int] = []
+        self.lock = asyncio.Lock()
+        self.loaded = False
+        self.loaded_at = 0.0
+
+
+class DispatchEngine:
+    def __init__(
+        self,
+        cargar: Callable[[int], Tuple[Iterable[tuple], Iterable[dict]]],
+        reclamar: Callable[[int, int, int], Optional[dict]],
+    ):
+        # cargar(sucursal_id) -> (filas (id, prioridad, created_at, estado), consultorios {numero, nombre, turno})
+        # reclamar(sucursal_id, numero, turno_id) -> turno | None si ya no estaba en espera;
+        #   ConsultorioOcupado si el consultorio no estaba libre. Ambas sync (corren en un hilo).
+        self._cargar = cargar
+        self._reclamar = reclamar
+        self._sucursales: Dict[int, _Sucursal] = {}
+        self._listeners: List[CambioListener] = []
+
+    def add_listener(self, cb: CambioListener) -> None:
+        self._listeners.append(cb)
+
+    def _cambio(self, sucursal_id: int, desde: Optional[_Key]) -> None:
+        for cb in self._listeners:
+            cb(sucursal_id, desde)
+
+    def _state(self, sucursal_id: int) -> _Sucursal:
+        st = self._sucursales.get(sucursal_id)
+        if st is None:
+            st = self._sucursales[sucursal_id] = _Sucursal()
+        return st
+
+    # ---- carga / recuperación ----
+
+    async def _load(self, sucursal_id: int, st: _Sucursal) -> None:
+        t0 = time.time()
+        espera, consultorios = await capacity.run("db", self._cargar, sucursal_id)
+        # La DB manda; solo se conservan los on_nuevo recientes, que la query pudo no ver
+        vivos = {tid: k for tid, k in st.vivos.items() if k[1] >= t0 - 5.0}
+        st.consultorios, st.nombres, st.en_atencion = {}, {}, {}
+        for turno_id, prioridad, created_at, estado in espera:
+            if estado == "atendiendo":
+                vivos.pop(turno_id, None)
+                st.en_atencion[turno_id] = None  # si tiene consultorio, lo pisa el loop de abajo
+            else:
+                vivos[turno_id] = (prioridad, _epoch(created_at), turno_id)
+        for c in consultorios:
+            turno = c.get("turno")
+            st.consultorios[c["numero"]] = turno
+            st.nombres[c["numero"]] = c.get("nombre")
+            if turno:
+                st.en_atencion[turno["id"]] = c["numero"]
+                vivos.pop(turno["id"], None)
+        st.vivos = vivos
+        st.heap = list(vivos.values())
+        heapq.heapify(st.heap)
+        st.orden = sorted(vivos.values())
+        st.libres = [n for n, t in st.consultorios.items() if t is None]
+        heapq.heapify(st.libres)
+        st.loaded, st.loaded_at = True, time.monotonic()
+        DISPATCH_QUEUE_DEPTH.labels(sucursal_id).set(len(st.vivos))
+        self._cambio(sucursal_id, None)
+
+    def _stale(self, st: _Sucursal) -> bool:
+        return not st.loaded or time.monotonic() - st.loaded_at > RESYNC_S
+
+    async def _ensure(self, sucursal_id: int) -> _Sucursal:
+        st = self._state(sucursal_id)
+        if self._stale(st):
+            async with st.lock:
+                if self._stale(st):
+                    await self._load(sucursal_id, st)
+        return st
+
+    def invalidate(self, sucursal_id: int) -> None:
+        """Fuerza releer la DB en el próximo uso (p.ej. cambió la lista de consultorios)."""
+        st = self._sucursales.get(sucursal_id)
+        if st is not None:
+            st.loaded = False
+
+    # ---- alta / baja en la espera (vivos, heap y orden juntos) ----
+
+    def _agregar(self, st: _Sucursal, key: _Key) -> None:
+        viejo = st.vivos.get(key[2])
+        if viejo is not None:
+            self._quitar(st, viejo)
+        st.vivos[key[2]] = key
+        heapq.heappush(st.heap, key)
+        bisect.insort(st.orden, key)
+
+    def _quitar(self, st: _Sucursal, key: _Key) -> None:
+        # el heap se limpia solo al llegar al tope (borrado perezoso)
+        del st.vivos[key[2]]
+        i = bisect.bisect_left(st.orden, key)
+        if i < len(st.orden) and st.orden[i] == key:
+            del st.orden[i]
+
+    # ---- notificaciones de los otros endpoints ----
+
+    def on_nuevo(self, sucursal_id: int, turno_id: int, prioridad: int, created_at: Any = None) -> None:
+        # created_at de la fila: el mismo orden que ORDER BY prioridad, created_at
+        st = self._state(sucursal_id)
+        key = (prioridad, _epoch(created_at), turno_id)
+        self._agregar(st, key)
+        DISPATCH_QUEUE_DEPTH.labels(sucursal_id).set(len(st.vivos))
+        self._cambio(sucursal_id, key)
+
+    def on_salio(self, sucursal_id: int, turno_id: int) -> None:
+        """El turno dejó la espera sin pasar por el despacho."""
+        st = self._sucursales.get(sucursal_id)
+        key = st.vivos.get(turno_id) if st is not None else None
+        if key is not None:
+            self._quitar(st, key)
+            DISPATCH_QUEUE_DEPTH.labels(sucursal_id).set(len(st.vivos))
+            self._cambio(sucursal_id, key)
+
+    def on_iniciado(self, sucursal_id: int, turno_id: int) -> None:
+        """/iniciar-turno: sale de la espera y queda en atención, sin consultorio."""
+        st = self._state(sucursal_id)
+        key = st.vivos.get(turno_id)
+        if key is not None:
+            self._quitar(st, key)
+            DISPATCH_QUEUE_DEPTH.labels(sucursal_id).set(len(st.vivos))
+        st.en_atencion.setdefault(turno_id, None)
+        self._cambio(sucursal_id, key or _FIN)
+
+    def on_finalizado(self, sucursal_id: int, turno_id: int) -> Optional[int]:
+        """Libera el consultorio del turno (si tenía). Devuelve su número."""
+        self.on_salio(sucursal_id, turno_id)
+        st = self._sucursales.get(sucursal_id)
+        if st is None or turno_id not in st.en_atencion:
+            return None
+        numero = st.en_atencion.pop(turno_id)
+        if numero is not None and numero in st.consultorios:
+            st.consultorios[numero] = None
+            heapq.heappush(st.libres, numero)
+        self._cambio(sucursal_id, _FIN)
+        return numero
+
+    def consultorios_activos(self, sucursal_id: int) -> Optional[int]:
+        """Consultorios activos según la última carga; None si la sucursal no usa el despacho."""
+        st = self._sucursales.get(sucursal_id)
+        if st is None or not st.loaded or not st.consultorios:
+            return None
+        return len(st.consultorios)
+
+    # ---- posición por turno ----
+
+    def clave(self, sucursal_id: int, turno_id: int) -> Optional[_Key]:
+        """Clave del turno si está en espera (para saber si un cambio lo mueve)."""
+        st = self._sucursales.get(sucursal_id)
+        return st.vivos.get(turno_id) if st is not None else None
+
+    def posicion_local(self, sucursal_id: int, turno_id: int) -> Optional[dict]:
+        """
+        Con lo que hay en memoria, sin ir a la DB. En espera: posición (1 = el
+        próximo) y cuántos hay adelante; atendiendo: consultorio. None si no
+        está en la cola de este proceso.
+        """
+        st = self._sucursales.get(sucursal_id)
+        if st is None:
+            return None
+        key = st.vivos.get(turno_id)
+        if key is not None:
+            adelante = bisect.bisect_left(st.orden, key)
+            return {"estado": "espera", "posicion": adelante + 1, "adelante": adelante}
+        if turno_id in st.en_atencion:
+            numero = st.en_atencion[turno_id]
+            return {"estado": "atendiendo", "consultorio": numero, "nombre_consultorio": st.nombres.get(numero)}
+        return None
+
+    async def posicion(self, sucursal_id: int, turno_id: int) -> Optional[dict]:
+        st = await self._ensure(sucursal_id)
+        pos = self.posicion_local(sucursal_id, turno_id)
+        if pos is None and time.monotonic() - st.loaded_at >= RELOAD_MIN_S:
+            # puede ser de otro proceso (sin sharding): releer, como mucho cada RELOAD_MIN_S
+            async with st.lock:
+                if time.monotonic() - st.loaded_at >= RELOAD_MIN_S:
+                    await self._load(sucursal_id, st)
+            pos = self.posicion_local(sucursal_id, turno_id)
+        return pos
+
+    # ---- despacho ----
+
+    def _pop(self, st: _Sucursal) -> Optional[_Key]:
+        while st.heap:
+            key = heapq.heappop(st.heap)
+            if st.vivos.get(key[2]) == key:
+                self._quitar(st, key)
+                return key
+        return None
+
+    def _libre(self, st: _Sucursal) -> Optional[int]:
+        while st.libres:
+            numero = heapq.heappop(st.libres)
+            if numero in st.consultorios and st.consultorios[numero] is None:
+                return numero
+        return None
+
+    async def llamar_siguiente(self, sucursal_id: int, numero: Optional[int] = None) -> Tuple[int, Optional[dict]]:
+        """
+        Asigna el próximo paciente (prioridad, llegada) al consultorio `numero`
+        o, si no se indica, al libre de menor número. Devuelve (consultorio,
+        turno); turno None si no hay nadie esperando.
+        """
+        st = await self._ensure(sucursal_id)
+        async with st.lock:
+            if self._stale(st):  # invalidate() entre _ensure y el lock
+                await self._load(sucursal_id, st)
+            sacado_de_libres = numero is None
+            if numero is None:
+                numero = self._libre(st)
+                if numero is None:
+                    DISPATCH_CLAIMS.labels("ocupado").inc()
+                    raise ConsultorioNoDisponible("No hay consultorios libres")
+            elif numero not in st.consultorios:
+                raise ConsultorioNoDisponible(f"Consultorio {numero} inexistente o inactivo")
+            elif st.consultorios[numero] is not None:
+                DISPATCH_CLAIMS.labels("ocupado").inc()
+                raise ConsultorioNoDisponible(f"Consultorio {numero} ocupado")
+
+            desde: Optional[_Key] = None  # el aviso a los listeners va al final, con el reclamo resuelto
+            try:
+                while True:
+                    key = self._pop(st)
+                    if key is not None and (desde is None or key < desde):
+                        desde = key
+                    if key is None:
+                        if time.monotonic() - st.loaded_at < RELOAD_MIN_S:
+                            DISPATCH_CLAIMS.labels("vacia").inc()
+                            return numero, None
+                        await self._load(sucursal_id, st)
+                        sacado_de_libres = False  # _load rearmó los libres
+                        continue
+                    turno_id = key[2]
+                    try:
+                        turno = await capacity.run("critico", self._reclamar, sucursal_id, numero, turno_id)
+                    except Exception as e:
+                        # el turno no se reclamó: vuelve a la cola
+                        self._agregar(st, key)
+                        if isinstance(e, ConsultorioOcupado):
+                            DISPATCH_CLAIMS.labels("ocupado").inc()
+                            st.loaded = False  # otro proceso lo ocupó: la memoria está vieja
+                        raise
+                    if turno is None:
+                        DISPATCH_CLAIMS.labels("descartado").inc()
+                        continue
+                    st.consultorios[numero] = turno
+                    st.en_atencion[turno_id] = numero
+                    DISPATCH_CLAIMS.labels("ok").inc()
+                    return numero, turno
+            finally:
+                if sacado_de_libres and st.loaded and st.consultorios.get(numero, False) is None:
+                    heapq.heappush(st.libres, numero)  # se sacó de libres y sigue libre
+                DISPATCH_QUEUE_DEPTH.labels(sucursal_id).set(len(st.vivos))
+                if desde is not None:
+                    self._cambio(sucursal_id, desde)
+
+    async def estado(self, sucursal_id: int) -> dict:
+        st = await self._ensure(sucursal_id)
+        return {
+            "sucursal_id": sucursal_id,
+            "en_espera": len(st.vivos),
+            "consultorios": [
+                {"consultorio": n, "nombre": st.nombres.get(n), "turno": t}
+                for n, t in sorted(st.consultorios.items())
+            ],
+        }
@@ -0,0 +1,179 @@
+"""
+Negociación de contenido para respuestas JSON grandes (/estadisticas,
+/turnos-espera, ...), como middleware ASGI puro.
+
+- Accept: application/msgpack (o application/x-msgpack) -> el JSON se
+  re-codifica a MessagePack (msgpack es dependencia fija, requirements.txt).
+- Accept-Encoding: zstd (si está instalado `zstandard`) o gzip -> el cuerpo
+  se comprime cuando supera ENCODING_MIN_BYTES.
+- Cuerpos de más de ENCODING_OFFLOOP_BYTES se codifican en un hilo (zlib y
+  zstd sueltan el GIL mientras comprimen) para no frenar el event loop.
+
+Solo toca respuestas application/json sin Content-Encoding previo; SSE,
+/metrics y lo demás pasan sin buffer. Registra el tamaño crudo y el enviado
+por ruta y encoding.
+"""
+
+import gzip
+import json
+import os
+from typing import List, Optional, Tuple
+
+import anyio
+import msgpack
+
+from services import metrics
+
+MIN_BYTES = int(os.getenv("ENCODING_MIN_BYTES", "1024"))
+OFFLOOP_BYTES = int(os.getenv("ENCODING_OFFLOOP_BYTES", "65536"))
+GZIP_LEVEL = int(os.getenv("ENCODING_GZIP_LEVEL", "5"))
+ZSTD_LEVEL = int(os.getenv("ENCODING_ZSTD_LEVEL", "3"))
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+
+_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+RESPONSE_RAW_BYTES = metrics.histogram(
+    "turnos_http_response_raw_bytes",
+    "Tamaño del cuerpo JSON antes de codificar, por ruta",
+    ("route",),
+    buckets=_SIZE_BUCKETS,
+)
+RESPONSE_BYTES = metrics.histogram(
+    "turnos_http_response_bytes",
+    "Tamaño enviado por ruta y encoding (identity, gzip, zstd, msgpack, msgpack+gzip...)",
+    ("route", "encoding"),
+    buckets=_SIZE_BUCKETS,
+)
+
+try:  # opcional: más rápido que gzip a igual ratio
+    import zstandard as _zstd
+except ImportError:  # pragma: no cover - depende del entorno
+    _zstd = None
+
+
+def _q_values(header: str) -> List[Tuple[str, float]]:
+    """"gzip;q=0.8, zstd" -> [("gzip", 0.8), ("zstd", 1.0)] (sin q=0)."""
+    out = []
+    for part in header.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        for p in params.split(";"):
+            k, _, v = p.strip().partition("=")
+            if k == "q":
+                try:
+                    q = float(v)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            out.append((token, q))
+    return out
+
+
+def choose_codec(accept_encoding: str) -> Optional[str]:
+    offered = dict(_q_values(accept_encoding))
+    candidates = []
+    if _zstd is not None and "zstd" in offered:
+        candidates.append(("zstd", offered["zstd"], 1))
+    if "gzip" in offered or "*" in offered:
+        candidates.append(("gzip", offered.get("gzip", offered.get("*", 0.0)), 0))
+    if not candidates:
+        return None
+    # mayor q gana; a igual q, zstd
+    return max(candidates, key=lambda c: (c[1], c[2]))[0]
+
+
+def wants_msgpack(accept: str) -> bool:
+    offered = dict(_q_values(accept))
+    return any(t in offered for t in MSGPACK_TYPES)
+
+
+def encode(body: bytes, to_msgpack: bool, codec: Optional[str]) -> bytes:
+    if to_msgpack:
+        body = msgpack.packb(json.loads(body), use_bin_type=True)
+    if codec == "gzip":
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    elif codec == "zstd":
+        body = _zstd.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    return body
+
+
+def _header(headers, name: bytes) -> str:
+    for k, v in headers:
+        if k.lower() == name:
+            return v.decode("latin-1")
+    return ""
+
+
+class EncodingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("method") == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        req_headers = scope.get("headers") or []
+        to_msgpack = wants_msgpack(_header(req_headers, b"accept"))
+        codec = choose_codec(_header(req_headers, b"accept-encoding"))
+
+        start = None
+        chunks: List[bytes] = []
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                headers = message.get("headers") or []
+                ctype = _header(headers, b"content-type")
+                if not ctype.startswith("application/json") or _header(headers, b"content-encoding"):
+                    passthrough = True
+                    await send(message)
+                    return
+                start = message
+                return
+            if message["type"] == "http.response.body" and start is not None:
+                chunks.append(message.get("body", b""))
+                if message.get("more_body"):
+                    return
+                await self._finish(scope, send, start, b"".join(chunks), to_msgpack, codec)
+                return
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def _finish(self, scope, send, start, body: bytes, to_msgpack: bool, codec: Optional[str]):
+        route = metrics.route_label(scope)
+        RESPONSE_RAW_BYTES.labels(route).observe(len(body))
+
+        if not body:
+            to_msgpack = False
+        if len(body) < MIN_BYTES:
+            codec = None
+        labels = [e for e in ("msgpack" if to_msgpack else None, codec) if e]
+
+        if labels:
+            if len(body) >= OFFLOOP_BYTES:
+                body = await anyio.to_thread.run_sync(encode, body, to_msgpack, codec)
+            else:
+                body = encode(body, to_msgpack, codec)
+
+        drop = {b"content-length", b"content-type"} if to_msgpack else {b"content-length"}
+        headers = [(k, v) for k, v in start.get("headers") or [] if k.lower() not in drop]
+        if to_msgpack:
+            headers.append((b"content-type", b"application/msgpack"))
+        if codec:
+            headers.append((b"content-encoding", codec.encode("latin-1")))
+        headers.append((b"vary", b"Accept, Accept-Encoding"))
+        headers.append((b"content-length", str(len(body)).encode("latin-1")))
+
+        RESPONSE_BYTES.labels(route, "+".join(labels) or "identity").observe(len(body))
+        await send({**start, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
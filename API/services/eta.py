@@ -0,0 +1,147 @@
+"""
+Estimador incremental de tiempos de espera por sucursal.
+
+Modelo: media móvil exponencial (EWMA) del tiempo de atención, una por hora
+del día (0-23) y una global por sucursal como respaldo. Se actualiza en O(1)
+cada vez que un turno se finaliza (lo llama db_finalizar_turno),
+y se precarga al arrancar con el historial reciente (warm_from_rows).
+
+annotate() agrega a cada turno en espera su inicio estimado sin ir a la DB:
+una simulación con un heap de "libre a partir de" por consultorio activo
+(varios atienden en paralelo desde el despacho multi-consultorio); cada
+turno en espera, en el orden del despacho (prioridad, llegada), va al que
+se libere primero.
+"""
+
+import heapq
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+ALPHA = float(os.getenv("ETA_ALPHA", "0.2"))
+DEFAULT_SERVICE_SEG = float(os.getenv("ETA_DEFAULT_SEG", "600"))
+# Muestras fuera de este rango (olvidos de finalizar, doble click) no entran al modelo
+MIN_SERVICE_SEG = float(os.getenv("ETA_MIN_SEG", "30"))
+MAX_SERVICE_SEG = float(os.getenv("ETA_MAX_SEG", "7200"))
+WARM_DAYS = int(os.getenv("ETA_WARM_DAYS", "28"))
+
+
+class _SucursalModel:
+    __slots__ = ("by_hour", "overall", "samples", "last_fin")
+
+    def __init__(self):
+        self.by_hour: List[Optional[float]] = [None] * 24
+        self.overall: Optional[float] = None
+        self.samples = 0
+        self.last_fin: Optional[datetime] = None
+
+    def observe(self, hour: int, seconds: float, alpha: float) -> None:
+        cur = self.by_hour[hour]
+        self.by_hour[hour] = seconds if cur is None else cur + alpha * (seconds - cur)
+        self.overall = seconds if self.overall is None else self.overall + alpha * (seconds - self.overall)
+        self.samples += 1
+
+    def service(self, hour: int) -> float:
+        v = self.by_hour[hour]
+        if v is not None:
+            return v
+        return self.overall if self.overall is not None else DEFAULT_SERVICE_SEG
+
+
+class EtaEstimator:
+    def __init__(self, alpha: float = ALPHA):
+        self.alpha = alpha
+        self._models: Dict[int, _SucursalModel] = {}
+        self._lock = threading.Lock()
+
+    def _model(self, sucursal_id: int) -> _SucursalModel:
+        m = self._models.get(sucursal_id)
+        if m is None:
+            m = self._models.setdefault(sucursal_id, _SucursalModel())
+        return m
+
+    # ---- actualizaciones O(1) ----
+
+    def on_finalizado(self, sucursal_id: int, inicio: Optional[datetime], fin: Optional[datetime]) -> None:
+        if fin is None:
+            return
+        with self._lock:
+            m = self._model(sucursal_id)
+            # Sin inicio_atencion (se finalizó directo desde espera): se usa el
+            # hueco desde la finalización anterior, si es del mismo día (la
+            # primera de la mañana no mide la noche desde la última de ayer).
+            prev = m.last_fin if m.last_fin is not None and m.last_fin.date() == fin.date() else None
+            start = inicio or prev
+            m.last_fin = fin
+            if start is None:
+                return
+            seconds = (fin - start).total_seconds()
+            if MIN_SERVICE_SEG <= seconds <= MAX_SERVICE_SEG:
+                m.observe(start.hour, seconds, self.alpha)
+
+    def warm_from_rows(self, rows: Iterable[Tuple[int, int, float, int]]) -> int:
+        """rows: (sucursal_id, hora, promedio_seg, n) ya agregados por SQL."""
+        count = 0
+        with self._lock:
+            for sucursal_id, hour, avg_seg, n in rows:
+                if avg_seg is None:
+                    continue
+                m = self._model(int(sucursal_id))
+                m.by_hour[int(hour)] = float(avg_seg)
+                total = (m.overall or 0.0) * m.samples + float(avg_seg) * int(n)
+                m.samples += int(n)
+                m.overall = total / m.samples if m.samples else None
+                count += 1
+        return count
+
+    # ---- lectura ----
+
+    def annotate(
+        self,
+        sucursal_id: int,
+        turnos: List[dict],
+        now: Optional[datetime] = None,
+        servidores: Optional[int] = None,
+    ) -> List[dict]:
+        """
+        Agrega "eta" (ISO) y "espera_estimada_seg" a cada turno en espera.
+        `servidores`: consultorios activos (None = uno, o tantos como turnos
+        atendiendo si hay más). Modifica y devuelve la misma lista.
+        """
+        if now is None:
+            # Las horas del modelo son las de la DB (timestamptz en la zona de la
+            # sesión, EXTRACT(hour) del warm-up): "ahora" en esa misma zona, no la del servidor
+            tz = next(
+                (ts.tzinfo for row in turnos for ts in (row.get("created_at"),) if isinstance(ts, datetime) and ts.tzinfo),
+                None,
+            )
+            now = datetime.now(tz) if tz else datetime.now(timezone.utc).astimezone()
+        m = self._models.get(sucursal_id)
+
+        def service_at(t: datetime) -> float:
+            return m.service(t.hour) if m else DEFAULT_SERVICE_SEG
+
+        # Cuándo se libera cada consultorio ocupado...
+        libres: List[datetime] = []
+        for row in turnos:
+            if row.get("estado") == "atendiendo":
+                inicio = row.get("inicio_atencion") or now
+                restante = service_at(inicio) - (now - inicio).total_seconds()
+                libres.append(now + timedelta(seconds=max(0.0, restante)))
+        # ...y los que están libres ya
+        libres.extend([now] * max(0, (servidores or 1) - len(libres)))
+        heapq.heapify(libres)
+
+        espera = [row for row in turnos if row.get("estado") == "espera"]
+        # orden del despacho; sort estable: si ya viene ordenado no cambia nada
+        espera.sort(key=lambda r: r.get("prioridad", 2))
+        for row in espera:
+            t = heapq.heappop(libres)
+            row["eta"] = t.isoformat()
+            row["espera_estimada_seg"] = round((t - now).total_seconds())
+            heapq.heappush(libres, t + timedelta(seconds=service_at(t)))
+        return turnos
+
+
+estimator = EtaEstimator()
@@ -0,0 +1,56 @@
+"""
+Idempotency-Key para /crear-turno.
+
+Los kioscos reintentan tras un timeout. Con el header Idempotency-Key el
+primer request guarda su respuesta (tabla idempotency_keys, sql/003) y los
+reintentos con la misma clave la reciben tal cual, sin Odoo, sin INSERT y
+sin broadcast. Delante de la DB hay un LRU en memoria.
+
+La clave es por sucursal. Reusarla con otro body es un error del cliente (422).
+Las respuestas viven IDEMPOTENCY_TTL_S; jobs/idempotencia.py borra las vencidas.
+"""
+
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional
+
+from services.cache import TTLCache
+
+HEADER = "Idempotency-Key"
+REPLAY_HEADER = "Idempotent-Replayed"
+TTL_S = int(os.getenv("IDEMPOTENCY_TTL_S", "86400"))
+MAX_KEY_LEN = 200
+
+cache = TTLCache(
+    maxsize=int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("IDEMPOTENCY_CACHE_TTL", str(min(TTL_S, 3600)))),
+)
+
+
+class IdempotencyError(ValueError):
+    """Clave inválida o reusada con otro body: 422."""
+
+
+def request_hash(payload: Dict[str, Any]) -> str:
+    body = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+def valid_key(key: Optional[str]) -> Optional[str]:
+    key = (key or "").strip()
+    if not key:
+        return None
+    if len(key) > MAX_KEY_LEN:
+        raise IdempotencyError(f"{HEADER} demasiado larga (máx {MAX_KEY_LEN})")
+    return key
+
+
+def stored(request_hash_: str, status_code: int, body: Any) -> Dict[str, Any]:
+    return {"request_hash": request_hash_, "status_code": status_code, "body": body}
+
+
+def check(entry: Dict[str, Any], request_hash_: str) -> Dict[str, Any]:
+    if entry["request_hash"] != request_hash_:
+        raise IdempotencyError(f"{HEADER} ya usada con otro contenido")
+    return entry
@@ -0,0 +1,384 @@
+"""
+Métricas en formato texto de Prometheus, sin dependencias externas.
+
+El camino caliente (observe/inc) no toma locks: cada hilo escribe en su propio
+"shard" (listas preasignadas) y /metrics suma los shards al exportar.
+El lock solo se usa al crear un hijo de labels nuevo o el shard de un hilo nuevo.
+"""
+
+import functools
+import math
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from services import profiler
+
+# Latencias en segundos: desde queries de 1 ms hasta RPCs de Odoo de 20 s
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_num(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+class _Shard:
+    __slots__ = ("counts", "total")
+
+    def __init__(self, n: int):
+        self.counts = [0] * n
+        self.total = 0.0
+
+
+class _ShardedChild:
+    """
+    Hijo con un shard por hilo; nadie más escribe en el shard de un hilo.
+    Se indexa por thread ident (que el SO reutiliza) para que los hilos
+    reciclados de anyio no hagan crecer la lista de shards sin límite.
+    """
+
+    def __init__(self, n: int):
+        self._n = n
+        self._by_thread: Dict[int, _Shard] = {}
+        self._shards: List[_Shard] = []
+        self._lock = threading.Lock()
+
+    def _shard(self) -> _Shard:
+        tid = threading.get_ident()
+        shard = self._by_thread.get(tid)
+        if shard is None:
+            shard = _Shard(self._n)
+            with self._lock:
+                self._shards.append(shard)
+                self._by_thread[tid] = shard
+        return shard
+
+    def _collect(self) -> Tuple[List[int], float]:
+        with self._lock:
+            shards = list(self._shards)
+        counts = [0] * self._n
+        total = 0.0
+        for s in shards:
+            for i, c in enumerate(s.counts):
+                counts[i] += c
+            total += s.total
+        return counts, total
+
+
+class _CounterChild(_ShardedChild):
+    def __init__(self):
+        super().__init__(1)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._shard().total += amount
+
+    @property
+    def value(self) -> float:
+        return self._collect()[1]
+
+
+class _HistogramChild(_ShardedChild):
+    def __init__(self, bounds: Tuple[float, ...]):
+        # un slot por bucket + uno para +Inf
+        super().__init__(len(bounds) + 1)
+        self._bounds = bounds
+
+    def observe(self, value: float) -> None:
+        shard = self._shard()
+        shard.counts[bisect_left(self._bounds, value)] += 1
+        shard.total += value
+
+    def time(self) -> "_Timer":
+        return _Timer(self)
+
+
+class _GaugeChild:
+    # Los gauges se actualizan desde el event loop (un solo hilo): basta un float
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, v: float) -> None:
+        self.value = float(v)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+
+class _Timer:
+    __slots__ = ("_child", "_t0")
+
+    def __init__(self, child: _HistogramChild):
+        self._child = child
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._child.observe(time.perf_counter() - self._t0)
+        return False
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values) -> object:
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name}: se esperaban labels {self.labelnames}")
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._new_child()
+                    self._children[key] = child
+        return child
+
+    def remove(self, *values) -> None:
+        with self._lock:
+            self._children.pop(tuple(str(v) for v in values), None)
+
+    def _items(self):
+        with self._lock:
+            return list(self._children.items())
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in self._items():
+            lines.extend(self._render_child(key, child))
+        return lines
+
+    def _render_child(self, key, child) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def _render_child(self, key, child):
+        return [f"{self.name}{_fmt_labels(self.labelnames, key)} {_fmt_num(child.value)}"]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, v: float) -> None:
+        self.labels().set(v)
+
+    def set_or_remove(self, v: float, *values) -> None:
+        """set() de la serie con esos labels; en 0 la quita (ids de sucursal: series que solo crecerían)."""
+        if v:
+            self.labels(*values).set(v)
+        else:
+            self.remove(*values)
+
+    def _render_child(self, key, child):
+        return [f"{self.name}{_fmt_labels(self.labelnames, key)} {_fmt_num(child.value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _render_child(self, key, child):
+        counts, total = child._collect()
+        out = []
+        acc = 0
+        for bound, c in zip(self.buckets + (math.inf,), counts):
+            acc += c
+            le = f'le="{_fmt_num(bound)}"'
+            out.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le)} {acc}")
+        lbl = _fmt_labels(self.labelnames, key)
+        out.append(f"{self.name}_sum{lbl} {_fmt_num(total)}")
+        out.append(f"{self.name}_count{lbl} {acc}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Métrica duplicada: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(
+    name: str,
+    documentation: str,
+    labelnames: Sequence[str] = (),
+    buckets: Sequence[float] = DEFAULT_BUCKETS,
+) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# =======================
+# Métricas de la API
+# =======================
+
+HTTP_REQUEST_SECONDS = histogram(
+    "turnos_http_request_duration_seconds",
+    "Latencia de requests HTTP por ruta (template) y status",
+    ("method", "route", "status"),
+)
+DB_QUERY_SECONDS = histogram(
+    "turnos_db_query_duration_seconds",
+    "Duración de cada helper db_* (conexión + query)",
+    ("helper",),
+)
+ODOO_RPC_SECONDS = histogram(
+    "turnos_odoo_rpc_duration_seconds",
+    "Duración de RPCs XML-RPC a Odoo por método y resultado",
+    ("method", "outcome"),
+)
+WS_CONNECTIONS = gauge(
+    "turnos_ws_connections",
+    "WebSockets abiertos por sucursal",
+    ("sucursal_id",),
+)
+BROADCAST_SECONDS = histogram(
+    "turnos_broadcast_duration_seconds",
+    "Tiempo de fan-out de ConnectionManager.broadcast",
+)
+BROADCAST_MESSAGES = counter(
+    "turnos_broadcast_messages_total",
+    "Mensajes enviados por broadcast, por resultado",
+    ("outcome",),
+)
+
+
+def timed_db(fn: Callable) -> Callable:
+    """Decorador para helpers db_*: registra su duración con label = nombre de la función."""
+    child = DB_QUERY_SECONDS.labels(fn.__name__)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            dt = time.perf_counter() - t0
+            child.observe(dt)
+            profiler.add_time("db", dt)
+
+    return wrapper
+
+
+def route_label(scope: dict) -> str:
+    """Template de la ruta (/turnos-espera/{sucursal_id}) para no explotar la cardinalidad."""
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    return path or "__unmatched__"
+
+
+class MetricsMiddleware:
+    """Middleware ASGI puro (sin BaseHTTPMiddleware) para medir cada request HTTP."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUEST_SECONDS.labels(
+                scope.get("method", ""), route_label(scope), status["code"]
+            ).observe(time.perf_counter() - t0)
+
+
+def render_latest() -> str:
+    return REGISTRY.render()
+
+
+def observe_rpc(method: str, outcome: str, seconds: float) -> None:
+    ODOO_RPC_SECONDS.labels(method, outcome).observe(seconds)
+
@@ -0,0 +1,200 @@
+"""
+Monitor de salud de Odoo en segundo plano.
+
+Una tarea asyncio sondea Odoo cada ODOO_HEALTH_INTERVAL_S (version +
+authenticate; db.list solo cada ODOO_HEALTH_DBS_EVERY sondeos) y mantiene una
+ventana rodante (ODOO_HEALTH_WINDOW_S) de latencias y errores. Además de los
+sondeos, cada RPC real que pasa por OdooClient alimenta la misma ventana.
+
+/odoo/health responde desde este estado sin tocar Odoo, y el resto del código
+pregunta monitor.is_up() antes de llamar a Odoo cuando la llamada es opcional
+(p.ej. normalizar el nombre al crear un turno).
+
+Un Fault de XML-RPC cuenta como Odoo disponible: respondió, aunque con error
+de negocio. Solo errores de red/timeout/config cuentan como caída.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from services import capacity
+
+log = logging.getLogger("uvicorn.error")
+
+INTERVAL_S = float(os.getenv("ODOO_HEALTH_INTERVAL_S", "15"))
+# Caído: se sondea más seguido para detectar la vuelta
+RETRY_S = float(os.getenv("ODOO_HEALTH_RETRY_S", "5"))
+WINDOW_S = float(os.getenv("ODOO_HEALTH_WINDOW_S", "600"))
+FAILS_DOWN = int(os.getenv("ODOO_HEALTH_FAILS_DOWN", "3"))
+SLOW_MS = float(os.getenv("ODOO_HEALTH_SLOW_MS", "3000"))
+DBS_EVERY = int(os.getenv("ODOO_HEALTH_DBS_EVERY", "20"))
+
+
+def _quantile(sorted_vals: List[float], q: float) -> Optional[float]:
+    if not sorted_vals:
+        return None
+    return sorted_vals[min(len(sorted_vals) - 1, int(q * len(sorted_vals)))]
+
+
+class OdooHealthMonitor:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples: Deque[Tuple[float, float, bool]] = deque()  # (ts, segundos, ok)
+        self._consecutive_failures = 0
+        self._last_success: Optional[float] = None
+        self._last_error: Optional[str] = None
+        self._last_error_at: Optional[float] = None
+        self._last_probe_at: Optional[float] = None
+        self._info: Dict[str, Any] = {"version": None, "uid": None, "dbs": None}
+        self._probes = 0
+        self._client = None
+        self._task: Optional[asyncio.Task] = None
+        self._first_probe: Optional[asyncio.Event] = None
+        self.disabled_reason: Optional[str] = None
+        # el RPC responde pero authenticate() devuelve False: los RPCs "andan" y aun así nada sirve
+        self._auth_error: Optional[str] = None
+
+    # ---- ventana ----
+
+    def observe(self, seconds: float, ok: bool, error: Optional[str] = None) -> None:
+        """Lo llaman los sondeos y cada RPC de OdooClient (desde cualquier hilo)."""
+        now = time.time()
+        with self._lock:
+            self._samples.append((now, seconds, ok))
+            self._trim(now)
+            if ok:
+                self._consecutive_failures = 0
+                self._last_success = now
+            else:
+                self._consecutive_failures += 1
+                self._last_error = error
+                self._last_error_at = now
+
+    def _trim(self, now: float) -> None:
+        limit = now - WINDOW_S
+        while self._samples and self._samples[0][0] < limit:
+            self._samples.popleft()
+
+    def is_up(self) -> bool:
+        """False si está deshabilitado o si fallaron las últimas FAILS_DOWN llamadas."""
+        if self.disabled_reason or self._auth_error:
+            return False
+        return self._consecutive_failures < FAILS_DOWN
+
+    def status(self) -> str:
+        if self.disabled_reason:
+            return "disabled"
+        if self._last_probe_at is None and self._last_success is None:
+            return "unknown"
+        if not self.is_up():
+            return "down"
+        snap = self._window_stats()
+        if snap["error_rate"] > 0.2 or (snap["p99_ms"] or 0) > SLOW_MS:
+            return "degraded"
+        return "up"
+
+    def _window_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._trim(time.time())
+            samples = list(self._samples)
+        lat = sorted(s * 1000.0 for _, s, ok in samples if ok)
+        errors = sum(1 for _, _, ok in samples if not ok)
+        return {
+            "samples": len(samples),
+            "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+            "p50_ms": round(_quantile(lat, 0.50), 1) if lat else None,
+            "p99_ms": round(_quantile(lat, 0.99), 1) if lat else None,
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.time()
+        stats = self._window_stats()
+        status = self.status()
+        return {
+            "ok": status in ("up", "degraded"),
+            "status": status,
+            **self._info,
+            **stats,
+            "window_s": WINDOW_S,
+            "consecutive_failures": self._consecutive_failures,
+            "last_success_at": self._last_success,
+            "seconds_since_success": round(now - self._last_success, 1) if self._last_success else None,
+            "last_probe_at": self._last_probe_at,
+            "last_error": self.disabled_reason or self._auth_error or self._last_error,
+            "last_error_at": self._last_error_at,
+        }
+
+    # ---- sondeo ----
+
+    def _probe_sync(self) -> None:
+        if self._client is None:
+            from services.odoo_service import OdooClient
+
+            self._client = OdooClient()
+        client = self._client
+        # version/authenticate ya pasan por observe() vía _TimedProxy
+        self._info["version"] = client.version()
+        self._info["uid"] = client.authenticate()
+        if self._probes % DBS_EVERY == 0:
+            try:
+                self._info["dbs"] = client.list_dbs()
+            except Exception:
+                self._info["dbs"] = None  # db.list suele estar bloqueado en producción
+
+    async def probe_once(self) -> bool:
+        try:
+            await capacity.run("odoo", self._probe_sync)
+            self._auth_error = None
+            ok = True
+        except Exception as e:
+            ok = False
+            msg = str(e)
+            if "ODOO_ENABLED=false" in msg or msg.startswith("Falta ODOO_"):
+                self.disabled_reason = msg
+            elif "devolvió False" in msg:
+                self._auth_error = msg
+        finally:
+            self._probes += 1
+            self._last_probe_at = time.time()
+            if self._first_probe is not None:
+                self._first_probe.set()
+        return ok
+
+    async def _run(self) -> None:
+        while not self.disabled_reason:
+            was_up = self.is_up()
+            await self.probe_once()
+            if self.disabled_reason:
+                log.info("Monitor de Odoo apagado: %s", self.disabled_reason)
+                return
+            if was_up and not self.is_up():
+                log.warning("Odoo caído: %s", self.snapshot()["last_error"])
+            elif self.is_up() and not was_up:
+                log.info("Odoo disponible de nuevo")
+            await asyncio.sleep(INTERVAL_S if self.is_up() else RETRY_S)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._first_probe = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def wait_first_probe(self) -> None:
+        if self._first_probe is not None:
+            await self._first_probe.wait()
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+monitor = OdooHealthMonitor()
@@ -1,10 +1,13 @@
 # Archivo sugerido: API/services/odoo_service.py
 
 import os
+import time
 import xmlrpc.client
 from typing import Any, Dict, List, Optional
 from pydantic import BaseModel
 
+from services import metrics, odoo_health, profiler
+
 
 
 
@@ -19,6 +22,59 @@ class TimeoutSafeTransport(xmlrpc.client.SafeTransport):
         return conn
 
 
+class TimeoutTransport(xmlrpc.client.Transport):
+    """Igual que TimeoutSafeTransport pero para http:// (Odoo local / fake de load tests)."""
+
+    def __init__(self, timeout: int = 20, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        conn = super().make_connection(host)
+        conn.timeout = self.timeout
+        return conn
+
+
+class _TimedProxy:
+    """
+    Envuelve un ServerProxy y mide cada RPC en turnos_odoo_rpc_duration_seconds.
+    Para execute_kw el label es "<modelo>.<método>" (ej: res.partner.search_read).
+    """
+
+    def __init__(self, proxy: xmlrpc.client.ServerProxy, service: str):
+        self._proxy = proxy
+        self._service = service
+
+    def __getattr__(self, name: str):
+        fn = getattr(self._proxy, name)
+
+        def call(*args):
+            if name == "execute_kw" and len(args) >= 5:
+                label = f"{args[3]}.{args[4]}"
+            else:
+                label = f"{self._service}.{name}"
+            outcome = "ok"
+            error = None
+            t0 = time.perf_counter()
+            try:
+                return fn(*args)
+            except xmlrpc.client.Fault:
+                outcome = "fault"
+                raise
+            except Exception as e:
+                outcome = "error"
+                error = repr(e)
+                raise
+            finally:
+                dt = time.perf_counter() - t0
+                metrics.observe_rpc(label, outcome, dt)
+                profiler.add_time("odoo", dt)
+                # un Fault es Odoo respondiendo: solo red/timeout cuentan como caída
+                odoo_health.monitor.observe(dt, outcome != "error", error)
+
+        return call
+
+
 class OdooClient:
     def __init__(self):
         # ✅ Normaliza URL (si viene sin http/https, agrega https://)
@@ -33,19 +89,24 @@ class OdooClient:
         self.enabled = (os.getenv("ODOO_ENABLED", "true").lower() in ("1", "true", "yes", "y", "on"))
 
         timeout = int(os.getenv("ODOO_TIMEOUT", "20"))
-        transport = TimeoutSafeTransport(timeout=timeout)
+        if self.url.startswith("http://"):
+            transport = TimeoutTransport(timeout=timeout)
+        else:
+            transport = TimeoutSafeTransport(timeout=timeout)
 
-        # Proxies XML-RPC
-        self.common = xmlrpc.client.ServerProxy(
+        # Proxies XML-RPC (medidos)
+        self.common = _TimedProxy(xmlrpc.client.ServerProxy(
             f"{self.url}/xmlrpc/2/common", allow_none=True, transport=transport
-        )
-        self.models = xmlrpc.client.ServerProxy(
+        ), "common")
+        self.models = _TimedProxy(xmlrpc.client.ServerProxy(
             f"{self.url}/xmlrpc/2/object", allow_none=True, transport=transport
-        )
-        self.db_proxy = xmlrpc.client.ServerProxy(
+        ), "object")
+        self.db_proxy = _TimedProxy(xmlrpc.client.ServerProxy(
             f"{self.url}/xmlrpc/2/db", allow_none=True, transport=transport
-        )
+        ), "db")
 
+        # uid cacheado para los métodos por lotes (session_uid)
+        self._uid: Optional[int] = None
 
 
     def _check_config(self):
@@ -198,7 +259,7 @@ class OdooClient:
         edad: Optional[int],
         telefono: Optional[str]
     ) -> Dict[str, Any]:
-        uid = self.authenticate()
+        uid = self.session_uid()
 
         nombre = (nombre or "").strip()
         apellido = (apellido or "").strip() if apellido else ""
@@ -236,7 +297,7 @@ class OdooClient:
 
 
     def update_partner_phone(self, partner_id: int, telefono: Optional[str]) -> Dict[str, Any]:
-        uid = self.authenticate()
+        uid = self.session_uid()
 
         tel = (telefono or "").strip()
 
@@ -268,3 +329,105 @@ class OdooClient:
             updated["mobile"] = None
 
         return updated
+
+    # =======================
+    # Lotes (importación masiva)
+    # =======================
+
+    def session_uid(self) -> int:
+        """authenticate() una sola vez por cliente: para miles de RPCs seguidos."""
+        if self._uid is None:
+            self._uid = self.authenticate()
+        return self._uid
+
+    def search_partners_by_phones(self, terms: List[str], fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Un search_read con phone IN terms OR mobile IN terms (match exacto).
+        El que llama arma las variantes de formato y compara por dígitos.
+        """
+        terms = [t for t in terms if t]
+        if not terms:
+            return []
+        uid = self.session_uid()
+        domain = ["|", ["phone", "in", terms], ["mobile", "in", terms]]
+        try:
+            partners = self.models.execute_kw(
+                self.db, uid, self.password,
+                "res.partner", "search_read",
+                [domain],
+                {"fields": fields or ["id", "name", "phone", "mobile"]}
+            )
+            return [self._normalize_partner(p) for p in partners]
+        except xmlrpc.client.Fault as f:
+            raise RuntimeError(f"Odoo Fault en search_read por teléfonos: {f.faultString}")
+        except Exception as e:
+            raise RuntimeError(f"Error en search_read por teléfonos: {repr(e)}")
+
+    def create_partners(self, vals_list: List[Dict[str, Any]]) -> List[int]:
+        """create multi-registro (Odoo >= 12): un RPC para todo el lote, sin read posterior."""
+        if not vals_list:
+            return []
+        uid = self.session_uid()
+        try:
+            ids = self.models.execute_kw(
+                self.db, uid, self.password,
+                "res.partner", "create",
+                [vals_list]
+            )
+        except xmlrpc.client.Fault as f:
+            raise RuntimeError(f"Odoo Fault creando {len(vals_list)} partners: {f.faultString}")
+        except Exception as e:
+            raise RuntimeError(f"Error creando {len(vals_list)} partners: {repr(e)}")
+        if isinstance(ids, int):
+            ids = [ids]
+        return [int(i) for i in ids]
+
+    def write_partners(self, partner_ids: List[int], vals: Dict[str, Any]) -> None:
+        """write de los mismos vals sobre varios partners en un RPC."""
+        if not partner_ids:
+            return
+        uid = self.session_uid()
+        try:
+            ok = self.models.execute_kw(
+                self.db, uid, self.password,
+                "res.partner", "write",
+                [[int(i) for i in partner_ids], vals]
+            )
+        except xmlrpc.client.Fault as f:
+            raise RuntimeError(f"Odoo Fault actualizando {len(partner_ids)} partners: {f.faultString}")
+        except Exception as e:
+            raise RuntimeError(f"Error actualizando {len(partner_ids)} partners: {repr(e)}")
+        if not ok:
+            raise RuntimeError("Odoo write() devolvió False")
+
+    def partners_modificados(
+        self,
+        desde: Optional[str],
+        offset: int = 0,
+        limit: int = 2000,
+    ) -> List[Dict[str, Any]]:
+        """
+        Partners con write_date >= desde (None: todos), archivados incluidos
+        (active_test=False) para poder sacarlos del índice local. Orden estable
+        (write_date, id) para paginar con offset.
+        """
+        uid = self.session_uid()
+        domain = [["write_date", ">=", desde]] if desde else []
+        try:
+            partners = self.models.execute_kw(
+                self.db, uid, self.password,
+                "res.partner", "search_read",
+                [domain],
+                {
+                    "fields": ["id", "name", "phone", "mobile", "active", "write_date"],
+                    "order": "write_date asc, id asc",
+                    "offset": int(offset),
+                    "limit": int(limit),
+                    "context": {"active_test": False},
+                }
+            )
+            return [self._normalize_partner(p) for p in partners or []]
+        except xmlrpc.client.Fault as f:
+            raise RuntimeError(f"Odoo Fault leyendo partners modificados: {f.faultString}")
+        except Exception as e:
+            raise RuntimeError(f"Error leyendo partners modificados: {repr(e)}")
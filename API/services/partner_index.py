@@ -0,0 +1,540 @@
+"""
+Índice local de partners de Odoo para el autocompletado de /odoo/clientes/buscar.
+
+Cada tecla en la caja de búsqueda era un authenticate() + search_read con
+ilike contra Odoo. Acá se busca en memoria (por proceso):
+- sin acentos ni mayúsculas; primero los nombres que empiezan con lo tipeado
+  (lista ordenada + bisect), después prefijo por palabra ("jose pe" -> "María
+  José Pérez") recorriendo solo la palabra más selectiva;
+- una palabra que no es prefijo de nada se busca por trigramas (como pg_trgm)
+  en el vocabulario de palabras, no en los partners: "rodrigez" -> "rodriguez";
+- teléfono por dígitos (exacto y substring), ignorando el formato.
+
+Sincronización: al arrancar se carga todo res.partner en un hilo y se arma un
+índice nuevo que reemplaza al anterior de una vez. Después, cada
+PARTNER_INDEX_SYNC_S se traen solo los partners con write_date >= último visto
+menos PARTNER_INDEX_OVERLAP_S (transacciones largas que commitean tarde) y se
+aplican en el event loop; los archivados salen del índice. Los borrados físicos
+no dejan write_date: se recarga todo cada PARTNER_INDEX_FULL_S.
+
+Hasta que termina la primera carga (o si Odoo está deshabilitado) la búsqueda
+sigue yendo a Odoo. Las altas/cambios hechos por esta API se aplican al
+momento (upsert); los de otros procesos o de Odoo, en la próxima sincronización.
+
+Cancelación: en el camino a Odoo, una búsqueda nueva del mismo cuadro
+(header X-Search-Session) cancela la anterior que siga en vuelo.
+"""
+
+import asyncio
+import bisect
+import heapq
+import logging
+import os
+import re
+import time
+import unicodedata
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Dict, Iterable, List, Optional, Set, Tuple
+
+import anyio
+
+from services import capacity, metrics
+
+log = logging.getLogger("uvicorn.error")
+
+ENABLED = os.getenv("PARTNER_INDEX_ENABLED", "true").lower() in ("1", "true", "yes", "y", "on")
+SYNC_S = float(os.getenv("PARTNER_INDEX_SYNC_S", "30"))
+OVERLAP_S = float(os.getenv("PARTNER_INDEX_OVERLAP_S", "60"))
+FULL_S = float(os.getenv("PARTNER_INDEX_FULL_S", "3600"))
+RETRY_S = float(os.getenv("PARTNER_INDEX_RETRY_S", "10"))
+PAGE = int(os.getenv("PARTNER_INDEX_PAGE", "2000"))
+# Más viejo que esto (sin sincronizar) y el índice no se usa para decir "no existe"
+STALE_S = float(os.getenv("PARTNER_INDEX_STALE_S", str(SYNC_S * 4)))
+TRGM_MIN = 0.3  # mismo umbral por defecto que pg_trgm
+MAX_SCAN = 20_000  # entradas recorridas como mucho por búsqueda: acota el peor caso
+# Más cambios que esto en una sincronización: se rearma el índice en un hilo
+REBUILD_OVER = int(os.getenv("PARTNER_INDEX_REBUILD_OVER", "1000"))
+
+PARTNER_INDEX_SIZE = metrics.gauge(
+    "turnos_partner_index_size",
+    "Partners en el índice local de autocompletado",
+)
+PARTNER_INDEX_SYNCS = metrics.counter(
+    "turnos_partner_index_syncs_total",
+    "Sincronizaciones del índice local con Odoo por tipo (full, incremental) y resultado",
+    ("tipo", "outcome"),
+)
+PARTNER_SEARCH_SECONDS = metrics.histogram(
+    "turnos_partner_search_duration_seconds",
+    "Duración de la búsqueda de partners por origen (indice, odoo)",
+    ("origen",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+SEARCH_SUPERSEDED = metrics.counter(
+    "turnos_partner_search_superseded_total",
+    "Búsquedas a Odoo canceladas por una más nueva del mismo X-Search-Session",
+)
+
+
+# =======================
+# Normalización
+# =======================
+
+def fold(raw: Optional[str]) -> str:
+    """Minúsculas, sin acentos, solo letras/dígitos separados por un espacio."""
+    s = unicodedata.normalize("NFKD", raw or "")
+    s = "".join(ch for ch in s if not unicodedata.combining(ch)).lower()
+    return " ".join(re.sub(r"[^0-9a-z]+", " ", s).split())
+
+
+def digits(raw: Optional[str]) -> str:
+    return re.sub(r"\D+", "", raw or "")
+
+
+def trigrams(folded: str) -> Set[str]:
+    """Trigramas por palabra con relleno, como pg_trgm ("  ma", " mar", ..., "ia ")."""
+    out: Set[str] = set()
+    for w in folded.split():
+        w = f"  {w} "
+        out.update(w[i:i + 3] for i in range(len(w) - 2))
+    return out
+
+
+def _digit_trigrams(d: str) -> Set[str]:
+    return {d[i:i + 3] for i in range(len(d) - 2)}
+
+
+def _claves_telefono(d: str) -> Tuple[str, ...]:
+    # 8299934714 y 18299934714 son el mismo número
+    if len(d) == 11 and d.startswith("1"):
+        return (d, d[1:])
+    if len(d) == 10:
+        return (d, "1" + d)
+    return (d,)
+
+
+# =======================
+# Índice
+# =======================
+
+class _Doc:
+    __slots__ = ("id", "name", "phone", "mobile", "folded", "words", "digits")
+
+    def __init__(self, p: Dict[str, Any]):
+        self.id = int(p["id"])
+        self.name = p.get("name") or ""
+        self.phone = p.get("phone") or None
+        self.mobile = p.get("mobile") or None
+        self.folded = fold(self.name)
+        self.words = tuple(dict.fromkeys(self.folded.split()))
+        self.digits = tuple(dict.fromkeys(d for d in (digits(self.phone), digits(self.mobile)) if d))
+
+    def out(self) -> Dict[str, Any]:
+        return {"id": self.id, "name": self.name, "phone": self.phone, "mobile": self.mobile}
+
+
+class _Indice:
+    """
+    Estructuras de búsqueda. Se modifica solo desde el event loop (o antes de
+    publicarse). Las listas ordenadas se actualizan con insort: O(n) de memmove
+    por cambio, barato para los pocos de una sincronización incremental.
+    """
+
+    def __init__(self):
+        self.docs: Dict[int, _Doc] = {}
+        self.names: List[Tuple[str, int]] = []  # (nombre plegado, id): "empieza con" en orden alfabético
+        self.words: List[Tuple[str, int]] = []  # (palabra, id): prefijo por palabra
+        self.vocab: Dict[str, int] = {}  # palabra -> cuántos docs la usan
+        self.vocab_grams: Dict[str, Set[str]] = {}  # trigrama -> palabras (para errores de tipeo)
+        self.phone_grams: Dict[str, Set[int]] = {}
+        self.by_digits: Dict[str, Set[int]] = {}
+
+    @classmethod
+    def build(cls, partners: Iterable[Dict[str, Any]]) -> "_Indice":
+        idx = cls()
+        for p in partners:
+            if p.get("active", True):
+                idx._add(_Doc(p), sort=False)
+        idx.names.sort()
+        idx.words.sort()
+        return idx
+
+    def _add(self, doc: _Doc, sort: bool = True) -> None:
+        self.docs[doc.id] = doc
+        put = bisect.insort if sort else list.append
+        put(self.names, (doc.folded, doc.id))
+        for w in doc.words:
+            put(self.words, (w, doc.id))
+            n = self.vocab.get(w, 0)
+            self.vocab[w] = n + 1
+            if n == 0:
+                for g in trigrams(w):
+                    self.vocab_grams.setdefault(g, set()).add(w)
+        for d in doc.digits:
+            for k in _claves_telefono(d):
+                self.by_digits.setdefault(k, set()).add(doc.id)
+            for g in _digit_trigrams(d):
+                self.phone_grams.setdefault(g, set()).add(doc.id)
+
+    @staticmethod
+    def _discard(index: Dict[str, Set[Any]], keys: Iterable[str], value: Any) -> None:
+        for k in keys:
+            vals = index.get(k)
+            if vals is not None:
+                vals.discard(value)
+                if not vals:
+                    del index[k]
+
+    @staticmethod
+    def _delete(sorted_list: List[Tuple[str, int]], item: Tuple[str, int]) -> None:
+        i = bisect.bisect_left(sorted_list, item)
+        if i < len(sorted_list) and sorted_list[i] == item:
+            del sorted_list[i]
+
+    def remove(self, partner_id: int) -> None:
+        doc = self.docs.pop(partner_id, None)
+        if doc is None:
+            return
+        self._delete(self.names, (doc.folded, doc.id))
+        for w in doc.words:
+            self._delete(self.words, (w, doc.id))
+            n = self.vocab.get(w, 0) - 1
+            if n > 0:
+                self.vocab[w] = n
+            else:
+                self.vocab.pop(w, None)
+                self._discard(self.vocab_grams, trigrams(w), w)
+        self._discard(self.by_digits, [k for d in doc.digits for k in _claves_telefono(d)], doc.id)
+        self._discard(self.phone_grams, [g for d in doc.digits for g in _digit_trigrams(d)], doc.id)
+
+    def upsert(self, p: Dict[str, Any]) -> None:
+        self.remove(int(p["id"]))
+        if p.get("active", True):
+            self._add(_Doc(p))
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [d.out() for d in self.docs.values()]
+
+    # ---- búsqueda ----
+
+    def _rango(self, sorted_list: List[Tuple[str, int]], prefijo: str) -> Tuple[int, int]:
+        return (
+            bisect.bisect_left(sorted_list, (prefijo,)),
+            bisect.bisect_left(sorted_list, (prefijo + "\uffff",)),
+        )
+
+    def _parecidas(self, w: str) -> Dict[str, float]:
+        """Palabras del vocabulario con similitud de trigramas >= TRGM_MIN (errores de tipeo)."""
+        qg = trigrams(w)
+        counts: Counter = Counter()
+        for g in qg:
+            counts.update(self.vocab_grams.get(g, ()))
+        out = {}
+        for word, shared in counts.items():
+            sim = shared / (len(qg) + len(trigrams(word)) - shared)
+            if sim >= TRGM_MIN:
+                out[word] = sim
+        return out
+
+    def _por_palabras(self, tokens: List[str], skip: Set[int], limit: int) -> List[_Doc]:
+        """
+        Docs que tienen, para cada token, una palabra que empieza con él (o, si
+        ninguna empieza con él, una parecida). Se recorre la lista del token más
+        selectivo y se corta al llenar el límite o tras MAX_SCAN entradas.
+        """
+        conds = []  # (costo, rangos a recorrer, chequeo sobre las palabras del doc, similitudes)
+        for t in tokens:
+            lo, hi = self._rango(self.words, t)
+            if lo < hi:
+                conds.append((hi - lo, [(lo, hi)], (lambda ws, t=t: any(w.startswith(t) for w in ws)), None))
+                continue
+            sims = self._parecidas(t)
+            if not sims:
+                return []
+            rangos = [self._rango_exacto(w) for w in sorted(sims, key=sims.get, reverse=True)]
+            conds.append((sum(b - a for a, b in rangos), rangos, (lambda ws, s=sims: any(w in s for w in ws)), sims))
+        conds.sort(key=lambda c: c[0])
+        _, rangos, _, _ = conds[0]
+        resto = [c[2] for c in conds[1:]]
+        fuzzy = [c[3] for c in conds if c[3] is not None]
+
+        out: List[_Doc] = []
+        vistos = set(skip)
+        scanned = 0
+        for lo, hi in rangos:
+            for _, pid in self.words[lo:min(hi, lo + MAX_SCAN - scanned)]:
+                scanned += 1
+                if pid in vistos:
+                    continue
+                vistos.add(pid)
+                doc = self.docs[pid]
+                if all(check(doc.words) for check in resto):
+                    out.append(doc)
+                    # exacto: alcanza con el límite; aproximado: algunos más para ordenar por parecido
+                    if len(out) >= (limit * 4 if fuzzy else limit):
+                        break
+            if scanned >= MAX_SCAN or len(out) >= (limit * 4 if fuzzy else limit):
+                break
+        if fuzzy:
+            # con tokens aproximados, primero los más parecidos
+            def score(doc: _Doc) -> float:
+                return sum(max((s.get(w, 0.0) for w in doc.words), default=0.0) for s in fuzzy)
+
+            out.sort(key=lambda d: (-score(d), d.folded))
+        return out[:limit]
+
+    def _rango_exacto(self, w: str) -> Tuple[int, int]:
+        return bisect.bisect_left(self.words, (w,)), bisect.bisect_left(self.words, (w, float("inf")))
+
+    def _telefono(self, qd: str, limit: int) -> List[_Doc]:
+        exactos: Set[int] = set()
+        for k in _claves_telefono(qd):
+            exactos |= self.by_digits.get(k, set())
+        out = sorted((self.docs[i] for i in exactos), key=lambda d: d.folded)
+        if len(out) >= limit:
+            return out[:limit]
+        # substring: se recorre el trigrama de dígitos más raro y se corta al llenar el límite
+        postings = sorted((self.phone_grams.get(g, set()) for g in _digit_trigrams(qd)), key=len)
+        extra = []
+        for i in (postings[0] if postings else ()):
+            if i not in exactos and any(qd in d for d in self.docs[i].digits):
+                extra.append(self.docs[i])
+                if len(out) + len(extra) >= limit:
+                    break
+        extra.sort(key=lambda d: (d.folded, d.id))
+        return out + extra
+
+    def buscar(self, q: str, limit: int) -> List[Dict[str, Any]]:
+        qf = fold(q)
+        if len(qf) < 2:
+            return []
+        qd = digits(q)
+        # "829-993", "+1 829", "9934714": teléfono; con letras: nombre
+        if len(qd) >= 3 and not re.search(r"[a-z]", qf):
+            return [d.out() for d in self._telefono(qd, limit)]
+
+        # 1) nombres que empiezan con lo tipeado, en orden alfabético: O(log n + limit)
+        lo, hi = self._rango(self.names, qf)
+        docs = [self.docs[pid] for _, pid in self.names[lo:min(hi, lo + limit)]]
+        # 2) cada palabra tipeada es prefijo de alguna palabra del nombre (o se le parece)
+        if len(docs) < limit:
+            docs += self._por_palabras(qf.split(), {d.id for d in docs}, limit - len(docs))
+        return [d.out() for d in docs]
+
+    def nombre_por_telefono(self, d: str) -> Optional[str]:
+        for k in _claves_telefono(d):
+            for pid in sorted(self.by_digits.get(k, ())):
+                name = self.docs[pid].name.strip()
+                if name:
+                    return name
+        return None
+
+
+# =======================
+# Sincronización
+# =======================
+
+def _fetch(client, desde: Optional[str]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Corre en un hilo: todas las páginas desde `desde`. Devuelve (partners, max write_date)."""
+    out: List[Dict[str, Any]] = []
+    offset = 0
+    while True:
+        page = client.partners_modificados(desde, offset, PAGE)
+        out.extend(page)
+        if len(page) < PAGE:
+            break
+        offset += len(page)
+    hw = max((p.get("write_date") or "" for p in out), default="") or None
+    return out, hw
+
+
+def _menos(write_date: str, segundos: float) -> str:
+    # write_date de Odoo: "YYYY-MM-DD HH:MM:SS" en UTC, comparable como string
+    t = datetime.strptime(write_date[:19], "%Y-%m-%d %H:%M:%S") - timedelta(seconds=segundos)
+    return t.strftime("%Y-%m-%d %H:%M:%S")
+
+
+class PartnerIndex:
+    def __init__(self):
+        self._idx: Optional[_Indice] = None
+        self._write_date: Optional[str] = None
+        self._client = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_sync: Optional[float] = None
+        self._last_full: Optional[float] = None
+        self._last_error: Optional[str] = None
+        # upserts de la API mientras se arma un índice nuevo: se reaplican después del swap
+        self._durante_armado: Optional[Dict[int, Dict[str, Any]]] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._idx is not None
+
+    @property
+    def fresh(self) -> bool:
+        """Sincronizado hace poco: un "no está" del índice vale como respuesta."""
+        return self.ready and self._last_sync is not None and time.monotonic() - self._last_sync < STALE_S
+
+    def buscar(self, q: str, limit: int) -> List[Dict[str, Any]]:
+        with PARTNER_SEARCH_SECONDS.labels("indice").time():
+            return self._idx.buscar(q, limit) if self._idx is not None else []
+
+    def nombre_por_telefono(self, d: str) -> Optional[str]:
+        return self._idx.nombre_por_telefono(d) if self._idx is not None else None
+
+    def upsert(self, partner: Dict[str, Any]) -> None:
+        """Alta/cambio hecho por esta API: visible ya, sin esperar la sincronización."""
+        if not partner or partner.get("id") is None:
+            return
+        if self._durante_armado is not None:
+            self._durante_armado[int(partner["id"])] = partner
+        if self._idx is not None:
+            self._idx.upsert(partner)
+            PARTNER_INDEX_SIZE.set(len(self._idx.docs))
+
+    async def _armar(self, partners: List[Dict[str, Any]]) -> _Indice:
+        """
+        Arma un índice en un hilo y le reaplica los upserts anotados desde que
+        empezó la recarga (el que llama abre y cierra _durante_armado): sin eso
+        se perderían en el índice descartado hasta la próxima carga completa.
+        """
+        idx = await anyio.to_thread.run_sync(_Indice.build, partners)
+        for p in self._durante_armado.values():
+            idx.upsert(p)
+        return idx
+
+    def _get_client(self):
+        if self._client is None:
+            from services.odoo_service import OdooClient
+
+            self._client = OdooClient()
+        return self._client
+
+    async def _full(self) -> None:
+        # desde antes del fetch: lo que cambie durante la descarga tampoco se pierde
+        self._durante_armado = {}
+        try:
+            partners, hw = await capacity.run("odoo", _fetch, self._get_client(), None)
+            idx = await self._armar(partners)  # armado fuera del loop
+        finally:
+            self._durante_armado = None
+        self._idx, self._write_date = idx, hw
+        self._last_full = time.monotonic()
+        PARTNER_INDEX_SIZE.set(len(idx.docs))
+        log.info("Índice de partners cargado: %s partners", len(idx.docs))
+
+    async def _incremental(self) -> None:
+        desde = _menos(self._write_date, OVERLAP_S) if self._write_date else None
+        partners, hw = await capacity.run("odoo", _fetch, self._get_client(), desde)
+        if len(partners) > REBUILD_OVER:
+            # p.ej. una importación masiva: rearmar en un hilo en vez de miles de insort en el loop
+            cambios = {int(p["id"]): p for p in partners}
+            self._durante_armado = {}
+            try:
+                base = [p for p in self._idx.snapshot() if p["id"] not in cambios]
+                self._idx = await self._armar(base + list(cambios.values()))
+            finally:
+                self._durante_armado = None
+        else:
+            for i, p in enumerate(partners):
+                self._idx.upsert(p)
+                if i % 50 == 49:
+                    await asyncio.sleep(0)  # dejar pasar búsquedas entre tandas
+        if hw and (self._write_date is None or hw > self._write_date):
+            self._write_date = hw
+        PARTNER_INDEX_SIZE.set(len(self._idx.docs))
+
+    async def sync_once(self) -> bool:
+        full = self._idx is None or self._last_full is None or time.monotonic() - self._last_full > FULL_S
+        tipo = "full" if full else "incremental"
+        try:
+            await (self._full() if full else self._incremental())
+        except Exception as e:
+            self._last_error = str(e)
+            PARTNER_INDEX_SYNCS.labels(tipo, "error").inc()
+            log.warning("No se pudo sincronizar el índice de partners (%s): %s", tipo, e)
+            return False
+        self._last_sync = time.monotonic()
+        self._last_error = None
+        PARTNER_INDEX_SYNCS.labels(tipo, "ok").inc()
+        return True
+
+    async def _run(self) -> None:
+        from services import odoo_health
+
+        while True:
+            if odoo_health.monitor.disabled_reason:
+                log.info("Índice de partners apagado: %s", odoo_health.monitor.disabled_reason)
+                return
+            ok = await self.sync_once()
+            await asyncio.sleep(SYNC_S if ok else RETRY_S)
+
+    def start(self) -> None:
+        if ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def status(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "enabled": ENABLED,
+            "ready": self.ready,
+            "fresh": self.fresh,
+            "partners": len(self._idx.docs) if self._idx is not None else 0,
+            "write_date": self._write_date,
+            "seconds_since_sync": round(now - self._last_sync, 1) if self._last_sync else None,
+            "seconds_since_full": round(now - self._last_full, 1) if self._last_full else None,
+            "last_error": self._last_error,
+        }
+
+
+index = PartnerIndex()
+
+
+# =======================
+# Búsquedas reemplazadas
+# =======================
+
+class Superseded(Exception):
+    """La búsqueda se canceló porque llegó otra más nueva del mismo cuadro."""
+
+
+class BusquedasEnVuelo:
+    """Una búsqueda en vuelo por X-Search-Session: la nueva cancela a la anterior."""
+
+    def __init__(self):
+        self._tareas: Dict[str, asyncio.Task] = {}
+        self._reemplazadas: Set[asyncio.Task] = set()
+
+    async def correr(self, sesion: Optional[str], coro: Awaitable[Any]) -> Any:
+        if not sesion:
+            return await coro
+        prev = self._tareas.get(sesion)
+        if prev is not None and not prev.done():
+            self._reemplazadas.add(prev)
+            prev.cancel()
+            SEARCH_SUPERSEDED.inc()
+        task = asyncio.ensure_future(coro)
+        self._tareas[sesion] = task
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if task in self._reemplazadas:
+                raise Superseded()
+            raise
+        finally:
+            self._reemplazadas.discard(task)
+            if self._tareas.get(sesion) is task:
+                del self._tareas[sesion]
+
+
+en_vuelo = BusquedasEnVuelo()
@@ -0,0 +1,135 @@
+"""
+Posición en la cola por turno, para la app de pacientes ("sos el #7").
+
+Antes la única forma era bajar /turnos-espera/{sucursal_id} entera y contar en
+el celular: miles de teléfonos descargando la cola completa en cada refresco.
+Ahora:
+- GET /turnos-espera/{sucursal_id}/posicion/{turno_id} responde con la
+  lista ordenada del despacho (DispatchEngine.orden), sin query;
+- WS /ws/{sucursal_id}/posicion/{turno_id} recibe un mensaje solo cuando
+  cambia SU posición (o pasa a atención / sale de la cola), no con cada
+  evento de la sucursal.
+
+El motor avisa cada cambio con la clave más chica que cambió: los suscriptos
+que esperan adelante no se recalculan. Al resto se le recalcula la posición
+(bisect) y solo se publica si difiere de la última publicada. Como en el
+tablero, publish() no bloquea: cada suscriptor tiene su tarea de envío y, si
+se atrasa, solo queda pendiente el último estado.
+
+La sucursal va en la ruta para que el sharding lleve la consulta al worker
+dueño de la cola, igual que /ws/{sucursal_id}.
+"""
+
+import asyncio
+import json
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from services import metrics
+
+POSICION_SUBSCRIBERS = metrics.gauge(
+    "turnos_posicion_subscribers",
+    "WebSockets suscriptos a la posición de un turno",
+)
+POSICION_EVENTS = metrics.counter(
+    "turnos_posicion_events_total",
+    "Recálculos de posición por suscriptor: publicado (cambió) o sin_cambio",
+    ("outcome",),
+)
+
+
+def evento(sucursal_id: int, turno_id: int, pos: Optional[dict]) -> dict:
+    # estado "fuera": ya no está en la cola (finalizado, cancelado o de otra sucursal)
+    return {"type": "posicion", "sucursal_id": sucursal_id, "turno_id": turno_id, **(pos or {"estado": "fuera"})}
+
+
+def _firma(event: dict) -> Tuple:
+    return event["estado"], event.get("posicion"), event.get("consultorio")
+
+
+class PosicionSubscriber:
+    def __init__(self, websocket, sucursal_id: int, turno_id: int):
+        self.websocket = websocket
+        self.sucursal_id = sucursal_id
+        self.turno_id = turno_id
+        self._ultima: Optional[Tuple] = None
+        self._pending: Optional[dict] = None
+        self._wake = asyncio.Event()
+
+    def publish(self, event: dict) -> bool:
+        """Deja el evento pendiente si cambió algo para este turno. True si se publicó."""
+        firma = _firma(event)
+        if firma == self._ultima:
+            POSICION_EVENTS.labels("sin_cambio").inc()
+            return False
+        self._ultima = firma
+        self._pending = event  # si el anterior no salió todavía, se reemplaza
+        self._wake.set()
+        POSICION_EVENTS.labels("publicado").inc()
+        return True
+
+    async def run(self) -> None:
+        """Envía los pendientes al WS; si el turno salió de la cola, avisa y cierra."""
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            event, self._pending = self._pending, None
+            if event is None:
+                continue
+            await self.websocket.send_text(json.dumps(event, ensure_ascii=False))
+            if event["estado"] == "fuera":
+                await self.websocket.close(code=1000)
+                return
+
+
+class PosicionesHub:
+    """Suscriptores por (sucursal, turno), alimentados por los avisos del DispatchEngine."""
+
+    def __init__(self, engine):
+        self._engine = engine
+        self._subs: Dict[int, Dict[int, Set[PosicionSubscriber]]] = defaultdict(dict)
+        self._total = 0
+        engine.add_listener(self.on_cambio)
+
+    def add(self, sub: PosicionSubscriber) -> None:
+        self._subs[sub.sucursal_id].setdefault(sub.turno_id, set()).add(sub)
+        self._total += 1
+        POSICION_SUBSCRIBERS.set(self._total)
+
+    def remove(self, sub: PosicionSubscriber) -> None:
+        por_turno = self._subs.get(sub.sucursal_id)
+        subs = por_turno.get(sub.turno_id) if por_turno else None
+        if not subs or sub not in subs:
+            return
+        subs.discard(sub)
+        self._total -= 1
+        POSICION_SUBSCRIBERS.set(self._total)
+        if not subs:
+            del por_turno[sub.turno_id]
+            if not por_turno:
+                del self._subs[sub.sucursal_id]
+
+    def on_cambio(self, sucursal_id: int, desde: Optional[tuple]) -> None:
+        por_turno = self._subs.get(sucursal_id)
+        if not por_turno:
+            return
+        for turno_id, subs in por_turno.items():
+            clave = self._engine.clave(sucursal_id, turno_id)
+            if desde is not None and clave is not None and clave < desde:
+                continue  # espera adelante de lo que cambió: su posición es la misma
+            event = evento(sucursal_id, turno_id, self._engine.posicion_local(sucursal_id, turno_id))
+            for sub in subs:
+                sub.publish(event)
+
+    def sucursales(self) -> List[int]:
+        return list(self._subs.keys())
+
+    async def close_sucursal(self, sucursal_id: int, code: int = 1012) -> None:
+        """Cierra los suscriptores de una sucursal (reconectan solos)."""
+        subs = [s for por_turno in self._subs.get(sucursal_id, {}).values() for s in por_turno]
+        for sub in subs:
+            self.remove(sub)
+            try:
+                await sub.websocket.close(code=code)
+            except Exception:
+                pass
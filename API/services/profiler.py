@@ -0,0 +1,246 @@
+"""
+Profiler por muestreo, opcional, para requests lentos.
+
+Se activa con PROFILE_ENABLED=true; si no, el middleware ni se instala y los
+hooks (add_time) salen en la primera línea.
+
+Cómo funciona:
+  - Un hilo muestreador toma sys._current_frames() cada PROFILE_INTERVAL_MS,
+    SOLO mientras haya requests perfilados en vuelo, y guarda las pilas en un
+    buffer circular con timestamp.
+  - Cada request se perfila si cae en el muestreo (PROFILE_SAMPLE_RATE) o si
+    tarda más de PROFILE_SLOW_MS. Al terminar se extraen las muestras de su
+    ventana de tiempo y se escriben en formato "folded" (flamegraph.pl,
+    speedscope, inferno) + un .json con ruta, sucursal y desglose de tiempos.
+  - Se conservan como máximo PROFILE_MAX_FILES perfiles (los más viejos se borran).
+
+Con requests concurrentes, las pilas de otros requests pueden aparecer en la
+misma ventana: cada pila lleva el nombre del hilo como primer frame.
+"""
+
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Tuple
+
+import anyio
+
+log = logging.getLogger("uvicorn.error")
+
+
+def _env_bool(name: str, default: str = "false") -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes", "y", "on")
+
+
+ENABLED = _env_bool("PROFILE_ENABLED")
+SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "1000"))
+INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "profiles"))
+MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+
+# Desglose de tiempos del request en curso (lo llenan timed_db y el proxy de Odoo)
+_breakdown: ContextVar[Optional[Dict[str, float]]] = ContextVar("profile_breakdown", default=None)
+
+
+def add_time(kind: str, seconds: float) -> None:
+    if not ENABLED:
+        return
+    d = _breakdown.get()
+    if d is None:
+        return
+    d[f"{kind}_s"] = d.get(f"{kind}_s", 0.0) + seconds
+    d[f"{kind}_calls"] = d.get(f"{kind}_calls", 0) + 1
+
+
+# =======================
+# Muestreador
+# =======================
+
+# Hojas "ociosas": un hilo esperando trabajo no aporta nada al flame graph
+_IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+}
+
+
+class _Sampler:
+    def __init__(self, interval_s: float, maxlen: int = 200_000):
+        self.interval_s = interval_s
+        self._samples: Deque[Tuple[float, str]] = deque(maxlen=maxlen)
+        self._active = 0
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._names: Dict[object, str] = {}
+
+    def acquire(self) -> None:
+        with self._cond:
+            self._active += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def release(self) -> None:
+        with self._cond:
+            self._active -= 1
+
+    def _frame_name(self, code) -> str:
+        name = self._names.get(code)
+        if name is None:
+            name = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+            self._names[code] = name
+        return name
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while True:
+            with self._cond:
+                while self._active <= 0:
+                    self._cond.wait()
+            now = time.perf_counter()
+            thread_names = {t.ident: t.name for t in threading.enumerate()}
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES:
+                    continue
+                stack: List[str] = []
+                f = frame
+                while f is not None:
+                    stack.append(self._frame_name(f.f_code))
+                    f = f.f_back
+                stack.append(thread_names.get(tid, f"thread-{tid}"))
+                self._samples.append((now, ";".join(reversed(stack))))
+            time.sleep(self.interval_s)
+
+    def window(self, t0: float, t1: float) -> Dict[str, int]:
+        folded: Dict[str, int] = {}
+        for ts, stack in list(self._samples):
+            if t0 <= ts <= t1:
+                folded[stack] = folded.get(stack, 0) + 1
+        return folded
+
+
+_sampler = _Sampler(INTERVAL_MS / 1000.0)
+
+
+# =======================
+# Escritura con retención acotada
+# =======================
+
+_slug_re = re.compile(r"[^A-Za-z0-9_-]+")
+
+
+def _write_profile(meta: dict, folded: Dict[str, int]) -> None:
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    route = _slug_re.sub("_", meta["route"]).strip("_") or "root"
+    base = f"{time.strftime('%Y%m%d-%H%M%S')}_{int(meta['total_ms'])}ms_{route}_s{meta.get('sucursal_id') or 'na'}"
+    base = f"{base}_{random.randrange(16 ** 4):04x}"
+
+    with open(PROFILE_DIR / f"{base}.folded", "w", encoding="utf-8") as fh:
+        for stack, count in sorted(folded.items()):
+            fh.write(f"{stack} {count}\n")
+    with open(PROFILE_DIR / f"{base}.json", "w", encoding="utf-8") as fh:
+        json.dump(meta, fh, ensure_ascii=False, indent=2)
+
+    files = sorted(PROFILE_DIR.glob("*.folded"), key=lambda p: p.stat().st_mtime)
+    for old in files[: max(0, len(files) - MAX_FILES)]:
+        old.unlink(missing_ok=True)
+        old.with_suffix(".json").unlink(missing_ok=True)
+
+
+def _sucursal_from_scope(scope: dict) -> Optional[int]:
+    sid = (scope.get("path_params") or {}).get("sucursal_id")
+    if sid is not None:
+        return sid
+    # Rutas POST (crear-turno, etc.): la sucursal viene en el token de sesión
+    from services import auth_service as auth
+
+    for k, v in scope.get("headers") or []:
+        if k == b"authorization":
+            claims = auth.verify_token(auth.token_from_header(v.decode("latin-1")))
+            return claims["sid"] if claims else None
+    return None
+
+
+# Streams de larga vida (/sse/{sucursal_id}): se saltean también por content-type
+_SIN_PERFIL = ("/sse/",)
+
+
+class ProfilerMiddleware:
+    """Middleware ASGI: solo se instala con PROFILE_ENABLED=true."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path", "").startswith(_SIN_PERFIL):
+            await self.app(scope, receive, send)
+            return
+
+        sampled = SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+        breakdown: Dict[str, float] = {}
+        token = _breakdown.set(breakdown)
+        _sampler.acquire()
+        soltado = False
+
+        async def send_wrapper(message):
+            nonlocal soltado
+            if message["type"] == "http.response.start" and not soltado:
+                headers = dict(message.get("headers") or [])
+                if headers.get(b"content-type", b"").startswith(b"text/event-stream"):
+                    # stream que no termina: ni muestreador prendido ni perfil "lento" de horas
+                    soltado = True
+                    _sampler.release()
+            await send(message)
+
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            t1 = time.perf_counter()
+            if not soltado:
+                _sampler.release()
+            _breakdown.reset(token)
+
+        if soltado:
+            return
+        total_ms = (t1 - t0) * 1000.0
+        if not sampled and total_ms < SLOW_MS:
+            return
+
+        route = getattr(scope.get("route"), "path", None) or scope.get("path", "")
+        db_ms = breakdown.get("db_s", 0.0) * 1000.0
+        odoo_ms = breakdown.get("odoo_s", 0.0) * 1000.0
+        meta = {
+            "route": route,
+            "method": scope.get("method"),
+            "path": scope.get("path"),
+            "sucursal_id": _sucursal_from_scope(scope),
+            "reason": "sampled" if sampled else "slow",
+            "total_ms": round(total_ms, 3),
+            "db_ms": round(db_ms, 3),
+            "db_calls": int(breakdown.get("db_calls", 0)),
+            "odoo_ms": round(odoo_ms, 3),
+            "odoo_calls": int(breakdown.get("odoo_calls", 0)),
+            # resto: event loop, espera del thread pool, regex, JSON, red...
+            "other_ms": round(max(0.0, total_ms - db_ms - odoo_ms), 3),
+            "interval_ms": INTERVAL_MS,
+        }
+        folded = _sampler.window(t0, t1)
+        try:
+            await anyio.to_thread.run_sync(_write_profile, meta, folded)
+        except Exception:
+            log.exception("No se pudo escribir el perfil")
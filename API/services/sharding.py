@@ -0,0 +1,415 @@
+"""
+Modo "afinidad por sucursal": cada sucursal pertenece a UN worker, elegido por
+hashing consistente de sucursal_id. Así el fan-out de ConnectionManager y
+cualquier estado en memoria por sucursal viven en un solo proceso.
+
+Configuración (si SHARD_SELF no está definido, el modo está apagado):
+  SHARD_SELF          id de este worker, ej: "w1"
+  SHARD_WORKERS       "w1=http://10.0.0.5:8101,w2=http://10.0.0.6:8101"
+  SHARD_WORKERS_FILE  alternativa a SHARD_WORKERS: un "id=url" por línea; se
+                      relee cuando cambia (agregar/quitar workers sin reiniciar)
+  SHARD_VNODES        nodos virtuales por worker (default 128)
+  SHARD_SECRET        secreto compartido entre workers: firma el header
+                      X-Shard-Forwarded. Sin él, el header solo se acepta si
+                      el request viene de la IP de un worker del anillo.
+
+Lo ideal es que el balanceador ya enrute por sucursal (GET /shard/owner/{id}
+o el mismo hash); el middleware hace proxy de lo que llegue al worker
+equivocado, tanto HTTP como WebSocket.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import socket
+import time
+from bisect import bisect_right
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+import anyio
+
+from services import capacity
+
+log = logging.getLogger("uvicorn.error")
+
+FORWARD_HEADER = "x-shard-forwarded"
+SUCURSAL_HEADER = "x-sucursal-id"
+
+# Rutas con sucursal en el path
+_PATH_RE = re.compile(r"^/(?:ws|sse|turno-actual|turnos-espera|estadisticas|consultorios)/(\d+)(?:/|$)")
+# Rutas de escritura con sucursal/turno en el body JSON
+_BODY_SUCURSAL = {"/crear-turno", "/consultorios/llamar-siguiente"}
+_BODY_TURNO = {"/iniciar-turno", "/finalizar-turno"}
+
+_HOP_BY_HOP = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade", "host", "content-length",
+}
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.sha1(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    def __init__(self, nodes: Dict[str, str], vnodes: int = 128):
+        self.nodes = dict(nodes)
+        ring: List[Tuple[int, str]] = []
+        for node_id in self.nodes:
+            for v in range(vnodes):
+                ring.append((_hash(f"{node_id}#{v}"), node_id))
+        ring.sort()
+        self._keys = [h for h, _ in ring]
+        self._owners = [n for _, n in ring]
+
+    def owner(self, sucursal_id: int) -> str:
+        if not self._keys:
+            raise RuntimeError("Anillo de shards vacío")
+        i = bisect_right(self._keys, _hash(str(int(sucursal_id))))
+        return self._owners[i % len(self._owners)]
+
+
+def parse_workers(raw: str) -> Dict[str, str]:
+    out: Dict[str, str] = {}
+    for part in re.split(r"[,\n]", raw or ""):
+        part = part.strip()
+        if not part or part.startswith("#"):
+            continue
+        node_id, _, url = part.partition("=")
+        if node_id.strip() and url.strip():
+            out[node_id.strip()] = url.strip().rstrip("/")
+    return out
+
+
+def peer_hosts(workers: Dict[str, str]) -> Set[str]:
+    """IPs de los workers (resuelve nombres: bloquea, llamar fuera del event loop)."""
+    hosts: Set[str] = set()
+    for url in workers.values():
+        host = urlsplit(url).hostname
+        if not host:
+            continue
+        hosts.add(host)
+        try:
+            hosts.update(info[4][0] for info in socket.getaddrinfo(host, None))
+        except OSError:
+            pass
+    return hosts
+
+
+RebalanceListener = Callable[["ShardRouter"], Awaitable[None]]
+
+
+class ShardRouter:
+    def __init__(
+        self,
+        self_id: str,
+        workers: Dict[str, str],
+        workers_file: Optional[str],
+        vnodes: int,
+        secret: Optional[str] = None,
+        peers: Optional[Set[str]] = None,
+    ):
+        self.self_id = self_id
+        self.workers_file = workers_file
+        self.vnodes = vnodes
+        self._secret = secret.encode("utf-8") if secret else None
+        self._peers: Set[str] = peers if peers is not None else peer_hosts(workers)
+        self._file_mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._listeners: List[RebalanceListener] = []
+        self.ring = HashRing(workers, vnodes)
+
+    @property
+    def workers(self) -> Dict[str, str]:
+        return self.ring.nodes
+
+    def owner(self, sucursal_id: int) -> str:
+        return self.ring.owner(sucursal_id)
+
+    def is_local(self, sucursal_id: int) -> bool:
+        return self.owner(sucursal_id) == self.self_id
+
+    def owner_url(self, sucursal_id: int) -> str:
+        return self.workers[self.owner(sucursal_id)]
+
+    def add_listener(self, cb: RebalanceListener) -> None:
+        self._listeners.append(cb)
+
+    def _firma(self, worker_id: str) -> str:
+        return hmac.new(self._secret, worker_id.encode("utf-8"), hashlib.sha256).hexdigest()
+
+    def forward_value(self) -> str:
+        """Valor de X-Shard-Forwarded para los requests que este worker reenvía."""
+        if self._secret is None:
+            return self.self_id
+        return f"{self.self_id}:{self._firma(self.self_id)}"
+
+    def es_reenvio(self, value: Optional[str], client: Optional[Tuple[str, int]]) -> bool:
+        """¿El header viene de otro worker? Si no, un cliente podría saltarse el ruteo."""
+        if not value:
+            return False
+        if self._secret is not None:
+            worker_id, _, firma = value.partition(":")
+            return hmac.compare_digest(firma.encode("latin-1"), self._firma(worker_id).encode("latin-1"))
+        return bool(client) and client[0] in self._peers
+
+    def _leer_archivo(self) -> Optional[Tuple[Dict[str, str], Set[str]]]:
+        # corre en un hilo: stat, lectura y resolución de nombres bloquean
+        try:
+            mtime = os.stat(self.workers_file).st_mtime
+        except OSError:
+            return None
+        if mtime == self._file_mtime:
+            return None
+        self._file_mtime = mtime
+        with open(self.workers_file, encoding="utf-8") as fh:
+            workers = parse_workers(fh.read())
+        if not workers or workers == self.workers:
+            return None
+        return workers, peer_hosts(workers)
+
+    async def maybe_reload(self) -> None:
+        """Relee SHARD_WORKERS_FILE como mucho cada 2 s; si cambió, rearma el anillo."""
+        if not self.workers_file:
+            return
+        now = time.monotonic()
+        if now - self._checked_at < 2.0:
+            return
+        self._checked_at = now
+        nuevo = await anyio.to_thread.run_sync(self._leer_archivo)
+        if nuevo is None:
+            return
+        workers, self._peers = nuevo
+        log.info("Shards: nuevo anillo %s", sorted(workers))
+        self.ring = HashRing(workers, self.vnodes)
+        for cb in self._listeners:
+            asyncio.create_task(cb(self))
+
+
+def router_from_env() -> Optional[ShardRouter]:
+    self_id = (os.getenv("SHARD_SELF", "") or "").strip()
+    if not self_id:
+        return None
+    workers_file = (os.getenv("SHARD_WORKERS_FILE", "") or "").strip() or None
+    raw = os.getenv("SHARD_WORKERS", "")
+    if workers_file and os.path.exists(workers_file):
+        with open(workers_file, encoding="utf-8") as fh:
+            raw = fh.read()
+    workers = parse_workers(raw)
+    if self_id not in workers:
+        raise RuntimeError(f"SHARD_SELF={self_id} no está en la lista de workers")
+    secret = (os.getenv("SHARD_SECRET", "") or "").strip() or None
+    if secret is None:
+        log.warning("SHARD_SECRET no configurado: X-Shard-Forwarded solo se acepta desde las IPs de los workers")
+    return ShardRouter(self_id, workers, workers_file, int(os.getenv("SHARD_VNODES", "128")), secret)
+
+
+# =======================
+# Middleware de enrutamiento
+# =======================
+
+class ShardRouterMiddleware:
+    """
+    Resuelve la sucursal del request (path, header X-Sucursal-Id, token de
+    sesión, body de /crear-turno o turno_id -> DB) y, si no es de este worker,
+    hace proxy al dueño. Los requests ya reenviados por otro worker (header
+    firmado o IP del anillo) se sirven siempre local.
+    """
+
+    def __init__(
+        self,
+        app,
+        router: ShardRouter,
+        sucursal_de_turno: Callable[[int], Optional[int]],
+        sucursal_de_token: Callable[[Optional[str]], Optional[int]],
+    ):
+        self.app = app
+        self.router = router
+        self.sucursal_de_turno = sucursal_de_turno
+        self.sucursal_de_token = sucursal_de_token
+        self._client = None  # httpx.AsyncClient, se crea con el primer proxy
+
+    @staticmethod
+    def _header(scope, name: str) -> Optional[str]:
+        key = name.encode("latin-1")
+        for k, v in scope.get("headers") or []:
+            if k == key:
+                return v.decode("latin-1")
+        return None
+
+    async def _read_body(self, receive) -> Tuple[bytes, Callable]:
+        chunks = []
+        while True:
+            msg = await receive()
+            if msg["type"] != "http.request":
+                break
+            chunks.append(msg.get("body", b""))
+            if not msg.get("more_body"):
+                break
+        body = b"".join(chunks)
+        sent = False
+
+        async def replay():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        return body, replay
+
+    async def _resolve(self, scope, receive) -> Tuple[Optional[int], Callable, Optional[bytes]]:
+        path = scope.get("path", "")
+        m = _PATH_RE.match(path)
+        if m:
+            return int(m.group(1)), receive, None
+
+        if scope["type"] != "http" or (path not in _BODY_SUCURSAL and path not in _BODY_TURNO):
+            return None, receive, None
+
+        # Escrituras: header explícito > token de sesión > body
+        hdr = self._header(scope, SUCURSAL_HEADER)
+        if hdr and hdr.isdigit():
+            return int(hdr), receive, None
+
+        sid = self.sucursal_de_token(self._header(scope, "authorization"))
+        if sid is not None:
+            return sid, receive, None
+
+        body, receive = await self._read_body(receive)
+        try:
+            data = json.loads(body or b"{}")
+        except ValueError:
+            return None, receive, body
+        if not isinstance(data, dict):
+            return None, receive, body
+        if path in _BODY_SUCURSAL and isinstance(data.get("sucursal_id"), int):
+            return data["sucursal_id"], receive, body
+        if path in _BODY_TURNO and isinstance(data.get("turno_id"), int):
+            sid = await capacity.run("db", self.sucursal_de_turno, data["turno_id"])
+            return sid, receive, body
+        return None, receive, body
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        if self.router.es_reenvio(self._header(scope, FORWARD_HEADER), scope.get("client")):
+            await self.app(scope, receive, send)
+            return
+
+        await self.router.maybe_reload()
+        sid, receive, body = await self._resolve(scope, receive)
+        if sid is None or self.router.is_local(sid):
+            await self.app(scope, receive, send)
+            return
+
+        if scope["type"] == "http":
+            await self._proxy_http(scope, receive, send, self.router.owner_url(sid), body)
+        else:
+            await self._proxy_ws(scope, receive, send, self.router.owner_url(sid))
+
+    def _forward_headers(self, scope) -> List[Tuple[str, str]]:
+        headers = [
+            (k.decode("latin-1"), v.decode("latin-1"))
+            for k, v in scope.get("headers") or []
+            if k.decode("latin-1").lower() not in _HOP_BY_HOP
+            # httpx negocia y descomprime solo; el EncodingMiddleware de este worker re-comprime
+            and k.decode("latin-1").lower() != "accept-encoding"
+            and not k.decode("latin-1").lower().startswith("sec-websocket")
+            and k.decode("latin-1").lower() != FORWARD_HEADER
+        ]
+        headers.append((FORWARD_HEADER, self.router.forward_value()))
+        return headers
+
+    async def _proxy_http(self, scope, receive, send, base_url: str, body: Optional[bytes]):
+        import httpx  # solo se carga si este worker realmente hace proxy
+
+        if body is None:
+            body, _ = await self._read_body(receive)
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=30.0)
+
+        qs = scope.get("query_string", b"").decode("latin-1")
+        url = f"{base_url}{scope['path']}" + (f"?{qs}" if qs else "")
+        req = self._client.build_request(scope["method"], url, headers=self._forward_headers(scope), content=body)
+        try:
+            # en streaming: /sse/{id} es una respuesta que no termina
+            resp = await self._client.send(req, stream=True)
+        except httpx.HTTPError as e:
+            log.warning("Shard proxy a %s falló: %r", base_url, e)
+            payload = json.dumps({"detail": "Worker dueño de la sucursal no disponible"}).encode()
+            await send({"type": "http.response.start", "status": 503,
+                        "headers": [(b"content-type", b"application/json")]})
+            await send({"type": "http.response.body", "body": payload})
+            return
+
+        headers = [
+            (k.encode("latin-1"), v.encode("latin-1"))
+            for k, v in resp.headers.multi_items()
+            if k.lower() not in _HOP_BY_HOP and k.lower() != "content-encoding"
+        ]
+        try:
+            await send({"type": "http.response.start", "status": resp.status_code, "headers": headers})
+            async for chunk in resp.aiter_bytes():
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        except httpx.HTTPError as e:
+            # la respuesta ya empezó: solo se puede cortar
+            log.warning("Shard proxy a %s se cortó: %r", base_url, e)
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            await resp.aclose()
+
+    async def _proxy_ws(self, scope, receive, send, base_url: str):
+        from websockets.asyncio.client import connect as ws_connect
+
+        msg = await receive()
+        if msg["type"] != "websocket.connect":
+            return
+
+        qs = scope.get("query_string", b"").decode("latin-1")
+        url = base_url.replace("http", "ws", 1) + scope["path"] + (f"?{qs}" if qs else "")
+        try:
+            upstream = await ws_connect(url, additional_headers={FORWARD_HEADER: self.router.forward_value()})
+        except Exception as e:
+            log.warning("Shard proxy WS a %s falló: %r", url, e)
+            await send({"type": "websocket.close", "code": 1013})
+            return
+
+        await send({"type": "websocket.accept"})
+
+        async def client_to_upstream():
+            while True:
+                m = await receive()
+                if m["type"] == "websocket.disconnect":
+                    return
+                if m.get("text") is not None:
+                    await upstream.send(m["text"])
+                elif m.get("bytes") is not None:
+                    await upstream.send(m["bytes"])
+
+        async def upstream_to_client():
+            async for data in upstream:
+                if isinstance(data, str):
+                    await send({"type": "websocket.send", "text": data})
+                else:
+                    await send({"type": "websocket.send", "bytes": data})
+
+        tasks = [asyncio.create_task(client_to_upstream()), asyncio.create_task(upstream_to_client())]
+        try:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for t in pending:
+                t.cancel()
+        finally:
+            await upstream.close()
+            try:
+                # upstream cerró (p.ej. rebalanceo): el cliente debe reconectar
+                await send({"type": "websocket.close", "code": 1012})
+            except Exception:
+                pass
@@ -0,0 +1,153 @@
+"""
+Server-Sent Events por sucursal: GET /sse/{sucursal_id}.
+
+Para pantallas detrás de proxies que cortan WebSockets y hoy hacen polling de
+/turno-actual cada segundo. ConnectionManager.broadcast publica acá el mismo
+JSON que manda por WS, así que no hay queries extra por cliente.
+
+- Cada evento lleva id "<boot>:<seq>" (seq por sucursal). Con Last-Event-ID
+  (el navegador lo manda solo al reconectar) se reenvía lo que falte desde un
+  historial de SSE_REPLAY_EVENTS por sucursal. Si el id es de otro proceso o
+  ya salió del historial, se manda un snapshot nuevo.
+- Comentario de keep-alive cada SSE_KEEPALIVE_S para que los proxies no corten.
+- Buffer por cliente de SSE_CLIENT_BUFFER eventos. Si un cliente lento lo
+  llena, se le cierra el stream: reconecta con Last-Event-ID y se pone al día
+  con el historial o con un snapshot, sin que el servidor acumule memoria.
+"""
+
+import asyncio
+import json
+import os
+import secrets
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from services import metrics
+
+REPLAY_EVENTS = int(os.getenv("SSE_REPLAY_EVENTS", "64"))
+CLIENT_BUFFER = int(os.getenv("SSE_CLIENT_BUFFER", "32"))
+KEEPALIVE_S = float(os.getenv("SSE_KEEPALIVE_S", "15"))
+RETRY_MS = int(os.getenv("SSE_RETRY_MS", "3000"))
+
+# Distingue ids de otro proceso / reinicio: ahí no sirve el historial
+BOOT = secrets.token_hex(4)
+
+SSE_CONNECTIONS = metrics.gauge(
+    "turnos_sse_connections",
+    "Streams SSE abiertos por sucursal",
+    ("sucursal_id",),
+)
+SSE_RESUMES = metrics.counter(
+    "turnos_sse_resumes_total",
+    "Reconexiones con Last-Event-ID por resultado (replay, snapshot)",
+    ("outcome",),
+)
+SSE_OVERFLOWS = metrics.counter(
+    "turnos_sse_overflows_total",
+    "Streams cerrados por llenar su buffer (cliente lento)",
+)
+
+HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # nginx: no bufferizar el stream
+}
+
+
+def frame(event_id: str, event_type: str, data: str) -> bytes:
+    # data es JSON sin saltos de línea (json.dumps sin indent)
+    return f"id: {event_id}\nevent: {event_type}\ndata: {data}\n\n".encode("utf-8")
+
+
+class _Client:
+    __slots__ = ("buffer", "wake", "overflow")
+
+    def __init__(self):
+        self.buffer: Deque[bytes] = deque()
+        self.wake = asyncio.Event()
+        self.overflow = False
+
+    def push(self, data: bytes) -> None:
+        if len(self.buffer) >= CLIENT_BUFFER:
+            self.overflow = True
+        else:
+            self.buffer.append(data)
+        self.wake.set()
+
+
+class SseHub:
+    def __init__(self):
+        self._seq: Dict[int, int] = {}
+        self._history: Dict[int, Deque[Tuple[int, bytes]]] = {}
+        self._clients: Dict[int, Set[_Client]] = {}
+
+    def _id(self, sucursal_id: int) -> str:
+        return f"{BOOT}:{self._seq.get(sucursal_id, 0)}"
+
+    def publish(self, sucursal_id: int, event_type: str, data: str) -> None:
+        """Lo llama ConnectionManager.broadcast (event loop, sin locks)."""
+        seq = self._seq[sucursal_id] = self._seq.get(sucursal_id, 0) + 1
+        data_frame = frame(f"{BOOT}:{seq}", event_type, data)
+        hist = self._history.get(sucursal_id)
+        if hist is None:
+            hist = self._history[sucursal_id] = deque(maxlen=REPLAY_EVENTS)
+        hist.append((seq, data_frame))
+        for c in self._clients.get(sucursal_id, ()):
+            c.push(data_frame)
+
+    def _replay(self, sucursal_id: int, last_event_id: Optional[str]) -> Optional[List[bytes]]:
+        """Eventos posteriores a last_event_id, o None si hace falta snapshot."""
+        if not last_event_id:
+            return None
+        boot, _, raw_seq = last_event_id.partition(":")
+        if boot != BOOT or not raw_seq.isdigit():
+            SSE_RESUMES.labels("snapshot").inc()
+            return None
+        seq = int(raw_seq)
+        current = self._seq.get(sucursal_id, 0)
+        hist = self._history.get(sucursal_id) or deque()
+        if seq > current or (seq < current and (not hist or hist[0][0] > seq + 1)):
+            SSE_RESUMES.labels("snapshot").inc()
+            return None
+        SSE_RESUMES.labels("replay").inc()
+        return [f for s, f in hist if s > seq]
+
+    async def stream(
+        self,
+        sucursal_id: int,
+        last_event_id: Optional[str],
+        snapshot: Callable[[], Awaitable[dict]],
+    ) -> AsyncIterator[bytes]:
+        client = _Client()
+        # suscribir antes de armar el snapshot: lo que pase mientras tanto queda en el buffer
+        clients = self._clients.setdefault(sucursal_id, set())
+        clients.add(client)
+        SSE_CONNECTIONS.set_or_remove(len(clients), sucursal_id)
+        try:
+            yield f"retry: {RETRY_MS}\n\n".encode("utf-8")
+            pending = self._replay(sucursal_id, last_event_id)
+            if pending is None:
+                snap_id = self._id(sucursal_id)
+                payload = await snapshot()
+                pending = [frame(snap_id, payload.get("type", "message"), json.dumps(payload, ensure_ascii=False))]
+            for data in pending:
+                yield data
+
+            while not client.overflow:
+                try:
+                    await asyncio.wait_for(client.wake.wait(), KEEPALIVE_S)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                client.wake.clear()
+                while client.buffer:
+                    yield client.buffer.popleft()
+            # lo que entró al buffer ya salió; el resto lo recupera con Last-Event-ID
+            SSE_OVERFLOWS.inc()
+        finally:
+            clients.discard(client)
+            SSE_CONNECTIONS.set_or_remove(len(clients), sucursal_id)
+            if not clients:
+                self._clients.pop(sucursal_id, None)
+
+
+hub = SseHub()
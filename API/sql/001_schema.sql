@@ -0,0 +1,37 @@
+-- Esquema base de turnos_db (el mismo que usa API/main.py).
+-- Sirve para levantar entornos locales, load tests y la suite de planes.
+
+CREATE TABLE IF NOT EXISTS sucursales (
+    id              SERIAL PRIMARY KEY,
+    nombre          TEXT NOT NULL,
+    doctor_nombre   TEXT,
+    username        TEXT NOT NULL UNIQUE,
+    password_hash   TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS turnos (
+    id               BIGSERIAL PRIMARY KEY,
+    sucursal_id      INTEGER NOT NULL REFERENCES sucursales (id),
+    nombre           TEXT NOT NULL,
+    edad             INTEGER,
+    telefono         TEXT,
+    estado           TEXT NOT NULL DEFAULT 'espera'
+                     CHECK (estado IN ('espera', 'atendiendo', 'finalizado')),
+    created_at       TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    inicio_atencion  TIMESTAMPTZ,
+    updated_at       TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Cola viva por sucursal (espera / atendiendo), en orden de llegada
+CREATE INDEX IF NOT EXISTS turnos_activos_idx
+    ON turnos (sucursal_id, created_at)
+    WHERE estado IN ('espera', 'atendiendo');
+
+-- Chequeo de duplicados en db_crear_turno_seguro
+CREATE INDEX IF NOT EXISTS turnos_activos_telefono_idx
+    ON turnos (sucursal_id, telefono)
+    WHERE estado IN ('espera', 'atendiendo');
+
+-- Estadísticas por día
+CREATE INDEX IF NOT EXISTS turnos_sucursal_created_idx
+    ON turnos (sucursal_id, created_at);
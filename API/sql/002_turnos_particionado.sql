@@ -0,0 +1,97 @@
+-- Particionado mensual de turnos por created_at.
+--
+-- Convierte la tabla existente (001_schema.sql) en una tabla particionada por
+-- RANGE(created_at), una partición por mes (turnos_yYYYYmMM), y copia los datos.
+-- Las particiones viejas se archivan/desprenden con jobs/particiones.py.
+--
+-- Correr en una ventana de mantenimiento: bloquea turnos mientras copia.
+--   psql -d turnos_db -v ON_ERROR_STOP=1 -f sql/002_turnos_particionado.sql
+
+BEGIN;
+
+-- Crea (si falta) la partición del mes que contiene `mes`, con sus índices
+-- nombrados <partición>_<sufijo> para que los planes sean fáciles de leer.
+CREATE OR REPLACE FUNCTION turnos_crear_particion(mes date) RETURNS text
+LANGUAGE plpgsql AS $$
+DECLARE
+    desde date := date_trunc('month', mes)::date;
+    hasta date := (date_trunc('month', mes) + interval '1 month')::date;
+    nombre text := format('turnos_y%sm%s', to_char(desde, 'YYYY'), to_char(desde, 'MM'));
+BEGIN
+    IF to_regclass(nombre) IS NOT NULL THEN
+        RETURN nombre;
+    END IF;
+
+    EXECUTE format('CREATE TABLE %I (LIKE turnos INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', nombre);
+    EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I PRIMARY KEY (id, created_at)', nombre, nombre || '_pkey');
+    EXECUTE format(
+        'CREATE INDEX %I ON %I (sucursal_id, created_at) WHERE estado IN (''espera'', ''atendiendo'')',
+        nombre || '_activos_idx', nombre);
+    EXECUTE format(
+        'CREATE INDEX %I ON %I (sucursal_id, telefono) WHERE estado IN (''espera'', ''atendiendo'')',
+        nombre || '_activos_telefono_idx', nombre);
+    EXECUTE format('CREATE INDEX %I ON %I (sucursal_id, created_at)', nombre || '_sucursal_created_idx', nombre);
+    EXECUTE format(
+        'ALTER TABLE turnos ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        nombre, desde, hasta);
+    RETURN nombre;
+END;
+$$;
+
+-- Asegura particiones desde `desde` hasta `hasta` (inclusive, por mes)
+CREATE OR REPLACE FUNCTION turnos_asegurar_particiones(desde date, hasta date) RETURNS integer
+LANGUAGE plpgsql AS $$
+DECLARE
+    mes date := date_trunc('month', desde)::date;
+    n integer := 0;
+BEGIN
+    WHILE mes <= hasta LOOP
+        PERFORM turnos_crear_particion(mes);
+        mes := (mes + interval '1 month')::date;
+        n := n + 1;
+    END LOOP;
+    RETURN n;
+END;
+$$;
+
+ALTER TABLE turnos RENAME TO turnos_legacy;
+ALTER INDEX IF EXISTS turnos_pkey RENAME TO turnos_legacy_pkey;
+ALTER INDEX IF EXISTS turnos_activos_idx RENAME TO turnos_legacy_activos_idx;
+ALTER INDEX IF EXISTS turnos_activos_telefono_idx RENAME TO turnos_legacy_activos_telefono_idx;
+ALTER INDEX IF EXISTS turnos_sucursal_created_idx RENAME TO turnos_legacy_sucursal_created_idx;
+
+CREATE TABLE turnos (
+    LIKE turnos_legacy INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+    PRIMARY KEY (id, created_at),
+    FOREIGN KEY (sucursal_id) REFERENCES sucursales (id)
+) PARTITION BY RANGE (created_at);
+
+-- La secuencia de ids pasa a ser de la tabla nueva (si no, DROP turnos_legacy la borra)
+ALTER SEQUENCE turnos_id_seq OWNED BY turnos.id;
+
+CREATE INDEX turnos_activos_idx
+    ON turnos (sucursal_id, created_at)
+    WHERE estado IN ('espera', 'atendiendo');
+CREATE INDEX turnos_activos_telefono_idx
+    ON turnos (sucursal_id, telefono)
+    WHERE estado IN ('espera', 'atendiendo');
+CREATE INDEX turnos_sucursal_created_idx
+    ON turnos (sucursal_id, created_at);
+
+-- Red de seguridad: si el job no creó el mes a tiempo, los INSERT no fallan.
+-- jobs/particiones.py avisa si esta partición tiene filas.
+CREATE TABLE turnos_default PARTITION OF turnos DEFAULT;
+
+SELECT turnos_asegurar_particiones(
+    COALESCE((SELECT min(created_at) FROM turnos_legacy), NOW())::date,
+    (NOW() + interval '3 months')::date
+);
+
+INSERT INTO turnos SELECT * FROM turnos_legacy;
+
+COMMIT;
+
+ANALYZE turnos;
+
+-- Verificado el cambio, se puede borrar la tabla vieja:
+--   DROP TABLE turnos_legacy;
@@ -0,0 +1,92 @@
+-- Regla "un turno activo por paciente y sucursal" como restricción única,
+-- y registro de Idempotency-Key para /crear-turno.
+--
+-- turnos puede estar particionada (002): un índice único ahí tendría que
+-- incluir created_at y no garantizaría nada entre meses. Por eso la regla
+-- vive en turnos_activos, una tabla chica (solo turnos en espera/atendiendo)
+-- cuya PK hace de índice único parcial global. La mantiene un trigger sobre
+-- turnos, así que vale para cualquier camino de escritura (API, SQL a mano).
+--
+-- Clave del paciente: el teléfono tal cual si viene; si no, el nombre.
+--
+-- Un turno activo más viejo que turnos.ventana_activos_dias (default 7, debe
+-- coincidir con TURNOS_VENTANA_ACTIVOS_DIAS de la API) se considera abandonado:
+-- no bloquea un turno nuevo del mismo paciente.
+--   ALTER DATABASE turnos_db SET turnos.ventana_activos_dias = '7';
+--
+--   psql -d turnos_db -v ON_ERROR_STOP=1 -f sql/003_turnos_activos_idempotencia.sql
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION turno_clave(telefono text, nombre text) RETURNS text
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT CASE WHEN telefono IS NOT NULL THEN 't:' || telefono ELSE 'n:' || nombre END
+$$;
+
+CREATE TABLE IF NOT EXISTS turnos_activos (
+    sucursal_id  INTEGER NOT NULL,
+    clave        TEXT NOT NULL,
+    turno_id     BIGINT NOT NULL,
+    created_at   TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (sucursal_id, clave)
+);
+CREATE INDEX IF NOT EXISTS turnos_activos_turno_idx ON turnos_activos (turno_id);
+
+CREATE OR REPLACE FUNCTION turnos_activos_sync() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    ventana interval := make_interval(
+        days => COALESCE(NULLIF(current_setting('turnos.ventana_activos_dias', true), ''), '7')::int);
+BEGIN
+    IF TG_OP = 'UPDATE'
+       AND OLD.estado IN ('espera', 'atendiendo') AND NEW.estado IN ('espera', 'atendiendo')
+       AND OLD.sucursal_id = NEW.sucursal_id
+       AND turno_clave(OLD.telefono, OLD.nombre) = turno_clave(NEW.telefono, NEW.nombre) THEN
+        RETURN NULL;  -- espera -> atendiendo: la clave no cambia
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.estado IN ('espera', 'atendiendo') THEN
+        DELETE FROM turnos_activos WHERE turno_id = OLD.id;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.estado IN ('espera', 'atendiendo') THEN
+        INSERT INTO turnos_activos (sucursal_id, clave, turno_id, created_at)
+        VALUES (NEW.sucursal_id, turno_clave(NEW.telefono, NEW.nombre), NEW.id, NEW.created_at)
+        ON CONFLICT (sucursal_id, clave) DO UPDATE
+            SET turno_id = EXCLUDED.turno_id, created_at = EXCLUDED.created_at
+            WHERE turnos_activos.created_at < NOW() - ventana;
+        IF NOT FOUND THEN
+            RAISE EXCEPTION 'El paciente ya tiene un turno activo en la sucursal %', NEW.sucursal_id
+                USING ERRCODE = 'unique_violation', CONSTRAINT = 'turnos_activos_pkey';
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS turnos_activos_sync ON turnos;
+CREATE TRIGGER turnos_activos_sync
+    AFTER INSERT OR DELETE OR UPDATE OF estado, sucursal_id, telefono, nombre ON turnos
+    FOR EACH ROW EXECUTE FUNCTION turnos_activos_sync();
+
+-- Backfill: si ya hay duplicados activos, gana el más viejo
+INSERT INTO turnos_activos (sucursal_id, clave, turno_id, created_at)
+SELECT sucursal_id, turno_clave(telefono, nombre), id, created_at
+FROM turnos
+WHERE estado IN ('espera', 'atendiendo')
+ORDER BY id
+ON CONFLICT (sucursal_id, clave) DO NOTHING;
+
+-- Respuestas de /crear-turno por Idempotency-Key (jobs/idempotencia.py borra las viejas)
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    sucursal_id   INTEGER NOT NULL,
+    key           TEXT NOT NULL,
+    request_hash  TEXT NOT NULL,
+    status_code   INTEGER,
+    response      JSONB,
+    created_at    TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (sucursal_id, key)
+);
+CREATE INDEX IF NOT EXISTS idempotency_keys_created_idx ON idempotency_keys (created_at);
+
+COMMIT;
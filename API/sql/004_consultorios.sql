@@ -0,0 +1,76 @@
+-- Varios consultorios por sucursal atendiendo en paralelo (services/dispatch.py).
+--
+-- turnos.prioridad: 0 urgente, 1 preferente, 2 normal (default). La cola se
+-- ordena por prioridad y después por llegada.
+-- turnos.consultorio: dónde se atendió (NULL = flujo de un solo consultorio).
+--
+-- consultorios.turno_id es el turno en atención (NULL = libre). Ocuparlo es un
+-- UPDATE ... WHERE turno_id IS NULL: el lock de la fila hace atómico el
+-- "reclamo" aunque dos requests llamen al mismo consultorio a la vez. Un
+-- trigger lo libera cuando su turno deja 'atendiendo', por cualquier camino.
+--
+--   psql -d turnos_db -v ON_ERROR_STOP=1 -f sql/004_consultorios.sql
+
+BEGIN;
+
+ALTER TABLE turnos ADD COLUMN IF NOT EXISTS prioridad SMALLINT NOT NULL DEFAULT 2;
+ALTER TABLE turnos ADD COLUMN IF NOT EXISTS consultorio INTEGER;
+
+-- Próximo en espera por prioridad (TURNO_ACTUAL, despacho)
+CREATE INDEX IF NOT EXISTS turnos_espera_prioridad_idx
+    ON turnos (sucursal_id, prioridad, created_at)
+    WHERE estado = 'espera';
+
+CREATE TABLE IF NOT EXISTS consultorios (
+    sucursal_id  INTEGER NOT NULL REFERENCES sucursales (id),
+    numero       INTEGER NOT NULL,
+    nombre       TEXT,
+    activo       BOOLEAN NOT NULL DEFAULT TRUE,
+    turno_id     BIGINT,
+    updated_at   TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (sucursal_id, numero)
+);
+-- Un turno se atiende en un solo consultorio
+CREATE UNIQUE INDEX IF NOT EXISTS consultorios_turno_idx
+    ON consultorios (turno_id) WHERE turno_id IS NOT NULL;
+
+CREATE OR REPLACE FUNCTION consultorios_liberar() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND NEW.estado = 'atendiendo' THEN
+        RETURN NULL;
+    END IF;
+    UPDATE consultorios SET turno_id = NULL, updated_at = NOW()
+    WHERE sucursal_id = OLD.sucursal_id AND turno_id = OLD.id;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS consultorios_liberar ON turnos;
+CREATE TRIGGER consultorios_liberar
+    AFTER DELETE OR UPDATE OF estado ON turnos
+    FOR EACH ROW WHEN (OLD.estado = 'atendiendo')
+    EXECUTE FUNCTION consultorios_liberar();
+
+-- Un consultorio por sucursal existente: el comportamiento de siempre
+INSERT INTO consultorios (sucursal_id, numero, nombre)
+SELECT id, 1, 'Consultorio 1' FROM sucursales
+ON CONFLICT (sucursal_id, numero) DO NOTHING;
+
+-- Si ya había alguien en atención, queda en el consultorio 1
+UPDATE consultorios c
+SET turno_id = t.id
+FROM (
+    SELECT DISTINCT ON (sucursal_id) id, sucursal_id
+    FROM turnos
+    WHERE estado = 'atendiendo'
+    ORDER BY sucursal_id, inicio_atencion DESC NULLS LAST
+) t
+WHERE c.sucursal_id = t.sucursal_id AND c.numero = 1 AND c.turno_id IS NULL;
+
+UPDATE turnos t
+SET consultorio = c.numero
+FROM consultorios c
+WHERE c.turno_id = t.id AND t.consultorio IS NULL;
+
+COMMIT;